@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+""" AMBER ASCII trajectory (mdcrd) reader.
+
+	The coordinates of each frame are written as 10F8.3 records,
+	optionally followed by a line of the 3 box lengths. The file does
+	not store the no. of atoms, it has to come from the PARM7 file.
+	Frames are read one at a time, so memory stays at a single frame.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import numpy as np
+
+import amber_parm7
+
+# 10F8.3
+WIDTH = 8
+DECIMALS = 3
+PER_LINE = 10
+
+
+def _snapshot(title, no_atoms, coordinates, box):
+	""" A frame as a dictionary like amber_parm7.load_rst7 """
+	return {
+		'title': title,
+		'no_atoms': no_atoms,
+		'time': None,
+		'temp': None,
+		'coordinates': coordinates.reshape(no_atoms, 3),
+		'velocities': None,
+		'box': box,
+		'angles': None,
+	}
+
+
+def _decode(data):
+	buf = np.frombuffer(data, dtype=np.uint8)
+	return amber_parm7.decode_rst7_block(buf, WIDTH, DECIMALS)
+
+
+def _overflow(coordinates, frame, mdcrd_file):
+	""" Warn of the coordinates too wide for the 10F8.3 fields """
+	count = np.count_nonzero(np.isnan(coordinates))
+	if count:
+		print('-- Warning: MDCRD frame %d of %s has %d overflow (********) coordinates, set to NaN.'
+			%(frame, mdcrd_file, count))
+
+
+def frames(mdcrd_file, no_atoms, box=None):
+	""" Iterate over the frames of an ASCII AMBER trajectory, yielding
+		a dictionary per frame with the title, no_atoms, coordinates
+		(N, 3) and box, see amber_parm7.load_rst7(). no_atoms is taken
+		from the PARM7 file, e.g. MOL['no_atoms']. Whether the frames
+		have a box line is detected from the first frame, unless box
+		is given as True or False. """
+
+	no_lines = -(-no_atoms * 3 // PER_LINE)
+
+	with open(mdcrd_file, 'rb') as fp:
+		title = fp.readline().decode('latin-1').strip()
+
+		# bytes per frame, known after reading the first one
+		frame_size = None
+		no_frames = 0
+
+		while True:
+			start = fp.tell()
+
+			if frame_size is not None:
+				# all the frames have the same layout, read at once
+				data = fp.read(frame_size)
+				if len(data) == 0:
+					return
+
+				if len(data) == frame_size and data.endswith(b'\n') and data.count(b'\n') == no_lines + bool(box):
+					if box:
+						coordinates = _decode(data[:data.rindex(b'\n', 0, -1) + 1])
+						frame_box = _decode(data[data.rindex(b'\n', 0, -1) + 1:])
+					else:
+						coordinates = _decode(data)
+						frame_box = None
+
+					if len(coordinates) == no_atoms * 3:
+						no_frames += 1
+						_overflow(coordinates, no_frames, mdcrd_file)
+						yield _snapshot(title, no_atoms, coordinates, frame_box)
+						continue
+
+				# a different layout, read the frame line by line
+				fp.seek(start)
+
+			lines = []
+			for i in range(no_lines):
+				line = fp.readline()
+				if len(line.strip()) == 0:
+					break
+				lines.append(line)
+
+			if len(lines) == 0:
+				return
+
+			if len(lines) < no_lines:
+				print('-- Error: Incomplete frame %d in %s, %d of %d lines.'
+					%(no_frames + 1, mdcrd_file, len(lines), no_lines))
+				return
+
+			data = b''.join(lines)
+			coordinates = _decode(data)
+
+			if len(coordinates) != no_atoms * 3:
+				print('-- Error: MDCRD frame %d has %d coordinates, expected %d. Wrong no. of atoms?'
+					%(no_frames + 1, len(coordinates), no_atoms * 3))
+				return
+
+			# optional box line
+			frame_box = None
+
+			if box is not False:
+				mark = fp.tell()
+				line = fp.readline()
+				items = line.split()
+
+				# a single atom frame also has 3 items
+				if len(items) == 3 and (box or no_atoms > 1):
+					frame_box = _decode(line)
+					data += line
+				else:
+					fp.seek(mark)
+
+			if frame_size is None:
+				box = frame_box is not None
+				frame_size = len(data)
+
+			no_frames += 1
+			_overflow(coordinates, no_frames, mdcrd_file)
+			yield _snapshot(title, no_atoms, coordinates, frame_box)
+
+
+def load(mdcrd_file, no_atoms, frame=0):
+	""" Read a single frame of an ASCII AMBER trajectory,
+		None if there are not enough frames. """
+
+	for i, snapshot in enumerate(frames(mdcrd_file, no_atoms)):
+		if i == frame:
+			return snapshot
+
+	print('-- Error: frame %d not found in %s' %(frame, mdcrd_file))
+	return None
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+""" AMBER NetCDF restart and trajectory reader.
+
+	A small pure python reader of the NetCDF3 classic and 64-bit
+	offset formats, the variables are memory mapped as numpy arrays.
+	See https://ambermd.org/netcdf/nctraj.xhtml for the conventions.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import mmap
+import struct
+
+import numpy as np
+
+# NetCDF3 header tags
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# NetCDF3 external types, all big endian
+nc_types = {
+	1: np.dtype('>i1'),		# byte
+	2: np.dtype('S1'),		# char
+	3: np.dtype('>i2'),		# short
+	4: np.dtype('>i4'),		# int
+	5: np.dtype('>f4'),		# float
+	6: np.dtype('>f8'),		# double
+}
+
+# numrecs value of a file being written in streaming mode
+STREAMING = 0xFFFFFFFF
+
+
+def is_netcdf(path):
+	""" Check the magic bytes of a file for a NetCDF3 file """
+	with open(path, 'rb') as fp:
+		return fp.read(3) == b'CDF'
+
+
+class NetCDF(object):
+	""" Read only NetCDF3 file. The header is parsed on open,
+		variables are read as numpy views of the memory map. """
+
+	def __init__(self, path):
+		self.path = path
+		self.fp = open(path, 'rb')
+		self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+		self.pos = 0
+
+		self.dimensions = {}		# name: length, None for the record dimension
+		self.attributes = {}		# global attributes
+		self.variables = {}			# name: header info of the variable
+		self.record_dim = None
+
+		self._read_header()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.mm.close()
+		self.fp.close()
+
+	# header parsing
+	# -----------------------------------------------------------------
+	def _unpack(self, fmt):
+		values = struct.unpack_from(fmt, self.mm, self.pos)
+		self.pos += struct.calcsize(fmt)
+		return values if len(values) > 1 else values[0]
+
+	def _padded(self, size):
+		# all header items are padded to 4 bytes
+		data = self.mm[self.pos:self.pos + size]
+		self.pos += size + (-size % 4)
+		return data
+
+	def _name(self):
+		return self._padded(self._unpack('>i')).decode('utf-8')
+
+	def _list(self, tag):
+		found, count = self._unpack('>ii')
+		if found not in (0, tag):
+			raise ValueError('invalid NetCDF header in %s' %self.path)
+		return count
+
+	def _attributes(self):
+		attributes = {}
+		for i in range(self._list(NC_ATTRIBUTE)):
+			name = self._name()
+			dtype = nc_types[self._unpack('>i')]
+			count = self._unpack('>i')
+			data = self._padded(count * dtype.itemsize)
+
+			if dtype.char == 'S':
+				value = data.rstrip(b'\x00').decode('utf-8')
+			else:
+				value = np.frombuffer(data, dtype=dtype).astype(dtype.newbyteorder('='))
+				if len(value) == 1:
+					value = value.item()
+			attributes[name] = value
+
+		return attributes
+
+	def _read_header(self):
+		magic = self.mm[:4]
+		if magic[:3] != b'CDF' or magic[3] not in (1, 2):
+			raise ValueError('%s is not a NetCDF3 classic or 64-bit offset file' %self.path)
+
+		# 64-bit offset files use 8 byte variable offsets
+		offset_fmt = '>q' if magic[3] == 2 else '>i'
+		self.pos = 4
+
+		self.numrecs = self._unpack('>I')
+
+		dim_names = []
+		for i in range(self._list(NC_DIMENSION)):
+			name = self._name()
+			length = self._unpack('>i')
+			if length == 0:
+				self.record_dim = name
+				length = None
+			self.dimensions[name] = length
+			dim_names.append(name)
+
+		self.attributes = self._attributes()
+
+		for i in range(self._list(NC_VARIABLE)):
+			name = self._name()
+			dims = [dim_names[self._unpack('>i')] for j in range(self._unpack('>i'))]
+			attributes = self._attributes()
+			dtype = nc_types[self._unpack('>i')]
+			vsize = self._unpack('>i')
+			begin = self._unpack(offset_fmt)
+
+			self.variables[name] = {
+				'dimensions': dims,
+				'attributes': attributes,
+				'dtype': dtype,
+				'vsize': vsize,
+				'begin': begin,
+				'record': len(dims) > 0 and dims[0] == self.record_dim,
+			}
+
+		# each record holds a slab of all the record variables
+		records = [v for v in self.variables.values() if v['record']]
+		if len(records) == 1:
+			# a single record variable is not padded
+			v = records[0]
+			self.record_size = int(np.prod(self._shape(v)[1:], dtype=np.int64)) * v['dtype'].itemsize
+		else:
+			self.record_size = sum(v['vsize'] for v in records)
+
+		if self.numrecs == STREAMING:
+			# count the complete records written so far
+			if records and self.record_size:
+				start = min(v['begin'] for v in records)
+				self.numrecs = (len(self.mm) - start) // self.record_size
+			else:
+				self.numrecs = 0
+
+	# data access
+	# -----------------------------------------------------------------
+	def _shape(self, var):
+		return [self.numrecs if d == self.record_dim else self.dimensions[d] for d in var['dimensions']]
+
+	@property
+	def no_records(self):
+		return self.numrecs
+
+	def has(self, name):
+		return name in self.variables
+
+	def shape(self, name):
+		return tuple(self._shape(self.variables[name]))
+
+	def read(self, name, record=None):
+		""" Read a variable as a native endian numpy array.
+			For record variables, a single record can be selected,
+			otherwise all the records are stacked. """
+
+		var = self.variables[name]
+		shape = self._shape(var)
+		dtype = var['dtype']
+
+		if var['dtype'].char == 'S':
+			count = int(np.prod(shape, dtype=np.int64))
+			data = np.frombuffer(self.mm, dtype=dtype, count=count, offset=var['begin'])
+			return b''.join(data.tolist()).rstrip(b'\x00').decode('utf-8')
+
+		if not var['record']:
+			count = int(np.prod(shape, dtype=np.int64))
+			data = np.frombuffer(self.mm, dtype=dtype, count=count, offset=var['begin'])
+			return data.reshape(shape).astype(dtype.newbyteorder('='))
+
+		if record is not None:
+			if record < 0:
+				record += self.numrecs
+			if not 0 <= record < self.numrecs:
+				raise IndexError('record %d out of range of %d records' %(record, self.numrecs))
+
+			count = int(np.prod(shape[1:], dtype=np.int64))
+			offset = var['begin'] + record * self.record_size
+			data = np.frombuffer(self.mm, dtype=dtype, count=count, offset=offset)
+			return data.reshape(shape[1:]).astype(dtype.newbyteorder('='))
+
+		return np.stack([self.read(name, i) for i in range(self.numrecs)])
+
+
+def _snapshot(nc, frame):
+	""" Read the coordinates, velocities and box of a single frame
+		(None for restarts) into a dictionary like amber_parm7.load_rst7 """
+
+	def get(name):
+		if not nc.has(name):
+			return None
+		if nc.variables[name]['record']:
+			return nc.read(name, frame).astype(np.float64)
+		return nc.read(name).astype(np.float64)
+
+	rst = {
+		'title': nc.attributes.get('title', None),
+		'no_atoms': nc.dimensions.get('atom', 0),
+		'time': None,
+		'temp': None,
+		'coordinates': get('coordinates'),
+		# stored in the same internal units as the ASCII restart,
+		# multiply by the scale_factor attribute to get angstrom/ps
+		'velocities': get('velocities'),
+		'box': get('cell_lengths'),
+		'angles': get('cell_angles'),
+	}
+
+	time = get('time')
+	if time is not None:
+		rst['time'] = float(np.ravel(time)[0])
+
+	temp = get('temp0')
+	if temp is not None:
+		rst['temp'] = float(np.ravel(temp)[0])
+
+	return rst
+
+
+def load(nc_file, frame=0):
+	""" Read a single frame of an AMBER NetCDF restart or trajectory.
+		Returns a dictionary of the title, no_atoms, time, temp,
+		coordinates (N, 3) and velocities (N, 3) arrays, box and
+		angles. Missing items are None. """
+
+	with NetCDF(nc_file) as nc:
+		if nc.attributes.get('Conventions', '') not in ('AMBER', 'AMBERRESTART'):
+			print('-- Warning: %s does not follow the AMBER NetCDF conventions.' %nc_file)
+
+		if nc.record_dim is None:
+			frame = None
+
+		return _snapshot(nc, frame)
+
+
+def frames(nc_file):
+	""" Iterate over the frames of an AMBER NetCDF trajectory,
+		yielding one dictionary per frame, see load(). """
+
+	with NetCDF(nc_file) as nc:
+		if nc.record_dim is None:
+			yield _snapshot(nc, None)
+			return
+
+		for i in range(nc.no_records):
+			yield _snapshot(nc, i)
@@ -5,7 +5,14 @@
 	This file is a part of OpenMOL python module.
 	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
 
+import mmap
+import os
+import re
+
+import numpy as np
+
 import openmol
+import amber_netcdf
 
 # AMBER PARM7 pointers list
 # See http://ambermd.org/formats.html
@@ -19,6 +26,98 @@ pointers = [
 	'NUMEXTRA', 'NCOPY'
 ]
 
+# Force field sections stored as they are
+ff_sections = {
+	'BOND_FORCE_CONSTANT': 		'FF_bond_k',
+	'BOND_EQUIL_VALUE': 		'FF_bond_eq',
+	'ANGLE_FORCE_CONSTANT': 	'FF_angle_k',
+	'ANGLE_EQUIL_VALUE': 		'FF_angle_eq',
+	'DIHEDRAL_FORCE_CONSTANT': 	'FF_dihed_k',
+	'DIHEDRAL_PERIODICITY': 	'FF_dihed_periodicity',
+	'DIHEDRAL_PHASE': 			'FF_dihed_phase',
+	'LENNARD_JONES_ACOEF': 		'parm7_lj_acoeff',
+	'LENNARD_JONES_BCOEF': 		'parm7_lj_bcoeff',
+}
+
+# No. of items in each record of the bonded sections,
+# these are stored chunk by chunk while being read
+record_sizes = {
+	'BONDS_INC_HYDROGEN': 3,
+	'BONDS_WITHOUT_HYDROGEN': 3,
+	'ANGLES_INC_HYDROGEN': 4,
+	'ANGLES_WITHOUT_HYDROGEN': 4,
+	'DIHEDRALS_INC_HYDROGEN': 5,
+	'DIHEDRALS_WITHOUT_HYDROGEN': 5,
+}
+
+# All the sections openmol reads, rest are skipped
+sections = [
+	'TITLE', 'POINTERS', 'ATOM_NAME', 'CHARGE', 'ATOMIC_NUMBER', 'MASS',
+	'ATOM_TYPE_INDEX', 'NUMBER_EXCLUDED_ATOMS', 'NONBONDED_PARM_INDEX',
+	'RESIDUE_LABEL', 'RESIDUE_POINTER',
+	'BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN',
+	'ANGLES_INC_HYDROGEN', 'ANGLES_WITHOUT_HYDROGEN',
+	'DIHEDRALS_INC_HYDROGEN', 'DIHEDRALS_WITHOUT_HYDROGEN',
+	'AMBER_ATOM_TYPE',
+] + list(ff_sections)
+
+# MOL fields filled by each section, used for lazy loading
+section_fields = {
+	'ATOM_NAME': ['atom_name'],
+	'CHARGE': ['atom_q'],
+	'ATOMIC_NUMBER': ['atom_atomic_no'],
+	'MASS': ['atom_mass'],
+	'ATOM_TYPE_INDEX': ['pair_ff_index'],
+	'NUMBER_EXCLUDED_ATOMS': ['atom_no_excluded'],
+	'NONBONDED_PARM_INDEX': ['parm7_lj_index'],
+	'RESIDUE_LABEL': ['residue_name'],
+	'RESIDUE_POINTER': ['residue_start'],
+	'BONDS_INC_HYDROGEN': ['bond_from', 'bond_to', 'bond_ff_index'],
+	'BONDS_WITHOUT_HYDROGEN': ['bond_from', 'bond_to', 'bond_ff_index'],
+	'ANGLES_INC_HYDROGEN': ['angle_a', 'angle_b', 'angle_c', 'angle_ff_index'],
+	'ANGLES_WITHOUT_HYDROGEN': ['angle_a', 'angle_b', 'angle_c', 'angle_ff_index'],
+	'DIHEDRALS_INC_HYDROGEN': ['dihed_a', 'dihed_b', 'dihed_c', 'dihed_d', 'dihed_ff_index'],
+	'DIHEDRALS_WITHOUT_HYDROGEN': ['dihed_a', 'dihed_b', 'dihed_c', 'dihed_d', 'dihed_ff_index'],
+	'AMBER_ATOM_TYPE': ['atom_type', 'unique_atom_types'],
+}
+section_fields.update({k: [v] for k, v in ff_sections.items()})
+
+# sections of one item per atom, decoded for the kept atoms only
+atom_sections = [
+	'ATOM_NAME', 'CHARGE', 'ATOMIC_NUMBER', 'MASS', 'ATOM_TYPE_INDEX',
+	'NUMBER_EXCLUDED_ATOMS', 'AMBER_ATOM_TYPE',
+]
+
+# pointers of the no. of records of the bonded sections
+record_pointers = {
+	'BONDS_INC_HYDROGEN': ['NBONH'],
+	'BONDS_WITHOUT_HYDROGEN': ['MBONA', 'NBONA'],
+	'ANGLES_INC_HYDROGEN': ['NTHETH'],
+	'ANGLES_WITHOUT_HYDROGEN': ['MTHETA', 'NTHETA'],
+	'DIHEDRALS_INC_HYDROGEN': ['NPHIH'],
+	'DIHEDRALS_WITHOUT_HYDROGEN': ['MPHIA', 'NPHIA'],
+}
+
+# above this many kept atom ranges, the atom sections are decoded whole
+max_atom_ranges = 4096
+
+# MOL items set from a restart file, the rest is topology
+restart_fields = [
+	'time', 'temp',
+	'atom_x', 'atom_y', 'atom_z', 'atom_vx', 'atom_vy', 'atom_vz',
+	'box_x', 'box_y', 'box_z', 'box_alpha', 'box_beta', 'box_gamma',
+]
+
+# fortran format spec, e.g. 10I8, 5E16.8, 20a4
+format_re = re.compile(r'^\s*(\d*)\s*([AaIiEeFfDd])\s*(\d+)')
+
+NEWLINE = ord('\n')
+SPACE = ord(' ')
+WHITESPACE = b' \t\r\n'
+
+# no. of bytes read from the PARM7 file at once
+read_block_size = 4 << 20
+
 def initialize():
 	""" Initialize an openmol object with Amber
 		specific items. """
@@ -38,86 +137,321 @@ def initialize():
 
 	return MOL
 
-def process_last_section(MOL, section, lines, sformat):
-	""" Parse and process the last read section of PARM7 file """
-
-	items = []
-	for line in lines:
-		if sformat == "10I8":
-			n = 8
-			for i in range(0, len(line), n):
-				item = line[i:i+n].strip()
-				if len(item) > 0:
-					items.append(item)
+def parse_format(sformat):
+	""" Parse a fortran %FORMAT spec like 20a4, 10I8, 5E16.8 or
+		1a80 into (items per line, item type, item width). """
+
+	match = format_re.match(sformat)
+	if not match:
+		raise ValueError('unsupported PRMTOP format: %s' %sformat)
+
+	count = int(match.group(1) or 1)
+	return count, match.group(2).upper(), int(match.group(3))
+
+def decode_integers(data, width):
+	""" Decode Iw fields as a dot product of their digit columns, like
+		decode_fixed(). Returns None if any field is not a right aligned
+		integer with an optional minus sign. """
+
+	chars = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+
+	# exact in float64 upto 15 digits
+	if width > 15:
+		return None
+
+	weights = 10.0 ** np.arange(width - 1, -1, -1)
+	values = np.empty(len(chars), dtype=np.int64)
+	step = 1 << 18
+
+	for i in range(0, len(chars), step):
+		block = chars[i:i + step]
+		digits = block - ord('0')
+		is_digit = digits < 10
+		minus = block == ord('-')
+
+		found = np.count_nonzero(is_digit) + np.count_nonzero(minus) + np.count_nonzero(block == SPACE)
+		if found != block.size or not is_digit[:, -1].all():
+			return None
+
+		# the digits run upto the end of the field, a sign right before them
+		if (is_digit[:, :-1] & ~is_digit[:, 1:]).any() or (minus[:, :-1] & ~is_digit[:, 1:]).any():
+			return None
+
+		digits *= is_digit
+		values[i:i + step] = digits @ weights
+
+		# a reduce over the few columns is faster than along the rows
+		negative = np.logical_or.reduce([minus[:, j] for j in range(width)])
+		values[i:i + step][negative] *= -1
+
+	return values
+
+def decode_section(text, sformat):
+	""" Decode the fixed width data lines of a section into a single
+		typed array following the %FORMAT spec. Text can be a block
+		of complete lines or a list of them. Returns an int64 array
+		for I, a float64 array for E/F and a list of stripped strings
+		for A formatted sections. """
+
+	count, kind, width = parse_format(sformat)
+	line_width = count * width
+
+	if isinstance(text, (list, tuple)):
+		text = ''.join(text) if text and isinstance(text[0], str) else b''.join(text)
+
+	raw = text.encode('latin-1') if isinstance(text, str) else bytes(text)
+
+	if not raw.endswith(b'\n'):
+		raw += b'\n'
+	if b'\r' in raw:
+		raw = raw.replace(b'\r', b'')
+
+	buf = np.frombuffer(raw, dtype=np.uint8)
+	ends = np.flatnonzero(buf == NEWLINE)
+	lengths = np.diff(ends, prepend=-1) - 1
+
+	if np.all(lengths[:-1] == line_width) and lengths[-1] <= line_width:
+		# all but the last line are full records, join them as is
+		data = buf[buf != NEWLINE].tobytes()
+	else:
+		# ragged lines, pad each of them to its last complete field
+		records = (l[:line_width] for l in raw.split(b'\n')[:-1])
+		data = b''.join(r.ljust(-(-len(r) // width) * width) for r in records)
+
+	# trailing blank fields of the last line are not items
+	n_items = -(-len(data.rstrip()) // width)
+	data = data[:n_items * width].ljust(n_items * width)
+
+	fields = np.frombuffer(data, dtype='S%d' %width)
+
+	if kind == 'I':
+		items = decode_integers(data, width)
+		if items is None:
+			items = fields.astype(np.int64)
+		return items
+
+	elif kind in 'EFD':
+		if kind == 'D':
+			fields = np.char.replace(fields, b'D', b'E')
+		return fields.astype(np.float64)
+
+	return np.char.strip(fields).astype(str).tolist()
+
+class SectionReader(object):
+	""" Decode a PARM7 section while it is streamed in. The raw text
+		is buffered in small chunks of complete lines, each chunk is
+		decoded straight into the typed destination array. """
+
+	# no. of bytes to decode at once
+	chunk_size = 1 << 20
+
+	def __init__(self, MOL, section, sformat, size=None, select=None):
+		self.MOL = MOL
+		self.section = section
+		self.sformat = sformat
+		self.select = select		# filter of the (N, record) records
+		self.chunks = []
+		self.buffered = 0
+		self.values = []
+		self.no_items = 0			# no. of items decoded so far
+
+		# items of an incomplete record carried over to the next chunk
+		self.record = record_sizes.get(section, None)
+		self.remainder = np.empty(0, dtype=np.int64)
+
+		# not used by openmol, no need to decode
+		self.skip = section not in sections
+		if self.skip:
+			return
+
+		count, kind, width = parse_format(sformat)
+
+		if kind != 'A' and not self.record:
+			self.values = openmol.Column(np.int64 if kind == 'I' else np.float64)
+			if size:
+				# preallocate the final size if known, grows otherwise
+				self.values.reserve(size)
+
+	def add(self, text):
+		""" Add a block of complete data lines """
+		if self.skip:
+			return
+
+		self.chunks.append(text)
+		self.buffered += len(text)
+
+		if self.buffered >= self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		if not self.chunks:
+			return
+
+		items = decode_section(b''.join(self.chunks), self.sformat)
+		self.chunks = []
+		self.buffered = 0
+		self.no_items += len(items)
+
+		if self.record:
+			# store the complete records right away
+			items = np.concatenate((self.remainder, items))
+			complete = len(items) - len(items) % self.record
+			records = items[:complete]
+			self.remainder = items[complete:]
+
+			if self.select is not None:
+				records = self.select(records.reshape(-1, self.record)).ravel()
+			process_records(self.MOL, self.section, records)
 		else:
-			items += line.strip().split()
+			self.values.extend(items)
+
+	def items(self):
+		""" Decode the remaining lines and return all the items """
+		self.flush()
+
+		if len(self.remainder):
+			raise ValueError('incomplete record of %d items' %len(self.remainder))
+
+		if isinstance(self.values, openmol.Column):
+			return self.values.array
+		return self.values
+
+def section_size(MOL, section):
+	""" Expected no. of items in a section according to the
+		POINTERS, None if unknown. """
+
+	natom = MOL['PARM_NATOM']
+	ntypes = MOL['PARM_NTYPES']
+
+	sizes = {
+		'ATOM_NAME': natom,
+		'CHARGE': natom,
+		'ATOMIC_NUMBER': natom,
+		'MASS': natom,
+		'ATOM_TYPE_INDEX': natom,
+		'NUMBER_EXCLUDED_ATOMS': natom,
+		'AMBER_ATOM_TYPE': natom,
+		'NONBONDED_PARM_INDEX': ntypes**2,
+		'RESIDUE_LABEL': MOL['PARM_NRES'],
+		'RESIDUE_POINTER': MOL['PARM_NRES'],
+		'BOND_FORCE_CONSTANT': MOL['PARM_NUMBND'],
+		'BOND_EQUIL_VALUE': MOL['PARM_NUMBND'],
+		'ANGLE_FORCE_CONSTANT': MOL['PARM_NUMANG'],
+		'ANGLE_EQUIL_VALUE': MOL['PARM_NUMANG'],
+		'DIHEDRAL_FORCE_CONSTANT': MOL['PARM_NPTRA'],
+		'DIHEDRAL_PERIODICITY': MOL['PARM_NPTRA'],
+		'DIHEDRAL_PHASE': MOL['PARM_NPTRA'],
+		'LENNARD_JONES_ACOEF': ntypes * (ntypes + 1) // 2,
+		'LENNARD_JONES_BCOEF': ntypes * (ntypes + 1) // 2,
+		'BONDS_INC_HYDROGEN': 3 * MOL['PARM_NBONH'],
+		'BONDS_WITHOUT_HYDROGEN': 3 * MOL['PARM_NBONA'],
+		'ANGLES_INC_HYDROGEN': 4 * MOL['PARM_NTHETH'],
+		'ANGLES_WITHOUT_HYDROGEN': 4 * MOL['PARM_NTHETA'],
+		'DIHEDRALS_INC_HYDROGEN': 5 * MOL['PARM_NPHIH'],
+		'DIHEDRALS_WITHOUT_HYDROGEN': 5 * MOL['PARM_NPHIA'],
+	}
+
+	return sizes.get(section, None)
+
+def set_record_pointers(MOL, section, count):
+	""" Set the PARM7 pointers of the no. of records of a section """
+	for pointer in record_pointers[section]:
+		MOL['PARM_%s' %pointer] = count
+
+def update_counts(MOL):
+	""" Set the openmol summary counts from the PARM7 pointers """
+
+	MOL['no_atoms'] = MOL['PARM_NATOM']
+	MOL['no_bonds'] = MOL['PARM_NBONA'] + MOL['PARM_NBONH']
+	MOL['no_angles'] = MOL['PARM_NTHETH'] + MOL['PARM_MTHETA']
+	MOL['no_diheds'] = MOL['PARM_NPHIH'] + MOL['PARM_MPHIA']
+	MOL['no_residues'] = MOL['PARM_NRES']
+	MOL['no_atom_types'] = MOL['PARM_NATYP']
+
+def process_records(MOL, section, items):
+	""" Store a chunk of complete bond, angle or dihedral records """
+
+	items = items.reshape(-1, record_sizes[section])
+
+	if section in ['BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN']:
+		# we do not distinguish between H or other atoms for now
+		# store as regular bond info
+		openmol.extend_field(MOL, 'bond_from', np.abs(items[:, 0]) // 3)
+		openmol.extend_field(MOL, 'bond_to', np.abs(items[:, 1]) // 3)
+		openmol.extend_field(MOL, 'bond_ff_index', items[:, 2] - 1)
+
+	elif section in ['ANGLES_INC_HYDROGEN', 'ANGLES_WITHOUT_HYDROGEN']:
+		# we do not distinguish between H or other atoms for now
+		# store as regular angle info
+		openmol.extend_field(MOL, 'angle_a', np.abs(items[:, 0]) // 3)
+		openmol.extend_field(MOL, 'angle_b', np.abs(items[:, 1]) // 3)
+		openmol.extend_field(MOL, 'angle_c', np.abs(items[:, 2]) // 3)
+		openmol.extend_field(MOL, 'angle_ff_index', items[:, 3] - 1)
+
+	elif section in ['DIHEDRALS_INC_HYDROGEN', 'DIHEDRALS_WITHOUT_HYDROGEN']:
+		# we do not distinguish between H or other atoms for now
+		# store as regular dihedral info
+		openmol.extend_field(MOL, 'dihed_a', np.abs(items[:, 0]) // 3)
+		openmol.extend_field(MOL, 'dihed_b', np.abs(items[:, 1]) // 3)
+		openmol.extend_field(MOL, 'dihed_c', np.abs(items[:, 2]) // 3)
+		openmol.extend_field(MOL, 'dihed_d', np.abs(items[:, 3]) // 3)
+		openmol.extend_field(MOL, 'dihed_ff_index', items[:, 4] - 1)
+
+def process_last_section(MOL, section, items):
+	""" Process the decoded items of the last read section of PARM7 file """
 
 	if not section:
 		# no previous section
 		return True
 
+	if section not in sections:
+		# not used by openmol, not decoded
+		openmol.info('OK')
+		return True
+
 	if section == 'TITLE':
-		MOL['title'] = lines[0]
+		MOL['title'] = ' '.join(items)
+		openmol.info('OK')
+		return True
 
-	elif section == 'POINTERS':
+	if section == 'POINTERS':
 		if len(items) > len(pointers):
 			print('\n-- Warning: unknown PRMTOP pointer found. Ignoring ...', end=' ')
 
-		for i, v in enumerate(items):
-			if i < len(pointers):
-				MOL['PARM_%s' %pointers[i]] = int(v)
+		for i, v in enumerate(items[:len(pointers)].tolist()):
+			MOL['PARM_%s' %pointers[i]] = v
 
-		MOL['no_atoms'] = MOL['PARM_NATOM']
-		MOL['no_bonds'] = MOL['PARM_NBONA'] + MOL['PARM_NBONH']
-		MOL['no_angles'] = MOL['PARM_NTHETH'] + MOL['PARM_MTHETA']
-		MOL['no_diheds'] = MOL['PARM_NPHIH'] + MOL['PARM_MPHIA']
-		MOL['no_residues'] = MOL['PARM_NRES']
-		MOL['no_atom_types'] = MOL['PARM_NATYP']
+		update_counts(MOL)
 
 	elif section == 'ATOM_NAME':
 		if len(items) != MOL['no_atoms']:
 			print('\n-- Error: no_atoms and ATOM_NAME section mismatch')
 			print('-- no of atoms: %d, record found: %d' %(MOL['no_atoms'], len(items)))
-			print('-- this may happen if the system is huge.')
-			print('-- reparsing section lines for atom names with 20A4 formatting ...')
-			items = []
-			for l in lines:
-				n = 4
-				items += [l[i:i+n].strip() for i in range(0, len(l), n)]
-
-			if len(items) != MOL['no_atoms']:
-				print('\n-- Error: no_atoms and ATOM_NAME section mismatch after reparsing')
-				print('-- no of atoms: %d, record found: %d' %(MOL['no_atoms'], len(items)))
-				print('-- nothing else to do. :( ')
-				return False
+			return False
 
-		for name in items:
-			MOL['atom_name'].append(name)
+		MOL['atom_name'].extend(items)
 
 	elif section == 'CHARGE':
 		if len(items) != MOL['no_atoms']:
 			print('-- Error: no_atoms and CHARGE section mismatch')
 			return False
 
-		for q in items:
-			# in electionic units, see http://ambermd.org/formats.html
-			MOL['atom_q'].append(float(q)/18.2223)
+		# in electionic units, see http://ambermd.org/formats.html
+		openmol.extend_field(MOL, 'atom_q', items / 18.2223)
 
 	elif section == 'ATOMIC_NUMBER':
 		if len(items) != MOL['no_atoms']:
 			print('-- Error: no_atoms and ATOMIC_NUMBER section mismatch')
 			return False
 
-		for A in items:
-			MOL['atom_atomic_no'].append(int(A))
+		openmol.extend_field(MOL, 'atom_atomic_no', items)
 
 	elif section == 'MASS':
 		if len(items) != MOL['no_atoms']:
 			print('-- Error: no_atoms and MASS section mismatch')
 			return False
 
-		for m in items:
-			MOL['atom_mass'].append(float(m))
+		openmol.extend_field(MOL, 'atom_mass', items)
 
 	# lj_ff_index for each atom
 	elif section == 'ATOM_TYPE_INDEX':
@@ -125,17 +459,15 @@ def process_last_section(MOL, section, lines, sformat):
 			print('-- Error: no_atoms and ATOM_TYPE_INDEX section mismatch')
 			return False
 
-		for t in items:
-			# 1 based indexing, subtract 1
-			MOL['pair_ff_index'].append(int(t) - 1)
+		# 1 based indexing, subtract 1
+		openmol.extend_field(MOL, 'pair_ff_index', items - 1)
 
 	elif section == 'NUMBER_EXCLUDED_ATOMS':
 		if len(items) != MOL['no_atoms']:
 			print('-- Error: no_atoms and NUMBER_EXCLUDED_ATOMS section mismatch')
 			return False
 
-		for ex in items:
-			MOL['atom_no_excluded'].append(int(ex))
+		openmol.extend_field(MOL, 'atom_no_excluded', items)
 
 	# lj parm index, needed to find epsilon, sigma
 	elif section == 'NONBONDED_PARM_INDEX':
@@ -143,276 +475,854 @@ def process_last_section(MOL, section, lines, sformat):
 			print('-- Error: PARM_NTYPES and NONBONDED_PARM_INDEX section mismatch')
 			return False
 
-		for ix in items:
-			MOL['parm7_lj_index'].append(int(ix))
+		openmol.extend_field(MOL, 'parm7_lj_index', items)
 
 	elif section == 'RESIDUE_LABEL':
 		if len(items) != MOL['no_residues']:
 			print('-- Error: no_residues and RESIDUE_LABEL section mismatch')
 			return False
 
-		for i in items:
-			MOL['residue_name'].append(i)
+		MOL['residue_name'].extend(items)
 
 	elif section == 'RESIDUE_POINTER':
 		if len(items) != MOL['no_residues']:
 			print('-- Error: no_residues and RESIDUE_POINTER section mismatch')
 			return False
 
-		for i in items:
-			MOL['residue_start'].append(int(i) - 1)
-
-	elif section in ['BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN']:
-		for i in range(0, len(items), 3):
-			index0 = int(abs(int(items[i]))/3)
-			index1 = int(abs(int(items[i+1]))/3)
-			index2 = int(items[i+2]) - 1
-			# we do not distinguish between H or other atoms for now
-			# store as regular bond info
-			MOL['bond_from'].append(index0)
-			MOL['bond_to'].append(index1)
-			MOL['bond_ff_index'].append(index2)
+		openmol.extend_field(MOL, 'residue_start', items - 1)
 
-	elif section in ['ANGLES_INC_HYDROGEN', 'ANGLES_WITHOUT_HYDROGEN']:
-		for i in range(0, len(items), 4):
-			index0 = int(abs(int(items[i]))/3)
-			index1 = int(abs(int(items[i+1]))/3)
-			index2 = int(abs(int(items[i+2]))/3)
-			index3 = int(items[i+3]) - 1
-			# we do not distinguish between H or other atoms for now
-			# store as regular angle info
-			MOL['angle_a'].append(index0)
-			MOL['angle_b'].append(index1)
-			MOL['angle_c'].append(index2)
-			MOL['angle_ff_index'].append(index3)
-
-	elif section in ['DIHEDRALS_INC_HYDROGEN', 'DIHEDRALS_WITHOUT_HYDROGEN']:
-		for i in range(0, len(items), 5):
-			index0 = int(abs(int(items[i]))/3)
-			index1 = int(abs(int(items[i+1]))/3)
-			index2 = int(abs(int(items[i+2]))/3)
-			index3 = int(abs(int(items[i+3]))/3)
-			index4 = int(items[i+4]) - 1
-			# we do not distinguish between H or other atoms for now
-			# store as regular dihedral info
-			MOL['dihed_a'].append(index0)
-			MOL['dihed_b'].append(index1)
-			MOL['dihed_c'].append(index2)
-			MOL['dihed_d'].append(index3)
-			MOL['dihed_ff_index'].append(index4)
+	elif section in record_sizes:
+		# already stored while streaming
+		pass
 
 	elif section == 'AMBER_ATOM_TYPE':
 		if len(items) != MOL['no_atoms']:
 			print('-- Error: no_atoms and AMBER_ATOM_TYPE section mismatch')
 			return False
 
-		for t in items:
-			MOL['atom_type'].append(t)
+		MOL['atom_type'].extend(items)
+
+		# keep the order of first appearance
+		for t in dict.fromkeys(items):
 			if t not in MOL['unique_atom_types']:
 				MOL['unique_atom_types'].append(t)
 
-	elif section == 'BOND_FORCE_CONSTANT':
-		for i in items:
-			MOL['FF_bond_k'].append(float(i))
-
-	elif section == 'BOND_EQUIL_VALUE':
-		for i in items:
-			MOL['FF_bond_eq'].append(float(i))
-
-	elif section == 'ANGLE_FORCE_CONSTANT':
-		for i in items:
-			MOL['FF_angle_k'].append(float(i))
+	elif section in ff_sections:
+		openmol.extend_field(MOL, ff_sections[section], items)
 
-	elif section == 'ANGLE_EQUIL_VALUE':
-		for i in items:
-			MOL['FF_angle_eq'].append(float(i))
+	openmol.info('OK')
+	return True
 
-	elif section == 'DIHEDRAL_FORCE_CONSTANT':
-		for i in items:
-			MOL['FF_dihed_k'].append(float(i))
+def finish_section(MOL, reader, stage=None):
+	""" Decode the rest of a streamed section and process it """
+	if reader is None:
+		return True
 
-	elif section == 'DIHEDRAL_PERIODICITY':
-		for i in items:
-			MOL['FF_dihed_periodicity'].append(float(i))
+	try:
+		items = reader.items()
+	except ValueError as err:
+		print('\n-- Error: failed to decode %s section: %s' %(reader.section, err))
+		return False
 
-	elif section == 'DIHEDRAL_PHASE':
-		for i in items:
-			MOL['FF_dihed_phase'].append(float(i))
+	if not process_last_section(MOL, reader.section, items):
+		return False
 
-	elif section == 'LENNARD_JONES_ACOEF':
-		for i in items:
-			MOL['parm7_lj_acoeff'].append(float(i))
+	if stage is not None:
+		stage.done(reader.no_items // (reader.record or 1))
 
-	elif section == 'LENNARD_JONES_BCOEF':
-		for i in items:
-			MOL['parm7_lj_bcoeff'].append(float(i))
+	return True
 
+def read_prmtop(prmtop, lazy=False, index_file=None, exclude=None, residues=None):
+	""" Read a PARM7 file section by section. The file is scanned in
+		large blocks and each section is decoded while it is being
+		read, so only the typed data is kept in memory.
+		If lazy, only the section offsets are indexed and each section
+		is decoded on the first access of its fields, see LazyMOL.
+		Residues can be left out while reading, by the names to exclude,
+		e.g. ['WAT', 'Na+', 'Cl-'], or the 0 based indices of the
+		residues to keep, see read_prmtop_filtered(). """
 
-	print('OK')
-	return True
+	if exclude is not None or residues is not None:
+		if lazy:
+			print('-- Warning: lazy loading not supported with a residue filter.')
+		return read_prmtop_filtered(prmtop, exclude, residues, index_file)
 
-def read_prmtop(prmtop):
-	global section_lines
+	if lazy:
+		return read_prmtop_lazy(prmtop, index_file)
 
 	MOL = initialize()
+	total = openmol.Stage('read', 'total', prmtop)
 
 	line_no = 0					# global line number
-	section_line_no = 0			# line number within current section
 	section = None
-	section_format = None
-	section_lines = []			# lines of current section
+	reader = None				# decoder of current section
+	stage = None				# timing of current section
+
+	with open(prmtop, 'rb') as fp:
+		buf = b''
+		eof = False
+
+		while not eof:
+			block = fp.read(read_block_size)
+			eof = len(block) == 0
+			buf += block
+			pos = 0
+
+			while pos < len(buf):
+				if buf.startswith(b'%', pos):
+					# header line, wait for the rest of it
+					end = buf.find(b'\n', pos)
+					if end < 0:
+						if not eof:
+							break
+						end = len(buf)
+
+					line_no += 1
+					line = buf[pos:end + 1].decode('latin-1')
+					pos = end + 1
+
+				else:
+					# data lines, upto the next header or the last complete line
+					end = buf.find(b'\n%', pos)
+					if end < 0:
+						end = len(buf) - 1 if eof else buf.rfind(b'\n', pos)
+						if end < pos:
+							break
+
+					data = buf[pos:end + 1]
+					line_no += data.count(b'\n')
+					pos = end + 1
+
+					if stage is not None:
+						stage.bytes += len(data)
+
+					if reader is not None:
+						try:
+							reader.add(data)
+						except ValueError as err:
+							print('\n-- Error: failed to decode %s section: %s' %(section, err))
+							return False
+					continue
+
+				if line.startswith('%VERSION'):
+					parts = line.split()
+					if len(parts) < 2:
+						print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
+						return None
+					else:
+						MOL['parm_version_string'] = ' '.join(parts[1:])
+
+				# new section
+				elif line.startswith('%FLAG'):
+					parts = line.split()
+					if len(parts) < 2:
+						print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
+						return None
+					else:
+						# new section found, first process the previous section if any
+						if not finish_section(MOL, reader, stage):
+							return False
+
+						section = parts[1]
+						reader = None
+						stage = openmol.Stage('read', section, prmtop)
+						openmol.info('Reading %s ...' %section, end=' ')
+
+				elif line.startswith('%FORMAT'):
+					parts = line.strip().split('(')
+					if len(parts) < 2:
+						print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
+						return None
+					else:
+						section_format = parts[1][:-1]
+
+						# read the whole title line
+						if section == 'TITLE':
+							section_format = '1a80'
+
+						try:
+							reader = SectionReader(MOL, section, section_format, section_size(MOL, section))
+						except ValueError as err:
+							print('\n-- Error: Invalid PRMTOP [line %d]: %s' %(line_no, err))
+							return None
+
+			buf = buf[pos:]
+
+	# process the final section
+	if not finish_section(MOL, reader, stage):
+		return False
 
-	for line in open(prmtop, 'r'):
-		line_no += 1
-		section_line_no += 1
+	if total.active:
+		total.bytes = os.path.getsize(prmtop)
+	total.done(MOL['no_atoms'])
 
-		if len(line) == 0:
-			continue
+	openmol.info('Reading Done')
+	return MOL
+
+def index_prmtop(prmtop, index_file=None):
+	""" Record the byte offsets of the %FLAG and %FORMAT lines
+		and the data lines of each PARM7 section, without decoding
+		anything. Saved as JSON if an index_file is given. """
+
+	index = {'version': None, 'sections': []}
+	entry = None
+
+	with open(prmtop, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		# header lines always start with a %
+		pos = 0 if mm[:1] == b'%' else mm.find(b'\n%') + 1
+
+		while pos > 0 or (pos == 0 and mm[:1] == b'%'):
+			end = mm.find(b'\n', pos)
+			if end < 0:
+				end = len(mm)
+
+			line = mm[pos:end].decode('latin-1')
+
+			if line.startswith('%VERSION'):
+				index['version'] = ' '.join(line.split()[1:])
+
+			elif line.startswith('%FLAG'):
+				entry = {'name': line.split()[1], 'flag': pos}
+				index['sections'].append(entry)
+
+			elif line.startswith('%FORMAT') and entry is not None:
+				entry['format'] = pos
+				entry['sformat'] = line.strip().split('(')[1][:-1]
+
+			# data lines follow the last header line of the section
+			nxt = mm.find(b'\n%', end)
+			if entry is not None:
+				entry['start'] = min(end + 1, len(mm))
+				entry['end'] = nxt + 1 if nxt >= 0 else len(mm)
+
+			if nxt < 0:
+				break
+			pos = nxt + 1
+
+	if index_file:
+		openmol.write_index(index, prmtop, index_file)
+
+	return index
+
+def load_section(MOL, prmtop, entry, select=None):
+	""" Seek to a single indexed section and decode it into MOL.
+		The records of a bonded section can be filtered by select. """
+
+	section = entry['name']
+	stage = openmol.Stage('read', section, prmtop)
+	stage.bytes = entry['end'] - entry['start']
+	openmol.info('Reading %s ...' %section, end=' ')
+
+	sformat = '1a80' if section == 'TITLE' else entry['sformat']
+	reader = SectionReader(MOL, section, sformat, section_size(MOL, section), select)
+
+	with open(prmtop, 'rb') as fp:
+		fp.seek(entry['start'])
+		remaining = entry['end'] - entry['start']
+		carry = b''
+
+		while remaining > 0:
+			block = carry + fp.read(min(read_block_size, remaining))
+			remaining -= len(block) - len(carry)
+
+			# pass only complete lines to the reader
+			cut = block.rfind(b'\n') + 1 if remaining > 0 else len(block)
+			reader.add(block[:cut])
+			carry = block[cut:]
+
+	return finish_section(MOL, reader, stage)
+
+class LazyMOL(openmol.AttrDict):
+	""" OpenMOL object of a PARM7 file that decodes a section
+		only when one of its fields is first accessed.
+		Operations over the whole dictionary (iteration, items,
+		copying, json) load all the remaining sections first. """
+
+	def __init__(self, MOL, prmtop, index):
+		super(LazyMOL, self).__init__()
+		dict.update(self, MOL)
+
+		pending = {}
+		for entry in index['sections']:
+			for field in section_fields.get(entry['name'], []):
+				pending.setdefault(field, []).append(entry)
+
+		for field in pending:
+			dict.pop(self, field, None)
+
+		object.__setattr__(self, '_prmtop', prmtop)
+		object.__setattr__(self, '_pending', pending)
+
+	def load(self, *fields):
+		""" Decode the sections of the given fields,
+			all the pending ones if none given. """
+
+		for field in fields or list(self._pending):
+			if field not in self._pending:
+				continue
+
+			# decode into a fresh object, so that the fields
+			# already set by the user are not touched
+			MOL = initialize()
+			for i in pointers:
+				MOL['PARM_%s' %i] = dict.__getitem__(self, 'PARM_%s' %i)
+			update_counts(MOL)
+
+			loaded = set()
+			for entry in self._pending[field]:
+				if not load_section(MOL, self._prmtop, entry):
+					raise ValueError('failed to decode %s section of %s' %(entry['name'], self._prmtop))
+				loaded.update(section_fields[entry['name']])
+
+			for key in loaded:
+				if key in self._pending:
+					del self._pending[key]
+					dict.__setitem__(self, key, MOL[key])
+
+	def __getitem__(self, key):
+		if key in self._pending:
+			self.load(key)
+		return dict.__getitem__(self, key)
 
-		if line.startswith('%VERSION'):
-			parts = line.split()
-			if len(parts) < 2:
-				print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
-				return None
-			else:
-				MOL['parm_version_string'] = ' '.join(parts[1:])
-
-		# new section
-		elif line.startswith('%FLAG'):
-			parts = line.split()
-			if len(parts) < 2:
-				print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
-				return None
-			else:
-				# new section found, first process the previous section if any
-				if not process_last_section(MOL, section, section_lines, section_format):
-					return False
-
-				section = parts[1]
-				print('Reading %s ...' %section, end=' ')
-				section_line_no = 0
-				section_lines = []
-
-		elif line.startswith('%FORMAT'):
-			parts = line.strip().split('(')
-			if len(parts) < 2:
-				print('-- Error: Invalid PRMTOP [line %d]:\n%s' %(line_no, line))
-				return None
-			else:
-				section_format = parts[1][:-1]
+	def __setitem__(self, key, value):
+		super(LazyMOL, self).__setitem__(key, value)
+		self._pending.pop(key, None)
 
+	def __contains__(self, key):
+		return key in self._pending or dict.__contains__(self, key)
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def __iter__(self):
+		self.load()
+		return dict.__iter__(self)
+
+	def __len__(self):
+		return dict.__len__(self) + len(self._pending)
+
+	def keys(self):
+		self.load()
+		return dict.keys(self)
+
+	def values(self):
+		self.load()
+		return dict.values(self)
+
+	def items(self):
+		self.load()
+		return dict.items(self)
+
+def read_prmtop_lazy(prmtop, index_file=None):
+	""" Index a PARM7 file (or reuse a saved index) and return a
+		LazyMOL with only the TITLE and POINTERS decoded. """
+
+	index = None
+	if index_file:
+		index = openmol.load_index(prmtop, index_file)
+
+	if index is None:
+		index = index_prmtop(prmtop, index_file)
+
+	MOL = initialize()
+	MOL['parm_version_string'] = index['version']
+
+	for entry in index['sections']:
+		if entry['name'] in ['TITLE', 'POINTERS']:
+			if not load_section(MOL, prmtop, entry):
+				return False
+
+	openmol.info('Indexing Done')
+	return LazyMOL(MOL, prmtop, index)
+
+def kept_ranges(starts, no_atoms, keep):
+	""" Atom ranges [lo, hi) of the kept residues, adjacent ones merged,
+		as lo, hi and the new index of the first atom of each range. """
+
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.append(starts[1:], no_atoms)
+	lo, hi = starts[keep], ends[keep]
+
+	if len(lo) == 0:
+		return lo, hi, lo
+
+	# a range continues where the previous one ended
+	first = np.append(True, lo[1:] != hi[:-1])
+	lo, hi = lo[first], hi[np.append(first[1:], True)]
+
+	offset = np.cumsum(hi - lo) - (hi - lo)
+	return lo, hi, offset
+
+def renumber(atoms, lo, hi, offset):
+	""" New index of each atom of the kept ranges, -1 for the others """
+	if len(lo) == 0:
+		return np.full(np.shape(atoms), -1, dtype=np.int64)
+
+	r = np.searchsorted(lo, atoms, side='right') - 1
+	inside = (r >= 0) & (atoms < hi[np.maximum(r, 0)])
+	return np.where(inside, offset[np.maximum(r, 0)] + atoms - lo[np.maximum(r, 0)], -1)
+
+def record_filter(lo, hi, offset):
+	""" Select the bonded records of the kept atoms and renumber them.
+		The atoms are stored as 3 times the index, negative flags kept. """
+
+	def select(records):
+		atoms = records[:, :-1]
+		new = renumber(np.abs(atoms) // 3, lo, hi, offset)
+		kept = np.all(new >= 0, axis=1)
+
+		records = records[kept]
+		records[:, :-1] = np.where(atoms[kept] < 0, -3, 3) * new[kept]
+		return records
+
+	return select
+
+def load_atom_section(MOL, prmtop, entry, no_atoms, lo, hi):
+	""" Decode the items of the kept atom ranges of a per atom section
+		into MOL. With the usual full fixed width lines, only the lines
+		of the ranges are read, otherwise the whole section is decoded
+		and the items of the other atoms discarded. """
+
+	section = entry['name']
+	sformat = entry['sformat']
+	stage = openmol.Stage('read', section, prmtop)
+	openmol.info('Reading %s ...' %section, end=' ')
+
+	count, kind, width = parse_format(sformat)
+	line = count * width + 1
+	size = entry['end'] - entry['start']
+	fixed = size == (no_atoms // count) * line + (no_atoms % count * width + 1 if no_atoms % count else 0)
+
+	parts = []
+
+	with open(prmtop, 'rb') as fp:
+		if fixed and len(lo) <= max_atom_ranges:
+			for a, b in zip(lo.tolist(), hi.tolist()):
+				first, last = a // count, (b - 1) // count
+				fp.seek(entry['start'] + first * line)
+				items = decode_section(fp.read(min((last + 1) * line, size) - first * line), sformat)
+				parts.append(items[a - first * count:b - first * count])
+				stage.bytes += min((last + 1) * line, size) - first * line
 		else:
-			section_lines.append(line)
+			fp.seek(entry['start'])
+			items = decode_section(fp.read(size), sformat)
+			stage.bytes += size
+			if len(items) != no_atoms:
+				print('\n-- Error: %d atoms and %s section mismatch' %(no_atoms, section))
+				return False
+			parts = [items[a:b] for a, b in zip(lo.tolist(), hi.tolist())]
 
-	# process the final section
-	if not process_last_section(MOL, section, section_lines, section_format):
+	if kind == 'A':
+		items = [name for part in parts for name in part]
+	else:
+		items = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64 if kind == 'I' else np.float64)
+
+	if not process_last_section(MOL, section, items):
 		return False
 
-	print('Reading Done')
-	return MOL
+	stage.done(len(items))
+	return True
 
-def read_rst7(MOL, rst_file):
-	line_no = 0
-	no_atoms = 0
-	items = []
-	last_line = None
+def read_prmtop_filtered(prmtop, exclude=None, residues=None, index_file=None):
+	""" Read only the atoms of some residues of a PARM7 file, e.g. the
+		solute of a solvated system. The residues are kept by their 0
+		based indices if given, less the ones named in exclude.
 
-	for line in open(rst_file, 'r'):
-		line_no += 1
-		line = line.strip()
+		The residues are read first through the section index, then the
+		per atom sections are decoded for the kept atom ranges only. The
+		bonded records of the other atoms are dropped while streaming,
+		the rest renumbered. The time and memory scale with the kept
+		atoms, except for the bonded sections that are scanned whole.
+		The force field tables are read as they are.
 
-		if len(line) == 0:
-			continue
+		The kept ranges are saved as parm7_kept_atoms, so that the
+		restarts of the whole system can be read, see apply_restart(). """
+
+	index = None
+	if index_file:
+		index = openmol.load_index(prmtop, index_file)
 
-		last_line = line
+	if index is None:
+		index = index_prmtop(prmtop, index_file)
+
+	entries = dict((entry['name'], entry) for entry in index['sections'])
+	for name in ['POINTERS', 'RESIDUE_LABEL', 'RESIDUE_POINTER']:
+		if name not in entries:
+			print('-- Error: %s section not found in %s' %(name, prmtop))
+			return False
 
-		if line_no == 1:
-			rst_title = line
+	MOL = initialize()
+	MOL['parm_version_string'] = index['version']
+	total = openmol.Stage('read', 'total', prmtop)
+
+	for name in ['TITLE', 'POINTERS']:
+		if name in entries and not load_section(MOL, prmtop, entries[name]):
+			return False
+
+	# the residues of the whole file, to find the kept atoms
+	whole = initialize()
+	for i in pointers:
+		whole['PARM_%s' %i] = MOL['PARM_%s' %i]
+	update_counts(whole)
+
+	for name in ['RESIDUE_LABEL', 'RESIDUE_POINTER']:
+		if not load_section(whole, prmtop, entries[name]):
+			return False
+
+	no_atoms = whole['no_atoms']
+	names = np.asarray(whole['residue_name'], dtype=str)
+	starts = np.asarray(whole['residue_start'], dtype=np.int64)
+
+	keep = np.ones(len(starts), dtype=bool)
+	if residues is not None:
+		residues = np.asarray(residues, dtype=np.int64)
+		if len(residues) and (residues.min() < 0 or residues.max() >= len(starts)):
+			print('-- Error: residue index out of range of %d residues.' %len(starts))
+			return False
+
+		keep[:] = False
+		keep[residues] = True
+	if exclude is not None:
+		keep &= ~np.isin(names, list(exclude))
+
+	lo, hi, offset = kept_ranges(starts, no_atoms, keep)
+	kept_atoms = int(np.sum(hi - lo))
+
+	MOL['PARM_NATOM'] = kept_atoms
+	MOL['PARM_NRES'] = int(keep.sum())
+	update_counts(MOL)
+
+	for entry in index['sections']:
+		section = entry['name']
+
+		if section in ['TITLE', 'POINTERS'] or section not in sections:
 			continue
-		elif line_no == 2:
-			parts = line.split()
-			no_atoms = int(parts[0])
-			if len(parts) > 1:
-				# optional time string
-				MOL['time'] = float(parts[1])
-			if len(parts) > 2:
-				# optional temperature string
-				MOL['temp'] = float(parts[2])
-
-			if no_atoms != MOL['no_atoms']:
-				print('-- Error: RST7 no_atoms mismatch with the PARM7 file.')
+
+		if section == 'RESIDUE_LABEL':
+			MOL['residue_name'].extend(names[keep].tolist())
+
+		elif section == 'RESIDUE_POINTER':
+			sizes = np.diff(np.append(starts, no_atoms))[keep]
+			openmol.extend_field(MOL, 'residue_start', np.cumsum(sizes) - sizes)
+
+		elif section in atom_sections:
+			if not load_atom_section(MOL, prmtop, entry, no_atoms, lo, hi):
 				return False
-		else:
-			# rest is all the atomic coordinates in 3D
-			items += line.split()
 
-	if len(items) < no_atoms * 3:
+		elif section in record_sizes:
+			field = section_fields[section][0]
+			before = len(MOL[field])
+
+			if not load_section(MOL, prmtop, entry, record_filter(lo, hi, offset)):
+				return False
+
+			set_record_pointers(MOL, section, len(MOL[field]) - before)
+
+		elif not load_section(MOL, prmtop, entry):
+			return False
+
+	update_counts(MOL)
+
+	MOL['parm7_no_atoms'] = no_atoms
+	MOL['parm7_kept_atoms'] = np.column_stack([lo, hi]).tolist()
+
+	if total.active:
+		total.bytes = os.path.getsize(prmtop)
+	total.done(MOL['no_atoms'])
+
+	openmol.info('Kept %d of %d atoms, %d of %d residues.' %(kept_atoms, no_atoms, MOL['no_residues'], len(starts)))
+	openmol.info('Reading Done')
+	return MOL
+
+def kept_rows(MOL, values):
+	""" Rows of the kept atoms of a residue filtered read, from an
+		array of all the atoms of the file """
+
+	rows = [values[lo:hi] for lo, hi in MOL['parm7_kept_atoms']]
+	return np.concatenate(rows) if rows else values[:0]
+
+def decode_fixed(data, width, decimals):
+	""" Decode Fw.d fields written with the decimal point at its fixed
+		position, as a dot product of the digit columns. Much faster
+		than a float cast. Returns None if any field does not follow
+		the layout, e.g. exponents or overflow stars. """
+
+	chars = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+	point = width - decimals - 1
+
+	if point < 0 or not np.all(chars[:, point] == ord('.')):
+		return None
+
+	# place value of each column, none for the decimal point
+	weights = np.zeros(width)
+	columns = [j for j in range(width) if j != point]
+	weights[columns] = 10.0 ** np.arange(len(columns) - 1, -1, -1)
+
+	values = np.empty(len(chars))
+	step = 1 << 18
+
+	for i in range(0, len(chars), step):
+		block = chars[i:i + step]
+		digits = block - ord('0')
+		is_digit = digits < 10
+		minus = block == ord('-')
+
+		# anything but digits, blanks and signs outside the decimal point
+		found = np.count_nonzero(is_digit) + np.count_nonzero(minus) + np.count_nonzero(block == SPACE)
+		if found != block.size - len(block) or minus[:, point:].any():
+			return None
+
+		# blanks and signs count as leading zeros, the sums are exact integers
+		digits *= is_digit
+		values[i:i + step] = digits @ weights
+		values[i:i + step][np.logical_or.reduce(minus[:, :point], axis=1)] *= -1
+
+	# exact integer over exact power of ten, same rounding as float()
+	return values / 10.0**decimals
+
+def decode_rst7_block(buf, width=12, decimals=7):
+	""" Decode the 6F12.7 block of an ASCII restart file
+		from a uint8 array into a float64 array. The overflow
+		fields, all stars, are NaN. """
+
+	# lengths of all the lines, the last one may not end with a newline
+	ends = np.flatnonzero(buf == NEWLINE)
+	lengths = np.diff(ends, prepend=-1, append=len(buf)) - 1
+
+	if np.all(lengths % width == 0) and not np.any(buf == ord('\r')):
+		# fixed width records, no need to split
+		data = buf[buf != NEWLINE].tobytes()
+		items = decode_fixed(data, width, decimals)
+		if items is not None:
+			return items
+
+		try:
+			return overflow_to_nan(np.frombuffer(data, dtype='S%d' %width)).astype(np.float64)
+		except ValueError:
+			# items not aligned to the fields, e.g. a short box line
+			pass
+
+	# unusual spacing, fall back to blank separated items
+	return overflow_to_nan(np.array(buf.tobytes().split(), dtype=bytes)).astype(np.float64)
+
+def overflow_to_nan(fields):
+	""" Fortran fills a field too narrow for its value with stars,
+		read those fields of a bytes array as NaN. """
+
+	stars = np.char.count(fields, b'*') > 0
+	if stars.any():
+		fields = np.where(stars, b'nan', fields)
+	return fields
+
+def load_rst7(rst_file):
+	""" Memory map an ASCII AMBER restart file and parse its
+		coordinates in a single vectorized pass.
+		Returns a dictionary of the title, no_atoms, time, temp,
+		coordinates (N, 3) and velocities (N, 3) arrays, box and
+		angles. Missing items are None. """
+
+	rst = {'title': None, 'no_atoms': 0, 'time': None, 'temp': None,
+			'coordinates': None, 'velocities': None, 'box': None, 'angles': None}
+
+	with open(rst_file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		first = mm.find(b'\n')
+		second = mm.find(b'\n', first + 1)
+		if first < 0 or second < 0:
+			print('-- Error: Invalid RST7 file %s' %rst_file)
+			return None
+
+		rst['title'] = mm[:first].decode('latin-1').strip()
+
+		parts = mm[first + 1:second].split()
+		rst['no_atoms'] = no_atoms = int(parts[0])
+		if len(parts) > 1:
+			# optional time string
+			rst['time'] = float(parts[1])
+		if len(parts) > 2:
+			# optional temperature string
+			rst['temp'] = float(parts[2])
+
+		# rest is all the atomic coordinates in 3D, copied out of the
+		# map, which can not be closed while an array refers to it
+		buf = np.frombuffer(mm, dtype=np.uint8, offset=second + 1)
+		end = len(buf)
+		while end > 0 and buf[end - 1] in WHITESPACE:
+			end -= 1
+
+		block = buf[:end].copy()
+		del buf
+
+	items = decode_rst7_block(block)
+	del block
+
+	n = len(items)
+	if n < no_atoms * 3:
 		print('-- Error: RST7 no_atoms, coordinate items mismatch.')
-		print('coordinates: ', len(items), 'no of atoms: ', no_atoms)
+		print('coordinates: ', n, 'no of atoms: ', no_atoms)
+		return None
+
+	rst['coordinates'] = items[:no_atoms * 3].reshape(no_atoms, 3)
+
+	# optional velocities
+	if n >= no_atoms * 6:
+		rst['velocities'] = items[no_atoms * 3:no_atoms * 6].reshape(no_atoms, 3)
+
+	# x,y,z coordinates (and velocities) + a,b,c
+	if n in [no_atoms * 3 + 3, no_atoms * 6 + 3]:
+		rst['box'] = items[-3:]
+
+	# x,y,z coordinates (and velocities) + a,b,c + angles
+	if n in [no_atoms * 3 + 6, no_atoms * 6 + 6]:
+		rst['box'] = items[-6:-3]
+		rst['angles'] = items[-3:]
+
+	return rst
+
+def read_rst7(MOL, rst_file):
+	""" Read the coordinates, velocities and box of an ASCII
+		restart file into MOL. """
+
+	rst = load_rst7(rst_file)
+	if rst is None:
+		return False
+
+	return apply_restart(MOL, rst)
+
+def read_netcdf(MOL, nc_file, frame=0):
+	""" Read the coordinates, velocities and box of an AMBER NetCDF
+		restart, or a frame of a NetCDF trajectory, into MOL. """
+
+	try:
+		rst = amber_netcdf.load(nc_file, frame)
+	except (ValueError, IndexError) as err:
+		print('-- Error: %s' %err)
 		return False
 
-	print('Reading coordinates ...', end=' ')
+	if rst['coordinates'] is None:
+		print('-- Error: no coordinates found in %s' %nc_file)
+		return False
+
+	return apply_restart(MOL, rst)
+
+def apply_restart(MOL, rst):
+	""" Set the coordinates, velocities and box of MOL from a
+		dictionary returned by load_rst7 or amber_netcdf.load """
 
-	for i in range(0, no_atoms*3, 3):
-		MOL['atom_x'].append(float(items[i]))
-		MOL['atom_y'].append(float(items[i+1]))
-		MOL['atom_z'].append(float(items[i+2]))
+	if rst['time'] is not None:
+		MOL['time'] = rst['time']
+	if rst['temp'] is not None:
+		MOL['temp'] = rst['temp']
 
-	print('OK')
+	# restart of the whole system of a residue filtered read
+	filtered = rst['no_atoms'] != MOL['no_atoms'] and rst['no_atoms'] == MOL.get('parm7_no_atoms', None)
 
-	# read optional velocities
-	if len(items) >= no_atoms*6:
-		print('Reading velocities ...', end=' ')
+	if rst['no_atoms'] != MOL['no_atoms'] and not filtered:
+		print('-- Error: RST7 no_atoms mismatch with the PARM7 file.')
+		return False
 
-		for i in range(no_atoms*3, no_atoms*6, 3):
-			MOL['atom_vx'].append(float(items[i]))
-			MOL['atom_vy'].append(float(items[i+1]))
-			MOL['atom_vz'].append(float(items[i+2]))
+	if filtered:
+		rst = dict(rst, coordinates=kept_rows(MOL, rst['coordinates']))
+		if rst['velocities'] is not None:
+			rst['velocities'] = kept_rows(MOL, rst['velocities'])
+
+	openmol.info('Reading coordinates ...', end=' ')
+	xyz = rst['coordinates']
+	openmol.set_field(MOL, 'atom_x', xyz[:, 0])
+	openmol.set_field(MOL, 'atom_y', xyz[:, 1])
+	openmol.set_field(MOL, 'atom_z', xyz[:, 2])
+	openmol.info('OK')
+
+	if rst['velocities'] is not None:
+		openmol.info('Reading velocities ...', end=' ')
+		vel = rst['velocities']
+		openmol.set_field(MOL, 'atom_vx', vel[:, 0])
+		openmol.set_field(MOL, 'atom_vy', vel[:, 1])
+		openmol.set_field(MOL, 'atom_vz', vel[:, 2])
+		openmol.info('OK')
+
+	if rst['box'] is not None:
+		openmol.info('Reading box dimension ...', end=' ')
+		MOL['box_x'], MOL['box_y'], MOL['box_z'] = rst['box'].tolist()
+		openmol.info('OK')
+	else:
+		openmol.info('-- No PBC box information found.')
 
-		print('OK')
+	if rst['angles'] is not None:
+		openmol.info('Reading box angles ...', end=' ')
+		MOL['box_alpha'], MOL['box_beta'], MOL['box_gamma'] = rst['angles'].tolist()
+		openmol.info('OK')
 
-	box_size_conditions = [
-		len(items) == no_atoms*3 + 3,	# x,y,z coordinates + a,b,c
-		len(items) == no_atoms*6 + 3,	# x,y,z coordinates and velocities + a,b,c
-		len(items) == no_atoms*3 + 6,	# x,y,z coordinates + a,b,c + angles
-		len(items) == no_atoms*6 + 6,	# x,y,z coordinates and velocities + a,b,c + angles
-	]
+	openmol.info('Reading Done')
+	return MOL
 
-	if any(box_size_conditions):
-		print('Reading box dimension ...', end=' ')
-		parts = last_line.split()
-		MOL['box_x'] = float(parts[0])
-		MOL['box_y'] = float(parts[1])
-		MOL['box_z'] = float(parts[2])
+def read_restart(MOL, rst7, frame=0):
+	""" Read the coordinates, velocities and box from an ASCII
+		restart, or a NetCDF restart or trajectory frame, into MOL. """
 
-		print('OK')
+	if not os.path.isfile(rst7):
+		print('-- Error: restart file %s not found.' %rst7)
+		return False
+
+	stage = openmol.Stage('read', 'restart', rst7)
+
+	if amber_netcdf.is_netcdf(rst7):
+		MOL = read_netcdf(MOL, rst7, frame)
 	else:
-		print('-- No PBC box information found.')
+		MOL = read_rst7(MOL, rst7)
 
-	box_angle_conditions = [
-		len(items) == no_atoms*3 + 6,
-		len(items) == no_atoms*6 + 6,
-	]
+	if MOL:
+		if stage.active:
+			stage.bytes = os.path.getsize(rst7)
+		stage.done(MOL['no_atoms'])
+
+	return MOL
 
-	if any(box_angle_conditions):
-		print('Reading box angles ...', end=' ')
-		parts = last_line.split()
-		MOL['box_alpha'] = float(parts[3])
-		MOL['box_beta'] = float(parts[4])
-		MOL['box_gamma'] = float(parts[5])
+def restart_state(MOL):
+	""" Current values of the MOL items that a restart sets. """
+	return {key: MOL[key] for key in restart_fields if key in MOL}
 
-		print('OK')
+def overlay_restart(MOL, rst7, state, frame=0):
+	""" Replace the coordinates, velocities and box of an already read,
+		and possibly built, MOL by those of a restart file. The topology
+		is not touched. The items are first reset to a restart_state(),
+		so nothing is left over from a previous restart. """
+
+	for key in restart_fields:
+		if key in state:
+			MOL[key] = state[key]
+		elif key in MOL:
+			del MOL[key]
+
+	MOL = read_restart(MOL, rst7, frame)
+
+	if not MOL or not openmol.check(MOL):
+		return False
 
-	print('Reading Done')
 	return MOL
 
-def read(prmtop, rst7):
-	MOL = read_prmtop(prmtop)
+def snapshots(MOL, rst_files, frame=0):
+	""" Overlay many restarts of the same system one by one on a MOL
+		read with read_prmtop() and built once, e.g. with
+		lammps_full.build(). Yields each restart file and the same MOL
+		updated in place, or False if the restart failed. """
+
+	state = restart_state(MOL)
+
+	for rst7 in rst_files:
+		yield rst7, overlay_restart(MOL, rst7, state, frame)
+
+def read(prmtop, rst7, frame=0, exclude=None, residues=None):
+	""" Read a PARM7 file and its coordinates from an ASCII restart,
+		or a NetCDF restart or trajectory frame. Residues can be
+		left out, see read_prmtop(). """
+
+	MOL = read_prmtop(prmtop, exclude=exclude, residues=residues)
 	if not MOL:
 		return False
-	
-	MOL = read_rst7(MOL, rst7)
-	if not openmol.check(MOL):
+
+	MOL = read_restart(MOL, rst7, frame)
+
+	if not MOL or not openmol.check(MOL):
 		return False
 
 	return MOL
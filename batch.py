@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+""" Convert many AMBER systems in parallel.
+
+	Reads a manifest of prmtop/rst7 pairs and output files, runs each
+	conversion in a process pool and writes a summary of the timings
+	and the errors. A failing system does not stop the others.
+	The converters run quietly, the time of each of their stages is
+	recorded instead and the slowest stages overall are reported.
+	Systems sharing a prmtop, e.g. many snapshots of a simulation,
+	read and build the topology only once.
+
+	Manifest, one system per line, # for comments:
+		<prmtop> <rst7> <output> [full|qmag|mol2|json]
+
+	The output style defaults to the output file extension, .json or
+	.mol2, LAMMPS atom_style full otherwise.
+
+	Usage:
+		batch.py manifest.txt [-j processes] [-s summary.json]
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+
+import openmol
+import amber_parm7 as parm
+import lammps_full
+import lammps_qmag
+import tripos_mol2 as mol2
+
+styles = ['full', 'qmag', 'mol2', 'json']
+
+builders = {
+	'full': lammps_full.build,
+	'qmag': lammps_qmag.build,
+	'mol2': mol2.build,
+}
+
+writers = {
+	'full': lammps_full.Writer,
+	'qmag': lammps_qmag.Writer,
+	'mol2': mol2.Writer,
+}
+
+# no. of output lines kept in the summary of a failed system
+LOG_TAIL = 20
+
+# no. of the slowest stages printed at the end of a run
+HOT_SPOTS = 5
+
+
+def read_manifest(manifest):
+	""" Parse a manifest file into a list of jobs. Relative paths
+		are taken relative to the manifest. Returns None if a line
+		is invalid. """
+
+	base = os.path.dirname(os.path.abspath(manifest))
+	jobs = []
+
+	for line_no, line in enumerate(open(manifest, 'r'), 1):
+		line = line.strip()
+
+		if len(line) == 0 or line.startswith('#'):
+			continue
+
+		parts = line.split()
+
+		if len(parts) < 3 or len(parts) > 4:
+			print('-- Error: Invalid manifest [line %d]:\n%s' %(line_no, line))
+			return None
+
+		prmtop, rst7, output = [os.path.join(base, p) for p in parts[:3]]
+
+		if len(parts) > 3:
+			style = parts[3]
+		elif output.endswith('.json'):
+			style = 'json'
+		elif output.endswith('.mol2'):
+			style = 'mol2'
+		else:
+			style = 'full'
+
+		if style not in styles:
+			print('-- Error: Unknown output style %s [line %d]' %(style, line_no))
+			return None
+
+		jobs.append({'prmtop': prmtop, 'rst7': rst7, 'output': output, 'style': style})
+
+	return jobs
+
+
+def failed(result, err, stage, log):
+	""" Record the error of a failed system in its result. """
+	result['error'] = '%s during %s: %s' %(type(err).__name__, stage, err)
+	result['traceback'] = traceback.format_exc()
+	result['log'] = log.getvalue().splitlines()[-LOG_TAIL:]
+	return result
+
+
+def convert(jobs):
+	""" Convert the systems of a group sharing a prmtop and an output
+		style. The topology is read and built once, then each restart
+		is overlaid on it and written. The output of the converters is
+		captured. Never raises, returns a result dictionary per system
+		with the time of each stage and the error if any. """
+
+	results = [dict(job, ok=False, error=None, times={}, stages=[]) for job in jobs]
+	style = jobs[0]['style']
+
+	# progress messages are not needed, errors are still captured
+	openmol.set_quiet()
+
+	log = io.StringIO()
+	start = time.perf_counter()
+	stage = 'topology'
+
+	try:
+		with contextlib.redirect_stdout(log), openmol.record_stages() as events:
+			MOL = parm.read_prmtop(jobs[0]['prmtop'])
+			if not MOL:
+				raise ValueError('failed to read %s' %jobs[0]['prmtop'])
+
+			if style in builders:
+				MOL = builders[style](MOL)
+				if not MOL:
+					raise ValueError('failed to build %s output' %style)
+
+			state = parm.restart_state(MOL)
+
+	except Exception as err:
+		for result in results:
+			failed(result, err, stage, log)
+			result['time'] = 0.0
+
+		results[0]['time'] = time.perf_counter() - start
+		return results
+
+	topology = time.perf_counter() - start
+	results[0]['stages'].extend(events)
+
+	for result in results:
+		log = io.StringIO()
+		start = mark = time.perf_counter()
+		stage = 'read'
+
+		try:
+			with contextlib.redirect_stdout(log), openmol.record_stages() as events:
+				SNAP = parm.overlay_restart(MOL, result['rst7'], state)
+				if not SNAP:
+					raise ValueError('failed to read %s' %result['rst7'])
+				result['no_atoms'] = SNAP['no_atoms']
+				result['times'][stage] = time.perf_counter() - mark
+
+				stage = 'write'
+				mark = time.perf_counter()
+
+				if style == 'json':
+					openmol.write_json(SNAP, result['output'])
+				elif writers[style](SNAP, result['output']).write() is False:
+					raise ValueError('failed to write %s' %result['output'])
+				result['times'][stage] = time.perf_counter() - mark
+
+			result['ok'] = True
+
+		except Exception as err:
+			failed(result, err, stage, log)
+
+		result['stages'].extend(events)
+		result['time'] = time.perf_counter() - start
+
+	# the shared topology time is counted for the first system
+	results[0]['times']['topology'] = topology
+	results[0]['time'] += topology
+
+	return results
+
+
+def groups(jobs, processes):
+	""" Group the jobs by prmtop and output style, so a topology is
+		read only once per group. Big groups are split in up to one
+		chunk per process to keep all the cores busy. Yields lists
+		of job indices. """
+
+	processes = processes or os.cpu_count() or 1
+	grouped = {}
+
+	for i, job in enumerate(jobs):
+		grouped.setdefault((job['prmtop'], job['style']), []).append(i)
+
+	for indices in grouped.values():
+		chunks = min(len(indices), processes)
+		for c in range(chunks):
+			yield indices[c::chunks]
+
+
+def hot_spots(results):
+	""" Total time, records and bytes of each stage of the
+		converters over all the systems, slowest first. The whole
+		file stages are left out, they include the others. """
+
+	totals = {}
+
+	for result in results:
+		for event in result.get('stages', []):
+			if event['stage'] == 'total':
+				continue
+
+			key = '%s %s' %(event['kind'], event['stage'])
+			total = totals.setdefault(key, {'stage': key, 'time': 0.0, 'records': 0, 'bytes': 0, 'count': 0})
+			total['time'] += event['time']
+			total['records'] += event['records']
+			total['bytes'] += event['bytes']
+			total['count'] += 1
+
+	return sorted(totals.values(), key=lambda t: t['time'], reverse=True)
+
+
+def run(jobs, processes=None, summary_file=None):
+	""" Run the conversions in a pool of processes, one per core
+		by default. Prints a line per finished system and returns
+		the summary, also saved as JSON if a summary_file is given. """
+
+	start = time.perf_counter()
+	results = [None] * len(jobs)
+	done = 0
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+		futures = {}
+		for indices in groups(jobs, processes):
+			futures[pool.submit(convert, [jobs[i] for i in indices])] = indices
+
+		for future in concurrent.futures.as_completed(futures):
+			indices = futures[future]
+			try:
+				group = future.result()
+			except Exception as err:
+				# the worker itself died, e.g. out of memory
+				group = [dict(jobs[i], ok=False, time=None, times={},
+					error='%s: %s' %(type(err).__name__, err)) for i in indices]
+
+			for i, result in zip(indices, group):
+				results[i] = result
+				done += 1
+
+				status = 'OK' if result['ok'] else 'FAILED'
+				print('[%d/%d] %s %s' %(done, len(jobs), status, result['output']))
+				if not result['ok']:
+					print('-- Error: %s' %result['error'])
+
+	failures = [r for r in results if not r['ok']]
+
+	summary = {
+		'no_systems': len(jobs),
+		'no_failed': len(failures),
+		'processes': processes or os.cpu_count(),
+		'wall_time': time.perf_counter() - start,
+		'cpu_time': sum(r['time'] or 0.0 for r in results),
+		'hot_spots': hot_spots(results),
+		'results': results,
+	}
+
+	print('Converted %d of %d systems in %.2f s (%.2f s total per system time).'
+		%(len(jobs) - len(failures), len(jobs), summary['wall_time'], summary['cpu_time']))
+
+	for total in summary['hot_spots'][:HOT_SPOTS]:
+		print('  %-32s %8.3f s  %10d records  %12d bytes' %(total['stage'], total['time'], total['records'], total['bytes']))
+
+	if summary_file:
+		with open(summary_file, 'w+') as fp:
+			json.dump(summary, fp, indent=2)
+		print('Write OK: %s' %summary_file)
+
+	return summary
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Convert many AMBER systems in parallel.')
+	parser.add_argument('manifest', help='lines of <prmtop> <rst7> <output> [full|qmag|mol2|json]')
+	parser.add_argument('-j', '--processes', type=int, default=None,
+		help='no. of worker processes, default one per core')
+	parser.add_argument('-s', '--summary', default=None, help='save the summary as JSON')
+	args = parser.parse_args(argv)
+
+	jobs = read_manifest(args.manifest)
+	if jobs is None:
+		return 1
+
+	summary = run(jobs, args.processes, args.summary)
+	return 1 if summary['no_failed'] else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
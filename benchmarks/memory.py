@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+""" Memory benchmark of synthetic systems of increasing size.
+
+	For each size, a synthetic system is saved as JSON, then loaded,
+	built and written as a LAMMPS data file. The peak memory of each
+	stage is measured with tracemalloc, and the memory of the largest
+	fields of the built object is reported. The stages run a lot
+	slower while tracing, so no timings are reported.
+
+	Usage: memory.py [no_atoms ...] [-o results.json]
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+
+import argparse
+import json
+import tempfile
+
+import openmol
+import lammps_full as lammps
+
+import synthetic
+
+SIZES = [1000, 10000, 100000]
+
+# no. of the largest fields reported
+TOP_FIELDS = 8
+
+
+def measure(no_atoms, workdir):
+	""" Peak memory of each stage and the per field memory of the
+		built object of a synthetic system. """
+
+	MOL = synthetic.system(no_atoms)
+	json_file = os.path.join(workdir, 'system.json')
+	data_file = os.path.join(workdir, 'system.data')
+	openmol.write_json(MOL, json_file)
+	del MOL
+
+	stages = {}
+
+	with openmol.record_stages(memory=True) as events:
+		MOL = openmol.load_json(json_file)
+		MOL = lammps.build(MOL)
+		lammps.Writer(MOL, data_file).write()
+
+	for event in events:
+		if event['kind'] == 'build' or event['stage'] in ['json', 'total']:
+			stages[event['kind']] = event['memory']
+
+	fields = openmol.memory_usage(MOL)
+
+	return {
+		'no_atoms': MOL['no_atoms'],
+		'stages': stages,
+		'total': sum(fields.values()),
+		'fields': dict(list(fields.items())[:TOP_FIELDS]),
+	}
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Memory benchmark of synthetic systems.')
+	parser.add_argument('sizes', type=int, nargs='*', default=SIZES, help='no. of atoms of each system')
+	parser.add_argument('-o', '--output', default=None, help='save the results as JSON')
+	args = parser.parse_args(argv)
+
+	openmol.set_quiet()
+	results = []
+
+	with tempfile.TemporaryDirectory() as workdir:
+		for no_atoms in args.sizes:
+			result = measure(no_atoms, workdir)
+			results.append(result)
+
+			print('%d atoms, %.1f MB held by the MOL' %(result['no_atoms'], result['total'] / 1e6))
+			for kind, peak in result['stages'].items():
+				print('  %-6s peak %10.1f MB' %(kind, peak / 1e6))
+			for key, size in result['fields'].items():
+				print('  %-24s %10.1f MB' %(key, size / 1e6))
+
+	if args.output:
+		with open(args.output, 'w+') as fp:
+			json.dump(results, fp, indent=2)
+		print('Write OK: %s' %args.output)
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+""" Benchmark suite of the readers, builders and writers on synthetic
+	systems of increasing size, see synthetic.py. The solvent removal
+	runs on a solvated system of the same size.
+
+	Each benchmark is timed, best of a few repeats, and then run once
+	more under tracemalloc for its peak memory. Reports the time, the
+	throughput in atoms/s and the peak memory. With a baseline of a
+	previous run, the benchmarks that got slower are reported and the
+	exit status is 1.
+
+	Usage:
+		suite.py [-s no_atoms ...] [-r repeats] [-o results.json]
+				 [-b baseline.json] [-t tolerance] [-w workdir]
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+
+import openmol
+import amber_parm7 as parm
+import lammps_full as lammps
+import tripos_mol2 as mol2
+import subset
+
+import synthetic
+
+SIZES = [1000, 10000, 100000]
+REPEATS = 3
+
+# allowed fractional drop of the throughput against a baseline
+TOLERANCE = 0.2
+
+
+def fresh(MOL):
+	""" A copy of MOL with its own lists, so that a builder extending
+		the fields in place does not change the input of the next run. """
+	return openmol.AttrDict({key: value[:] if isinstance(value, (list, openmol.Column)) else value
+		for key, value in MOL.items()})
+
+
+def benchmarks(files, workdir):
+	""" The benchmarks as (name, setup, run) tuples. setup returns the
+		input of run, it is not timed. """
+
+	out = os.path.join(workdir, 'out')
+	inputs = {}
+
+	def amber():
+		if 'amber' not in inputs:
+			inputs['amber'] = parm.read(files['prmtop'], files['rst7'])
+		return fresh(inputs['amber'])
+
+	def built(builder, key):
+		def setup():
+			if key not in inputs:
+				inputs[key] = builder(amber())
+			return inputs[key]
+		return setup
+
+	def tripos():
+		if 'tripos' not in inputs:
+			inputs['tripos'] = mol2.read(files['mol2'])
+		return fresh(inputs['tripos'])
+
+	def solvated():
+		if 'solvated' not in inputs:
+			inputs['solvated'] = parm.read(files['solvated']['prmtop'], files['solvated']['rst7'])
+		return fresh(inputs['solvated'])
+
+	def json_file():
+		openmol.write_json(amber(), out + '.json')
+		return out + '.json'
+
+	return [
+		('amber_parm7.read', lambda: None, lambda _: parm.read(files['prmtop'], files['rst7'])),
+		('lammps_full.build', amber, lammps.build),
+		('lammps_full.Writer.write', built(lammps.build, 'lammps'), lambda MOL: lammps.Writer(MOL, out + '.data').write()),
+		('tripos_mol2.read', lambda: None, lambda _: mol2.read(files['mol2'])),
+		('tripos_mol2.build', tripos, mol2.build),
+		('tripos_mol2.Writer.write', built(mol2.build, 'mol2'), lambda MOL: mol2.Writer(MOL, out + '.mol2').write()),
+		('openmol.write_json', amber, lambda MOL: openmol.write_json(MOL, out + '.json')),
+		('openmol.load_json', json_file, openmol.load_json),
+		('subset.strip', solvated, subset.strip),
+		('amber_parm7.read(exclude)', lambda: None, lambda _: parm.read(files['solvated']['prmtop'],
+			files['solvated']['rst7'], exclude=['WAT', 'Na+', 'Cl-'])),
+	]
+
+
+def measure(setup, run, repeats):
+	""" Best wall time of the repeats and the peak memory of run. """
+
+	best = None
+	for i in range(repeats):
+		data = setup()
+		gc.collect()
+
+		start = time.perf_counter()
+		result = run(data)
+		elapsed = time.perf_counter() - start
+
+		if result is False:
+			raise RuntimeError('benchmark failed, see the errors above')
+
+		best = elapsed if best is None else min(best, elapsed)
+		del data, result
+
+	data = setup()
+	gc.collect()
+
+	tracemalloc.start()
+	run(data)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return best, peak
+
+
+def run_size(no_atoms, workdir, repeats):
+	prefix = os.path.join(workdir, 'synthetic_%d' %no_atoms)
+	results = []
+
+	# the warnings of the converters are only shown if one fails
+	log = io.StringIO()
+
+	try:
+		with contextlib.redirect_stdout(log):
+			files = synthetic.generate(no_atoms, prefix)
+			files['solvated'] = synthetic.generate(no_atoms, prefix + '_solvated', ['rst7'], solvent=True)
+			atoms = parm.read_prmtop(files['prmtop'], lazy=True)['no_atoms']
+	except Exception:
+		print(log.getvalue())
+		raise
+
+	for name, setup, run in benchmarks(files, workdir):
+		log = io.StringIO()
+
+		try:
+			with contextlib.redirect_stdout(log):
+				elapsed, peak = measure(setup, run, repeats)
+		except Exception:
+			print(log.getvalue())
+			raise
+
+		results.append({
+			'name': name,
+			'no_atoms': atoms,
+			'time': elapsed,
+			'atoms_per_s': atoms / elapsed if elapsed else None,
+			'peak_memory': peak,
+		})
+
+		print('%-26s %10d atoms %9.3f s %12.0f atoms/s %10.1f MB'
+			%(name, atoms, elapsed, results[-1]['atoms_per_s'], peak / 1e6), flush=True)
+
+	return results
+
+
+def regressions(results, baseline, tolerance):
+	""" Benchmarks slower than the baseline by more than the tolerance """
+
+	previous = {(r['name'], r['no_atoms']): r for r in baseline}
+	slower = []
+
+	for result in results:
+		old = previous.get((result['name'], result['no_atoms']))
+		if old and old['atoms_per_s'] and result['atoms_per_s'] < old['atoms_per_s'] * (1.0 - tolerance):
+			slower.append((result, old))
+
+	return slower
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmark the readers and writers on synthetic systems.')
+	parser.add_argument('-s', '--sizes', type=float, nargs='+', default=SIZES, help='no. of atoms, upto 1e7')
+	parser.add_argument('-r', '--repeats', type=int, default=REPEATS, help='timed runs of each benchmark')
+	parser.add_argument('-o', '--output', default=None, help='save the results as JSON')
+	parser.add_argument('-b', '--baseline', default=None, help='results of a previous run to compare with')
+	parser.add_argument('-t', '--tolerance', type=float, default=TOLERANCE, help='allowed throughput drop')
+	parser.add_argument('-w', '--workdir', default=None, help='directory of the synthetic input files')
+	args = parser.parse_args(argv)
+
+	openmol.set_quiet()
+	results = []
+
+	with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+		for no_atoms in args.sizes:
+			results.extend(run_size(int(no_atoms), workdir, args.repeats))
+
+	if args.output:
+		with open(args.output, 'w+') as fp:
+			json.dump(results, fp, indent=2)
+		print('Write OK: %s' %args.output)
+
+	if args.baseline:
+		with open(args.baseline, 'r') as fp:
+			slower = regressions(results, json.load(fp), args.tolerance)
+
+		for result, old in slower:
+			print('-- Regression: %s at %d atoms, %.0f atoms/s, was %.0f atoms/s'
+				%(result['name'], result['no_atoms'], result['atoms_per_s'], old['atoms_per_s']))
+
+		if slower:
+			return 1
+
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+
+""" Synthetic systems for the benchmarks, made of copies of the
+	oleylamine example placed on a cubic lattice. Each copy keeps the
+	topology and the force field of the template, the atom, residue
+	and bonded indices are shifted.
+
+	The PRMTOP of a system is written by tiling the sections of the
+	template file, including the ones openmol does not read, so all
+	the sections have the sizes of a real file of that many atoms.
+
+	A solvated system has 9 solvent atoms per solute atom, as a box
+	of TIP3P waters on top of the copies with NaCl at 0.15 M. The
+	water and the ions are appended to the tiled sections as residues
+	WAT, Na+ and Cl-, with their own atom, bond and angle types.
+
+	Usage: synthetic.py <no_atoms> [-o prefix] [-f prmtop rst7 mol2] [-s]
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+
+import argparse
+import math
+
+import numpy as np
+
+import openmol
+import amber_parm7 as parm
+import tripos_mol2 as mol2
+
+TEMPLATE_PRMTOP = os.path.join(HERE, '..', 'examples', 'oleylamine.prmtop')
+TEMPLATE_RST7 = os.path.join(HERE, '..', 'examples', 'oleylamine.rst7')
+
+# prefixes of the per item fields, and the count of the items
+groups = [
+	('atom_', 'no_atoms'),
+	('pair_ff_index', 'no_atoms'),
+	('bond_', 'no_bonds'),
+	('angle_', 'no_angles'),
+	('dihed_', 'no_diheds'),
+	('residue_', 'no_residues'),
+]
+
+# fields of atom or residue indices, shifted for each copy
+index_fields = {
+	'bond_from': 'no_atoms',	'bond_to': 'no_atoms',
+	'angle_a': 'no_atoms',		'angle_b': 'no_atoms',		'angle_c': 'no_atoms',
+	'dihed_a': 'no_atoms',		'dihed_b': 'no_atoms',
+	'dihed_c': 'no_atoms',		'dihed_d': 'no_atoms',
+	'residue_start': 'no_atoms',	'residue_end': 'no_atoms',
+	'atom_resid': 'no_residues',
+}
+
+# PRMTOP sections of 1 based atom indices, 0 for none
+atom_index_sections = ['RESIDUE_POINTER', 'EXCLUDED_ATOMS_LIST']
+
+# PARM7 pointers of the per item counts
+scaled_pointers = ['NATOM', 'NBONH', 'MBONA', 'NTHETH', 'MTHETA', 'NPHIH', 'MPHIA',
+				'NNB', 'NRES', 'NBONA', 'NTHETA', 'NPHIA']
+
+# PARM7 pointers of the no. of types, added up for the solvent
+type_pointers = ['NTYPES', 'NUMBND', 'NUMANG', 'NPTRA', 'NATYP']
+
+# PRMTOP sections of one item per type, and the no. of types
+type_sections = {
+	'BOND_FORCE_CONSTANT': 'NUMBND',		'BOND_EQUIL_VALUE': 'NUMBND',
+	'ANGLE_FORCE_CONSTANT': 'NUMANG',		'ANGLE_EQUIL_VALUE': 'NUMANG',
+	'DIHEDRAL_FORCE_CONSTANT': 'NPTRA',		'DIHEDRAL_PERIODICITY': 'NPTRA',
+	'DIHEDRAL_PHASE': 'NPTRA',				'SCEE_SCALE_FACTOR': 'NPTRA',
+	'SCNB_SCALE_FACTOR': 'NPTRA',			'SOLTY': 'NATYP',
+}
+
+# the type index pointer of each bonded record section
+record_types = {'BONDS': 'NUMBND', 'ANGLES': 'NUMANG', 'DIHEDRALS': 'NPTRA'}
+
+lj_sections = ['NONBONDED_PARM_INDEX', 'LENNARD_JONES_ACOEF', 'LENNARD_JONES_BCOEF']
+
+# solvent atoms per solute atom, and NaCl ion pairs per water at 0.15 M
+SOLVENT_RATIO = 9
+SALT = 0.15 / 55.5
+
+# spacing of the lattice of the solvent molecules, about 1 g/cc of water
+SOLVENT_SPACING = 3.1
+
+# TIP3P water and the Joung-Cheatham ions. The atoms as (name, type,
+# atomic no., mass, charge, radius, screen), the LJ Rmin/2 and epsilon
+# of each type, the bonds and angles as (0 based atoms ..., type) and
+# the bond and angle types as (k, equilibrium value in degree for the
+# angles). All the bonded items of the water include a hydrogen.
+SOLVENT = {
+	'WAT': {
+		'atoms': [('O', 'OW', 8, 16.00, -0.834, 1.5, 0.85),
+				('H1', 'HW', 1, 1.008, 0.417, 0.8, 0.85),
+				('H2', 'HW', 1, 1.008, 0.417, 0.8, 0.85)],
+		'lj': [('OW', 1.7683, 0.1520), ('HW', 0.0, 0.0)],
+		'bonds': [(0, 1, 0), (0, 2, 0), (1, 2, 1)],
+		'bond_types': [(553.0, 0.9572), (553.0, 1.5136)],
+		'angles': [(1, 0, 2, 0), (0, 1, 2, 1), (0, 2, 1, 1)],
+		'angle_types': [(100.0, 104.52), (0.0, 127.74)],
+	},
+	'Na+': {
+		'atoms': [('Na+', 'Na+', 11, 22.99, 1.0, 1.5, 0.8)],
+		'lj': [('Na+', 1.369, 0.0874393)],
+	},
+	'Cl-': {
+		'atoms': [('Cl-', 'Cl-', 17, 35.45, -1.0, 1.7, 0.8)],
+		'lj': [('Cl-', 2.513, 0.0355910)],
+	},
+}
+
+# charge of the electron in the units of the PRMTOP charges
+AMBER_CHARGE = 18.2223
+
+
+def template():
+	""" The oleylamine example as read by amber_parm7 """
+	quiet = not openmol.VERBOSE
+	openmol.set_quiet()
+	MOL = parm.read(TEMPLATE_PRMTOP, TEMPLATE_RST7)
+	openmol.set_quiet(quiet)
+	return MOL
+
+
+def count_of(key):
+	for prefix, count in groups:
+		if key.startswith(prefix):
+			return count
+	return None
+
+
+def tile(MOL, copies):
+	""" A new MOL of copies of MOL on a cubic lattice of its box. """
+
+	side = math.ceil(copies ** (1.0 / 3.0))
+	box = np.array([MOL['box_x'], MOL['box_y'], MOL['box_z']])
+
+	SYS = openmol.AttrDict(dict(MOL))
+
+	for key, value in MOL.items():
+		count = count_of(key)
+		if count is None or isinstance(value, str) or len(value) == 0 or len(value) != MOL[count]:
+			continue
+
+		if key in ['atom_x', 'atom_y', 'atom_z']:
+			axis = ['atom_x', 'atom_y', 'atom_z'].index(key)
+			cells = np.arange(copies) // side ** axis % side
+			values = np.tile(np.asarray(value, dtype=np.float64), copies)
+			values += np.repeat(cells * box[axis], len(value))
+
+		elif key in index_fields:
+			shift = np.repeat(np.arange(copies) * MOL[index_fields[key]], len(value))
+			values = np.tile(np.asarray(value, dtype=np.int64), copies) + shift
+
+		elif isinstance(value, openmol.Column) or not isinstance(value[0], str):
+			values = np.tile(np.asarray(value), copies)
+
+		else:
+			SYS[key] = list(value) * copies
+			continue
+
+		openmol.set_field(SYS, key, values)
+
+	for count in set(count for prefix, count in groups):
+		SYS[count] = MOL[count] * copies
+
+	for pointer in scaled_pointers:
+		SYS['PARM_%s' %pointer] = MOL['PARM_%s' %pointer] * copies
+
+	SYS['box_x'], SYS['box_y'], SYS['box_z'] = (box * side).tolist()
+	SYS['title'] = '%s x %d' %(MOL['title'], copies)
+
+	return SYS
+
+
+def system(no_atoms):
+	""" A synthetic system of about no_atoms atoms """
+	MOL = template()
+	return tile(MOL, max(1, round(no_atoms / MOL['no_atoms'])))
+
+
+def write_fixed(fp, values, item, per_line):
+	""" Write the values in fixed width lines of per_line items,
+		formatted by the old style item format, chunk by chunk. """
+
+	n = len(values)
+	full = n // per_line
+	line = item * per_line + '\n'
+	rows = openmol.WRITE_CHUNK // per_line
+
+	for start in range(0, full, rows):
+		k = min(rows, full - start)
+		chunk = values[start * per_line:(start + k) * per_line]
+		fp.write((line * k) % tuple(np.asarray(chunk).tolist()))
+
+	tail = values[full * per_line:]
+	if len(tail) or n == 0:
+		fp.write((item * len(tail) + '\n') % tuple(np.asarray(tail).tolist()))
+
+
+def item_format(sformat):
+	""" Old style format of an item of a fortran %FORMAT spec """
+	count, kind, width = parm.parse_format(sformat)
+
+	if kind == 'I':
+		return '%%%dd' %width, count
+
+	if kind in 'EFD':
+		decimals = int(sformat.split('.')[1]) if '.' in sformat else 0
+		return '%%%d.%d%s' %(width, decimals, 'f' if kind == 'F' else 'E'), count
+
+	return '%%-%d.%ds' %(width, width), count
+
+
+def tile_section(name, values, copies, natom, nres):
+	""" Items of a PRMTOP section of copies of the template,
+		None if the section is the same for any no. of copies. """
+
+	if name in parm.record_sizes:
+		# 3 x 0 based atom indices, the last item is the type index
+		size = parm.record_sizes[name]
+		records = values.reshape(-1, size)
+		shift = np.zeros(size, dtype=np.int64)
+		shift[:-1] = 3 * natom
+
+		tiled = np.tile(records, (copies, 1))
+		offset = np.repeat(np.arange(copies), len(records))[:, None] * shift
+		# negative indices flag the dihedrals not counted in 1-4 terms
+		tiled += np.sign(tiled) * offset
+		tiled[tiled == 0] += offset[tiled == 0]
+		return tiled.ravel()
+
+	if name in atom_index_sections:
+		values = np.asarray(values, dtype=np.int64)
+		offset = np.repeat(np.arange(copies) * natom, len(values))
+		tiled = np.tile(values, copies)
+		return np.where(tiled > 0, tiled + offset, 0)
+
+	if len(values) == natom or name == 'RESIDUE_LABEL':
+		if isinstance(values, list):
+			return values * copies
+		return np.tile(values, copies)
+
+	return None
+
+
+def pointer_of(values, pointer):
+	return int(values['POINTERS'][parm.pointers.index(pointer)])
+
+
+def template_sections(raw, index):
+	""" Decoded sections of a PRMTOP, but the title """
+	return {entry['name']: parm.decode_section(raw[entry['start']:entry['end']], entry['sformat'])
+		for entry in index['sections'] if entry['name'] != 'TITLE'}
+
+
+def solvent_sections(name, no_pointers):
+	""" The PRMTOP sections of a solvent residue of SOLVENT """
+
+	molecule = SOLVENT[name]
+	atoms = molecule['atoms']
+	natom = len(atoms)
+	types = [t[0] for t in molecule['lj']]
+	bonds = np.array(molecule.get('bonds', []), dtype=np.int64).reshape(-1, 3)
+	angles = np.array(molecule.get('angles', []), dtype=np.int64).reshape(-1, 4)
+	bond_types = np.array(molecule.get('bond_types', []), dtype=np.float64).reshape(-1, 2)
+	angle_types = np.array(molecule.get('angle_types', []), dtype=np.float64).reshape(-1, 2)
+
+	# 3 x 0 based atom indices, 1 based type index
+	records = {}
+	for key, items in [('BONDS', bonds), ('ANGLES', angles), ('DIHEDRALS', np.zeros((0, 5), dtype=np.int64))]:
+		items = items.copy()
+		items[:, :-1] *= 3
+		items[:, -1] += 1
+		records[key + '_INC_HYDROGEN'] = items.ravel()
+		records[key + '_WITHOUT_HYDROGEN'] = np.zeros(0, dtype=np.int64)
+
+	# the molecules are small, each atom excludes the ones after it
+	excluded = [list(range(i + 2, natom + 1)) or [0] for i in range(natom)]
+
+	# Lorentz-Berthelot mixing of the types of the molecule
+	rmin = np.array([t[1] for t in molecule['lj']])
+	epsilon = np.array([t[2] for t in molecule['lj']])
+	i, j = np.tril_indices(len(types))
+	r, e = rmin[i] + rmin[j], np.sqrt(epsilon[i] * epsilon[j])
+
+	ntypes = len(types)
+	lo, hi = np.minimum.outer(np.arange(ntypes), np.arange(ntypes)), np.maximum.outer(np.arange(ntypes), np.arange(ntypes))
+
+	pointer_values = dict(NATOM=natom, NTYPES=ntypes, NBONH=len(bonds), NTHETH=len(angles),
+		NNB=sum(map(len, excluded)), NRES=1, NUMBND=len(bond_types), NUMANG=len(angle_types),
+		NATYP=ntypes, NMXRS=natom)
+	pointers = np.zeros(no_pointers, dtype=np.int64)
+	for pointer, value in pointer_values.items():
+		pointers[parm.pointers.index(pointer)] = value
+
+	sections = {
+		'POINTERS': pointers,
+		'ATOM_NAME': [a[0] for a in atoms],
+		'CHARGE': np.array([a[4] * AMBER_CHARGE for a in atoms]),
+		'ATOMIC_NUMBER': np.array([a[2] for a in atoms], dtype=np.int64),
+		'MASS': np.array([a[3] for a in atoms]),
+		'ATOM_TYPE_INDEX': np.array([types.index(a[1]) + 1 for a in atoms], dtype=np.int64),
+		'NUMBER_EXCLUDED_ATOMS': np.array([len(x) for x in excluded], dtype=np.int64),
+		'NONBONDED_PARM_INDEX': (hi * (hi + 1) // 2 + lo + 1).ravel(),
+		'RESIDUE_LABEL': [name],
+		'RESIDUE_POINTER': np.array([1], dtype=np.int64),
+		'BOND_FORCE_CONSTANT': bond_types[:, 0],
+		'BOND_EQUIL_VALUE': bond_types[:, 1],
+		'ANGLE_FORCE_CONSTANT': angle_types[:, 0],
+		'ANGLE_EQUIL_VALUE': np.radians(angle_types[:, 1]),
+		'SOLTY': np.zeros(ntypes),
+		'LENNARD_JONES_ACOEF': e * r ** 12,
+		'LENNARD_JONES_BCOEF': 2 * e * r ** 6,
+		'EXCLUDED_ATOMS_LIST': np.array(sum(excluded, []), dtype=np.int64),
+		'AMBER_ATOM_TYPE': [a[1] for a in atoms],
+		'TREE_CHAIN_CLASSIFICATION': ['BLA'] * natom,
+		'JOIN_ARRAY': np.zeros(natom, dtype=np.int64),
+		'IROTAT': np.zeros(natom, dtype=np.int64),
+		'RADII': np.array([a[5] for a in atoms]),
+		'SCREEN': np.array([a[6] for a in atoms]),
+	}
+
+	for key in ['DIHEDRAL_FORCE_CONSTANT', 'DIHEDRAL_PERIODICITY', 'DIHEDRAL_PHASE',
+			'SCEE_SCALE_FACTOR', 'SCNB_SCALE_FACTOR']:
+		sections[key] = np.zeros(0)
+
+	sections.update(records)
+	return sections
+
+
+def part_offsets(parts):
+	""" The no. of atoms and types of the parts before each part """
+
+	offsets = []
+	total = dict.fromkeys(['NATOM'] + type_pointers, 0)
+
+	for values, copies in parts:
+		offsets.append(dict(total))
+		for pointer in total:
+			n = pointer_of(values, pointer)
+			total[pointer] += n * copies if pointer in scaled_pointers else n
+
+	return offsets
+
+
+def shift_section(name, values, offset):
+	""" Shift the atom and type indices of a section of a part by the
+		items of the parts before it. """
+
+	if name in parm.record_sizes:
+		records = values.reshape(-1, parm.record_sizes[name])
+		atoms = records[:, :-1]
+		zero = atoms == 0
+		atoms += np.sign(atoms) * 3 * offset['NATOM']
+		atoms[zero] += 3 * offset['NATOM']
+		records[:, -1] += offset[record_types[name.split('_')[0]]]
+		return records.ravel()
+
+	if name in atom_index_sections:
+		return np.where(values > 0, values + offset['NATOM'], 0)
+
+	if name == 'ATOM_TYPE_INDEX':
+		return values + offset['NTYPES']
+
+	return values
+
+
+def lj_parameters(values):
+	""" Rmin and epsilon of each LJ type of a part, from the A and B
+		coefficients of its pairs of the same type. """
+
+	ntypes = pointer_of(values, 'NTYPES')
+	diagonal = np.asarray(values['NONBONDED_PARM_INDEX']).reshape(ntypes, ntypes).diagonal() - 1
+	a = np.asarray(values['LENNARD_JONES_ACOEF'])[diagonal]
+	b = np.asarray(values['LENNARD_JONES_BCOEF'])[diagonal]
+
+	valid = (a > 0) & (b > 0)
+	rmin = np.where(valid, (2 * a / np.where(valid, b, 1)) ** (1.0 / 6.0), 0.0)
+	epsilon = np.where(valid, b * b / (4 * np.where(valid, a, 1)), 0.0)
+	return rmin, epsilon
+
+
+def combine_lj(parts):
+	""" The LJ sections of all the types of the parts. The pairs of the
+		types of a part are kept as they are, the others are mixed by
+		the Lorentz-Berthelot rules. """
+
+	types = [(p, t) for p, (values, copies) in enumerate(parts) for t in range(pointer_of(values, 'NTYPES'))]
+	params = [lj_parameters(values) for values, copies in parts]
+	acoef, bcoef = [], []
+
+	for i in range(len(types)):
+		for j in range(i + 1):
+			(p, a), (q, b) = types[i], types[j]
+
+			if p == q:
+				values = parts[p][0]
+				k = values['NONBONDED_PARM_INDEX'][a * pointer_of(values, 'NTYPES') + b] - 1
+				acoef.append(values['LENNARD_JONES_ACOEF'][k])
+				bcoef.append(values['LENNARD_JONES_BCOEF'][k])
+			else:
+				r = (params[p][0][a] + params[q][0][b]) / 2
+				e = math.sqrt(params[p][1][a] * params[q][1][b])
+				acoef.append(e * r ** 12)
+				bcoef.append(2 * e * r ** 6)
+
+	n = np.arange(len(types))
+	lo, hi = np.minimum.outer(n, n), np.maximum.outer(n, n)
+
+	return {
+		'NONBONDED_PARM_INDEX': (hi * (hi + 1) // 2 + lo + 1).ravel(),
+		'LENNARD_JONES_ACOEF': np.array(acoef, dtype=np.float64),
+		'LENNARD_JONES_BCOEF': np.array(bcoef, dtype=np.float64),
+	}
+
+
+def combine_section(name, parts, offsets):
+	""" Items of a PRMTOP section of the parts, as (sections, copies),
+		None if the section is the one of the first part. """
+
+	if name == 'POINTERS':
+		values = parts[0][0]['POINTERS'].copy()
+		for i, pointer in enumerate(parm.pointers[:len(values)]):
+			items = [(int(v['POINTERS'][i]), copies) for v, copies in parts]
+			if pointer in scaled_pointers:
+				values[i] = sum(n * copies for n, copies in items)
+			elif pointer in type_pointers:
+				values[i] = sum(n for n, copies in items)
+			elif pointer == 'NMXRS':
+				values[i] = max(n for n, copies in items)
+		return values
+
+	if len(parts) > 1 and name in type_sections:
+		return np.concatenate([np.asarray(values[name], dtype=np.float64) for values, copies in parts])
+
+	if len(parts) > 1 and name in lj_sections:
+		return combine_lj(parts)[name]
+
+	items = []
+	for (values, copies), offset in zip(parts, offsets):
+		tiled = tile_section(name, values[name], copies, pointer_of(values, 'NATOM'), pointer_of(values, 'NRES'))
+		if tiled is None:
+			return None
+		items.append(shift_section(name, tiled, offset))
+
+	if isinstance(items[0], list):
+		return sum(items, [])
+
+	return np.concatenate(items)
+
+
+def write_prmtop(copies, prmtop_file, template=TEMPLATE_PRMTOP, solvent=None):
+	""" Write a PRMTOP of copies of the template PRMTOP, followed by
+		the residues of SOLVENT given as {name: count}. """
+
+	index = parm.index_prmtop(template)
+
+	with open(template, 'rb') as fp:
+		raw = fp.read().decode('latin-1')
+
+	values = template_sections(raw, index)
+	parts = [(values, copies)]
+	for name, count in (solvent or {}).items():
+		if count:
+			parts.append((solvent_sections(name, len(values['POINTERS'])), count))
+
+	offsets = part_offsets(parts)
+
+	with open(prmtop_file, 'w+') as fp:
+		fp.write(raw[:index['sections'][0]['flag']])
+
+		for entry in index['sections']:
+			# the %FLAG, %COMMENT and %FORMAT lines as they are
+			fp.write(raw[entry['flag']:entry['start']])
+			data = raw[entry['start']:entry['end']]
+
+			items = None
+			if entry['name'] != 'TITLE':
+				items = combine_section(entry['name'], parts, offsets)
+
+			if items is None:
+				fp.write(data)
+			else:
+				item, per_line = item_format(entry['sformat'])
+				write_fixed(fp, items, item, per_line)
+
+	openmol.info('Write OK: %s' %prmtop_file)
+
+
+def solvent_counts(solvent_atoms):
+	""" No. of molecules of each residue of SOLVENT """
+	pairs = max(1, round(solvent_atoms / 3 * SALT))
+	return {'WAT': max(1, (solvent_atoms - 2 * pairs) // 3), 'Na+': pairs, 'Cl-': pairs}
+
+
+def solvent_coordinates(counts, box):
+	""" Coordinates of the solvent molecules of counts, on a lattice
+		on top of a box of the solute. Returns the coordinates and the
+		height of the solvent box. """
+
+	nx = max(1, int(box[0] // SOLVENT_SPACING))
+	ny = max(1, int(box[1] // SOLVENT_SPACING))
+	total = sum(counts.values())
+	layers = math.ceil(total / (nx * ny))
+
+	site = np.arange(total)
+	sites = np.column_stack([site % nx, site // nx % ny, site // (nx * ny)]) * SOLVENT_SPACING
+	sites[:, 2] += box[2] + SOLVENT_SPACING / 2
+
+	# water in the xy plane, H-O-H of the equilibrium geometry
+	bond, angle = SOLVENT['WAT']['bond_types'][0][1], math.radians(SOLVENT['WAT']['angle_types'][0][1])
+	water = np.array([[0.0, 0.0, 0.0], [bond, 0.0, 0.0], [bond * math.cos(angle), bond * math.sin(angle), 0.0]])
+
+	nwat = counts.get('WAT', 0)
+	xyz = [(sites[:nwat, None, :] + water[None, :, :]).reshape(-1, 3), sites[nwat:]]
+	return np.concatenate(xyz), layers * SOLVENT_SPACING
+
+
+def solvated(no_atoms, prmtop_file):
+	""" Write the PRMTOP of a solvated system of about no_atoms atoms,
+		returns the MOL read from it with the coordinates and box. """
+
+	MOL = template()
+	copies = max(1, round(no_atoms / (1 + SOLVENT_RATIO) / MOL['no_atoms']))
+	counts = solvent_counts(copies * MOL['no_atoms'] * SOLVENT_RATIO)
+	write_prmtop(copies, prmtop_file, solvent=counts)
+
+	SOLUTE = tile(MOL, copies)
+	box = [SOLUTE['box_x'], SOLUTE['box_y'], SOLUTE['box_z']]
+	xyz, height = solvent_coordinates(counts, box)
+
+	quiet = not openmol.VERBOSE
+	openmol.set_quiet()
+	SYS = parm.read_prmtop(prmtop_file)
+	openmol.set_quiet(quiet)
+
+	for axis, key in enumerate(['atom_x', 'atom_y', 'atom_z']):
+		SYS[key] = np.concatenate([np.asarray(SOLUTE[key], dtype=np.float64), xyz[:, axis]]).tolist()
+
+	SYS['box_x'], SYS['box_y'], SYS['box_z'] = box[0], box[1], box[2] + height
+	SYS['box_alpha'] = SYS['box_beta'] = SYS['box_gamma'] = 90.0
+	SYS['title'] = '%s x %d solvated' %(MOL['title'], copies)
+
+	return SYS
+
+
+def write_rst7(MOL, rst7_file):
+	""" Write the coordinates and box of MOL as an ASCII restart. """
+
+	xyz = np.column_stack([np.asarray(MOL[k], dtype=np.float64) for k in ['atom_x', 'atom_y', 'atom_z']])
+
+	with open(rst7_file, 'w+') as fp:
+		fp.write('%s\n%6d\n' %(MOL['title'], MOL['no_atoms']))
+		write_fixed(fp, xyz.ravel(), '%12.7f', 6)
+		write_fixed(fp, [MOL['box_x'], MOL['box_y'], MOL['box_z'],
+				MOL['box_alpha'], MOL['box_beta'], MOL['box_gamma']], '%12.7f', 6)
+
+	openmol.info('Write OK: %s' %rst7_file)
+
+
+def generate(no_atoms, prefix, formats=('prmtop', 'rst7', 'mol2'), solvent=False):
+	""" Write the input files of a synthetic system of about no_atoms
+		atoms as prefix.prmtop, prefix.rst7 and prefix.mol2. Returns
+		the file names of each format. The PRMTOP of a solvated system
+		is always written. """
+
+	files = {}
+
+	if solvent:
+		files['prmtop'] = prefix + '.prmtop'
+		MOL = solvated(no_atoms, files['prmtop'])
+
+	else:
+		MOL = template()
+		copies = max(1, round(no_atoms / MOL['no_atoms']))
+		MOL = tile(MOL, copies)
+
+		if 'prmtop' in formats:
+			files['prmtop'] = prefix + '.prmtop'
+			write_prmtop(copies, files['prmtop'])
+
+	if 'rst7' in formats:
+		files['rst7'] = prefix + '.rst7'
+		write_rst7(MOL, files['rst7'])
+
+	if 'mol2' in formats:
+		files['mol2'] = prefix + '.mol2'
+		quiet = not openmol.VERBOSE
+		openmol.set_quiet()
+		mol2.Writer(mol2.build(MOL), files['mol2']).write()
+		openmol.set_quiet(quiet)
+		openmol.info('Write OK: %s' %files['mol2'])
+
+	return files
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Write the input files of a synthetic system.')
+	parser.add_argument('no_atoms', type=float, help='approximate no. of atoms, e.g. 1e6')
+	parser.add_argument('-o', '--prefix', default='synthetic', help='output file name prefix')
+	parser.add_argument('-f', '--formats', nargs='+', default=['prmtop', 'rst7', 'mol2'],
+		choices=['prmtop', 'rst7', 'mol2'], help='files to write')
+	parser.add_argument('-s', '--solvent', action='store_true', help='add water and NaCl')
+	args = parser.parse_args(argv)
+
+	generate(int(args.no_atoms), args.prefix, args.formats, args.solvent)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+""" Convert an AMBER ASCII trajectory into a LAMMPS dump file,
+	one frame at a time.
+
+	Usage: mdcrd_dump.py <prmtop> <mdcrd> <dump file>
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+import sys
+sys.path.append("..")
+
+import amber_parm7 as parm
+import amber_mdcrd as mdcrd
+import lammps_full as lammps
+
+if len(sys.argv) < 4:
+	print("%s <prmtop> <mdcrd> <dump file>" %sys.argv[0])
+	exit(1)
+
+# only the topology is needed for the atom types and molecule ids
+p = parm.read_prmtop(sys.argv[1])
+p = lammps.build(p)
+
+dump = lammps.DumpWriter(p, sys.argv[3])
+
+for frame in mdcrd.frames(sys.argv[2], p['no_atoms']):
+	dump.frame(frame['coordinates'], frame['box'])
+
+dump.write()
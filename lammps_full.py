@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
-""" LAMMPS dat file writer for atom_style 'full'.
+""" LAMMPS dat file reader and writer for atom_style 'full'.
 
 	This file is a part of OpenMOL python module.
 	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
 
 import math
+import re
+
+import numpy as np
+
 import openmol
 
 # If box info is not set in openmol object
@@ -13,6 +17,32 @@ import openmol
 # of the coordinates. This is the buffer for that.
 BOX_BUFFER = 3.0	# A
 
+# title suffixes added by the writers, removed when reading back
+title_suffixes = [' (generated by OpenMOL lammps_full)', ' ']
+
+# section names of a data file, each on its own line
+section_re = re.compile(r'^[ \t]*(Masses|Pair Coeffs|Bond Coeffs|Angle Coeffs|Dihedral Coeffs|'
+	r'Improper Coeffs|Atoms|Velocities|Bonds|Angles|Dihedrals|Impropers)[ \t]*(#.*)?$', re.M)
+
+# header counts and their MOL items
+header_counts = {
+	'atoms': 'no_atoms',
+	'bonds': 'no_bonds',
+	'angles': 'no_angles',
+	'dihedrals': 'no_diheds',
+	'atom types': 'no_atom_types',
+	'bond types': 'no_bond_types',
+	'angle types': 'no_angle_types',
+	'dihedral types': 'no_dihed_types',
+}
+
+# no. of data items of an Atoms record of each style,
+# LAMMPS may add 3 image flags
+atom_style_items = {
+	'full': 7,
+	'qmag': 8,
+}
+
 def initialize():
 	""" Initialize an openmol object with LAMMPS
 		specific items. """
@@ -31,29 +61,35 @@ def initialize():
 	return MOL
 
 
+def first_occurrence(values):
+	""" Map each distinct value to the index of its first occurrence. """
+	first = {}
+	for i, value in enumerate(values):
+		first.setdefault(value, i)
+	return first
+
+
 def build(MOL):
 	""" Go through the openmol object and see if LAMMPS 
 		specific items are properly calculated. If not,
 		attemt to calculate them. """
 
+	stage = openmol.Stage('build', 'lammps_full')
+
 	# add/update with default lammps items
 	MOL = dict(initialize(), **MOL)
 
 	# build residue id and name list
 	if len(MOL['atom_resname']) == 0:
-		for r, st in enumerate(MOL['residue_start']):
-			res = MOL['residue_name'][r]
-
-			# assume final atom is the last atom of residue
-			end = MOL['no_atoms']
+		starts = np.asarray(MOL['residue_start'], dtype=np.int64)
 
-			# if there are more residues defined, update last atom
-			if len(MOL['residue_start']) > r + 1:
-				end = MOL['residue_start'][r+1]
+		# assume final atom is the last atom of residue,
+		# otherwise the next residue starts after the last atom
+		ends = np.append(starts[1:], MOL['no_atoms'])
+		counts = np.maximum(ends - starts, 0)
 
-			for i in range(st, end):
-				MOL['atom_resid'].append(r)
-				MOL['atom_resname'].append(res)
+		openmol.extend_field(MOL, 'atom_resid', np.repeat(np.arange(len(starts)), counts))
+		MOL['atom_resname'].extend(np.repeat(np.asarray(MOL['residue_name'][:len(starts)], dtype=object), counts).tolist())
 
 	# using parm7 data
 	MOL['no_bond_types'] = len(MOL['FF_bond_k'])
@@ -62,8 +98,9 @@ def build(MOL):
 
 	# if we have individual atom masses list, build type's masses
 	if len(MOL['unique_atom_mass']) == 0 and len(MOL['atom_mass']):
+		first = first_occurrence(MOL['atom_type'])
 		for unique_atom in MOL['unique_atom_types']:
-			i = MOL['atom_type'].index(unique_atom)
+			i = first[unique_atom]
 			MOL['unique_atom_mass'].append(MOL['atom_mass'][i])
 
 	if len(MOL['unique_atom_mass']) != MOL['no_atom_types']:
@@ -102,10 +139,9 @@ def build(MOL):
 
 	# build indices of types
 	if len(MOL['atom_type_index']) != MOL['no_atoms']:
-		MOL['atom_type_index'] = []
-		for i in range(MOL['no_atoms']):
-			atom_type = MOL['atom_type'][i]
-			MOL['atom_type_index'].append(MOL['unique_atom_types'].index(atom_type))
+		type_index = first_occurrence(MOL['unique_atom_types'])
+		type_index = [type_index[atom_type] for atom_type in MOL['atom_type'][:MOL['no_atoms']]]
+		openmol.set_field(MOL, 'atom_type_index', type_index)
 
 	if len(MOL['atom_type_index']) != MOL['no_atoms']:
 		print('-- LAMMPS Build Error: fail to build atom type indices, length mismatch.')
@@ -114,9 +150,13 @@ def build(MOL):
 	if len(MOL['FF_lj_epsilon']) != MOL['no_atom_types'] or len(MOL['FF_lj_sigma']) != MOL['no_atom_types']:
 		MOL['FF_lj_epsilon'] = []
 		MOL['FF_lj_sigma'] = []
+
+		# the first atom of each type
+		types, first = np.unique(np.asarray(MOL['atom_type_index']), return_index=True)
+		first = dict(zip(types.tolist(), first.tolist()))
+
 		for i in range(MOL['no_atom_types']):
-			# get the first atom of this type
-			aix = MOL['atom_type_index'].index(i)
+			aix = first[i]
 			# get parm7 pair ff index of that atom
 			pfx = MOL['pair_ff_index'][aix]
 			MOL['FF_lj_epsilon'].append(MOL['parm7_lj_epsilon'][pfx])
@@ -126,9 +166,290 @@ def build(MOL):
 		print('-- LAMMPS Build Error: fail to build pair coeffs, length mismatch.')
 
 	MOL['_lammps_built'] = True
+	stage.done(MOL['no_atoms'])
+
 	return openmol.AttrDict(MOL)
 
 
+# the blank characters that separate the items of a line
+blank_chars = np.zeros(256, dtype=bool)
+blank_chars[[ord(' '), ord('\t'), ord('\r'), ord('\n')]] = True
+
+
+def items_per_line(body):
+	""" No. of blank separated items of each line of a text """
+
+	buf = np.frombuffer(body.encode('latin-1', 'replace'), dtype=np.uint8)
+	blank = blank_chars[buf]
+
+	# the first character of each item, and the end of each line
+	first = np.flatnonzero(blank[:-1] & ~blank[1:]) + 1
+	if len(buf) and not blank[0]:
+		first = np.append(0, first)
+	ends = np.append(np.flatnonzero(buf == ord('\n')), len(buf))
+
+	return np.diff(np.searchsorted(first, ends), prepend=0)
+
+
+def split_records(body, size):
+	""" Split the records of a section into columns of strings. The
+		first size items of each record are kept, and the trailing
+		comments are returned as another column. Records with the same
+		layout are split all at once. Returns None if a record has
+		too few items. """
+
+	body = body.strip()
+	if len(body) == 0:
+		return [[] for i in range(size)], []
+
+	no_records = body.count('\n') + 1
+	first = body[:body.find('\n')] if no_records > 1 else body
+
+	data, mark, comment = first.partition('#')
+	length = len(data.split())
+	comment = comment.split()
+
+	items = body.split()
+	width = length + len(mark) + len(comment)
+
+	# the totals may add up with different items per line, check each
+	if (length >= size and width * no_records == len(items) and len(comment) <= 1
+			and np.all(items_per_line(body) == width)):
+		if mark and set(items[length::width]) == {'#'}:
+			cols = [items[j::width] for j in range(size)]
+			return cols, items[width - 1::width] if comment else [''] * no_records
+
+		if not mark and '#' not in body:
+			return [items[j::width] for j in range(size)], [''] * no_records
+
+	# different layouts, split line by line
+	cols = [[] for i in range(size)]
+	comments = []
+
+	for line in body.split('\n'):
+		data, mark, comment = line.partition('#')
+		parts = data.split()
+
+		if len(parts) == 0:
+			continue
+
+		if len(parts) < size:
+			print('-- Error: Invalid LAMMPS data record:\n%s' %line.strip())
+			return None
+
+		for j in range(size):
+			cols[j].append(parts[j])
+		comments.append(comment.strip())
+
+	return cols, comments
+
+
+def sorted_records(cols, dtypes):
+	""" Typed arrays of the columns, sorted by the id column. """
+	ids = np.array(cols[0], dtype=np.int64)
+	order = np.argsort(ids, kind='stable')
+	return [np.array(c, dtype=t)[order] for c, t in zip(cols, dtypes)], order
+
+
+def read(data_file):
+	""" Read a LAMMPS data file of atom_style full, or qmag written
+		by lammps_qmag, into an OpenMOL object. The big sections are
+		split in bulk. All indices are decremented to use 0 based
+		indexing, records are ordered by their ids.
+		Round trips through Writer: the atom names are set to the
+		atom types and the residue names to UNK, since the data
+		file does not store them. The box lengths are hi - lo, the
+		lower bounds are saved as box_origin if not at the origin. """
+
+	MOL = initialize()
+
+	with open(data_file, 'r') as fp:
+		text = fp.read()
+
+	found = list(section_re.finditer(text))
+	header_end = found[0].start() if found else len(text)
+
+	# header, a few lines only
+	lines = text[:header_end].split('\n')
+	title = lines[0].rstrip('\n')
+	for suffix in title_suffixes:
+		if title.endswith(suffix):
+			title = title[:-len(suffix)]
+	MOL['title'] = title
+
+	bounds = {}
+	for line in lines[1:]:
+		line = line.partition('#')[0].strip()
+		if len(line) == 0:
+			continue
+
+		parts = line.split()
+		key = ' '.join(parts[1:])
+
+		if key in header_counts:
+			MOL[header_counts[key]] = int(parts[0])
+
+		elif ' '.join(parts[2:]) in ['xlo xhi', 'ylo yhi', 'zlo zhi']:
+			bounds[parts[2][0]] = (float(parts[0]), float(parts[1]))
+
+	# the MOL box spans from the origin, the lower bounds are kept as
+	# box_origin if any is not 0, the coordinates are left as they are
+	for axis, (lo, hi) in bounds.items():
+		MOL['box_' + axis] = hi - lo
+
+	if any(lo != 0.0 for lo, hi in bounds.values()):
+		MOL['box_origin'] = [bounds.get(axis, (0.0, 0.0))[0] for axis in 'xyz']
+
+	style = 'full'
+
+	for i, match in enumerate(found):
+		name = match.group(1)
+		end = found[i + 1].start() if i + 1 < len(found) else len(text)
+		body = text[match.end():end]
+
+		stage = openmol.Stage('read', name, data_file)
+		stage.bytes = len(body)
+		openmol.info('Reading %s ...' %name, end=' ')
+
+		if name == 'Masses':
+			records = split_records(body, 2)
+			if records is None:
+				return False
+			(ids, mass), order = sorted_records(records[0], [np.int64, np.float64])
+			openmol.set_field(MOL, 'unique_atom_mass', mass)
+			MOL['unique_atom_types'] = [records[1][k] or str(ids[j]) for j, k in enumerate(order.tolist())]
+
+		elif name == 'Pair Coeffs':
+			records = split_records(body, 3)
+			if records is None:
+				return False
+			(ids, eps, sigma), order = sorted_records(records[0], [np.int64, np.float64, np.float64])
+			openmol.set_field(MOL, 'FF_lj_epsilon', eps)
+			openmol.set_field(MOL, 'FF_lj_sigma', sigma)
+
+		elif name == 'Bond Coeffs':
+			records = split_records(body, 3)
+			if records is None:
+				return False
+			(ids, k, eq), order = sorted_records(records[0], [np.int64, np.float64, np.float64])
+			openmol.set_field(MOL, 'FF_bond_k', k)
+			openmol.set_field(MOL, 'FF_bond_eq', eq)
+
+		elif name == 'Angle Coeffs':
+			records = split_records(body, 3)
+			if records is None:
+				return False
+			(ids, k, eq), order = sorted_records(records[0], [np.int64, np.float64, np.float64])
+			openmol.set_field(MOL, 'FF_angle_k', k)
+			openmol.set_field(MOL, 'FF_angle_eq', np.radians(eq))
+
+		elif name == 'Dihedral Coeffs':
+			records = split_records(body, 4)
+			if records is None:
+				return False
+			(ids, k, d, n), order = sorted_records(records[0], [np.int64, np.float64, np.int64, np.float64])
+			openmol.set_field(MOL, 'FF_dihed_k', k)
+			# harmonic style, d = 1 is the phase 0 and d = -1 the phase pi
+			openmol.set_field(MOL, 'FF_dihed_phase', np.where(d == -1, math.pi, 0.0))
+			openmol.set_field(MOL, 'FF_dihed_periodicity', n)
+
+		elif name == 'Atoms':
+			if match.group(2) and 'qmag' in match.group(2):
+				style = 'qmag'
+
+			size = atom_style_items[style]
+			records = split_records(body, size)
+			if records is None:
+				return False
+
+			cols, comments = records
+			dtypes = [np.int64, np.int64, np.int64] + [np.float64] * (size - 3)
+			values, order = sorted_records(cols, dtypes)
+
+			openmol.set_field(MOL, 'atom_resid', values[1] - 1)
+			openmol.set_field(MOL, 'atom_type_index', values[2] - 1)
+			openmol.set_field(MOL, 'atom_q', values[3])
+			openmol.set_field(MOL, 'atom_x', values[4])
+			openmol.set_field(MOL, 'atom_y', values[5])
+			openmol.set_field(MOL, 'atom_z', values[6])
+
+			if style == 'qmag':
+				MOL['atom_qm'] = values[7].tolist()
+
+			# the type names of the comments, or of the Masses section
+			comments = np.array(comments, dtype=object)[order]
+			if all(comments):
+				MOL['atom_type'] = comments.tolist()
+			else:
+				types = np.array(MOL['unique_atom_types'] or [str(i + 1) for i in range(MOL['no_atom_types'])], dtype=object)
+				MOL['atom_type'] = types[values[2] - 1].tolist()
+
+			MOL['atom_name'] = list(MOL['atom_type'])
+
+		elif name == 'Velocities':
+			records = split_records(body, 4)
+			if records is None:
+				return False
+			(ids, vx, vy, vz), order = sorted_records(records[0], [np.int64] + [np.float64] * 3)
+			openmol.set_field(MOL, 'atom_vx', vx)
+			openmol.set_field(MOL, 'atom_vy', vy)
+			openmol.set_field(MOL, 'atom_vz', vz)
+
+		elif name in ['Bonds', 'Angles', 'Dihedrals']:
+			prefix = {'Bonds': 'bond', 'Angles': 'angle', 'Dihedrals': 'dihed'}[name]
+			fields = {
+				'Bonds': ['bond_from', 'bond_to'],
+				'Angles': ['angle_a', 'angle_b', 'angle_c'],
+				'Dihedrals': ['dihed_a', 'dihed_b', 'dihed_c', 'dihed_d'],
+			}[name]
+
+			records = split_records(body, len(fields) + 2)
+			if records is None:
+				return False
+			values, order = sorted_records(records[0], [np.int64] * (len(fields) + 2))
+
+			openmol.set_field(MOL, prefix + '_ff_index', values[1] - 1)
+			for field, atoms in zip(fields, values[2:]):
+				openmol.set_field(MOL, field, atoms - 1)
+
+		else:
+			# @todo: impropers are not supported yet
+			openmol.info('skipped,', end=' ')
+
+		stage.done(body.strip().count('\n') + 1 if body.strip() else 0)
+		openmol.info('OK')
+
+	if MOL['no_atom_types'] and not MOL['unique_atom_types']:
+		MOL['unique_atom_types'] = [str(i + 1) for i in range(MOL['no_atom_types'])]
+
+	# one residue per molecule id, in order of the atoms
+	resid = np.asarray(MOL['atom_resid'], dtype=np.int64)
+	changed = np.diff(resid, prepend=-1) != 0
+	starts = np.flatnonzero(changed)
+	openmol.set_field(MOL, 'residue_start', starts)
+
+	# the molecule ids may skip numbers or repeat, atom_resid is the
+	# 0 based index of the residue, same as the other readers
+	openmol.set_field(MOL, 'atom_resid', np.cumsum(changed) - 1)
+	MOL['residue_name'] = ['UNK'] * len(starts)
+	MOL['atom_resname'] = ['UNK'] * len(resid)
+	MOL['no_residues'] = len(starts)
+
+	MOL['source_format'] = 'LAMMPS QMAG' if style == 'qmag' else 'LAMMPS FULL'
+	MOL['_lammps_built'] = True
+
+	if not openmol.check(MOL):
+		return False
+
+	openmol.info('Reading Done')
+	return MOL
+
+
+def one_based(indices):
+	""" Integer array of the 0 based indices shifted by one. """
+	return np.asarray(indices, dtype=np.int64) + 1
+
+
 class Writer(openmol.Writer):
 	def __init__(self, MOL, data_file):
 		# open the file for writing
@@ -151,27 +472,29 @@ class Writer(openmol.Writer):
 		self.fp.write("%d dihedral types\n\n" %self.MOL['no_dihed_types'])
 
 	def box_info(self):
-		# @todo: handle situations where coords have -ve values
+		# lower bounds of a box read from a data file, if not at the origin
+		origin = self.MOL.get('box_origin', [0.0, 0.0, 0.0])
+
 		if self.MOL['box_x'] == 0.0:
 			xlo = min(self.MOL['atom_x']) - BOX_BUFFER
 			xhi = max(self.MOL['atom_x']) + BOX_BUFFER
 		else:
-			xlo = 0.0
-			xhi = self.MOL['box_x']
+			xlo = origin[0]
+			xhi = origin[0] + self.MOL['box_x']
 
 		if self.MOL['box_y'] == 0.0:
 			ylo = min(self.MOL['atom_y']) - BOX_BUFFER
 			yhi = max(self.MOL['atom_y']) + BOX_BUFFER
 		else:
-			ylo = 0.0
-			yhi = self.MOL['box_y']
+			ylo = origin[1]
+			yhi = origin[1] + self.MOL['box_y']
 
 		if self.MOL['box_z'] == 0.0:
 			zlo = min(self.MOL['atom_z']) - BOX_BUFFER
 			zhi = max(self.MOL['atom_z']) + BOX_BUFFER
 		else:
-			zlo = 0.0
-			zhi = self.MOL['box_z']
+			zlo = origin[2]
+			zhi = origin[2] + self.MOL['box_z']
 
 		self.fp.write("%8.4f %8.4f xlo xhi\n" %(xlo, xhi))
 		self.fp.write("%8.4f %8.4f ylo yhi\n" %(ylo, yhi))
@@ -202,13 +525,13 @@ class Writer(openmol.Writer):
 				%(i+1, self.MOL['FF_angle_k'][i], math.degrees(self.MOL['FF_angle_eq'][i])))
 
 	def dihed_coeffs(self):
+		""" dihedral_style harmonic, K [1 + d cos(n phi)]. The AMBER
+			phase 0 is d = 1 and the phase pi is d = -1, other phases
+			can not be written and are rounded to the nearest one. """
+
 		self.fp.write("\nDihedral Coeffs\n\n")
 		for i in range(self.MOL['no_dihed_types']):
-			phase = int(math.cos(self.MOL['FF_dihed_phase'][i]))
-
-			if phase == 0:
-				phase = 1
-			else: phase = -1
+			phase = -1 if math.cos(self.MOL['FF_dihed_phase'][i]) < 0 else 1
 
 			period = int(self.MOL['FF_dihed_periodicity'][i])
 			self.fp.write('%3d  %6.3f  %2d  %d\n'
@@ -217,86 +540,145 @@ class Writer(openmol.Writer):
 	def atoms(self):
 		self.fp.write("\nAtoms # atom_style_full\n\n")
 
-		for i in range(self.MOL['no_atoms']):
-			resid = self.MOL['atom_resid'][i]
-			atom = {
-				'id' : i + 1,
-				'name': self.MOL['atom_name'][i],
-				'x': self.MOL['atom_x'][i],
-				'y': self.MOL['atom_y'][i],
-				'z': self.MOL['atom_z'][i],
-				'typeid': self.MOL['atom_type_index'][i] + 1,
-				'resid': self.MOL['atom_resid'][i] + 1,
-				'charge': self.MOL['atom_q'][i],
-				'type': self.MOL['atom_type'][i]
-			}
-
-			atomstr =	"{id:>7d} {resid:>4d} {typeid:>3} {charge:>10.6f}  " \
-						"{x:>8.4f}  {y:>8.4f}  {z:>8.4f} # {type}\n"
-
-			self.fp.write(atomstr.format(**atom))
+		n = self.MOL['no_atoms']
+		atomstr = "%7d %4d %3d %10.6f  %8.4f  %8.4f  %8.4f # %s\n"
+
+		self.write_rows(atomstr, range(1, n + 1),
+			one_based(self.MOL['atom_resid']),
+			one_based(self.MOL['atom_type_index']),
+			self.MOL['atom_q'],
+			self.MOL['atom_x'], self.MOL['atom_y'], self.MOL['atom_z'],
+			self.MOL['atom_type'])
 
 	def bonds(self):
 		self.fp.write("\nBonds\n\n")
 
-		for i in range(self.MOL['no_bonds']):
-			bond = {
-				'id' : i + 1,
-				'from': self.MOL['bond_from'][i] + 1,
-				'to': self.MOL['bond_to'][i] + 1,
-				'type': self.MOL['bond_ff_index'][i] + 1,
-			}
-			bondstr =	"{id:>7d}  {type:>5d}  {from:>7d}  {to:>7d} \n"
-			self.fp.write(bondstr.format(**bond))
+		n = self.MOL['no_bonds']
+		bondstr = "%7d  %5d  %7d  %7d \n"
+
+		self.write_rows(bondstr, range(1, n + 1),
+			one_based(self.MOL['bond_ff_index']),
+			one_based(self.MOL['bond_from']),
+			one_based(self.MOL['bond_to']))
 
 	def angles(self):
 		self.fp.write("\nAngles\n\n")
 
-		for i in range(self.MOL['no_angles']):
-			angle = {
-				'id' : i + 1,
-				'a': self.MOL['angle_a'][i] + 1,
-				'b': self.MOL['angle_b'][i] + 1,
-				'c': self.MOL['angle_c'][i] + 1,
-				'type': self.MOL['angle_ff_index'][i] + 1,
-			}
-			anglestr =	"{id:>7d}  {type:>3d}  {a:>5d}  {b:>5d}  {c:>5d} \n"
-			self.fp.write(anglestr.format(**angle))
+		n = self.MOL['no_angles']
+		anglestr = "%7d  %3d  %5d  %5d  %5d \n"
 
+		self.write_rows(anglestr, range(1, n + 1),
+			one_based(self.MOL['angle_ff_index']),
+			one_based(self.MOL['angle_a']),
+			one_based(self.MOL['angle_b']),
+			one_based(self.MOL['angle_c']))
 
 	def diheds(self):
 		self.fp.write("\nDihedrals\n\n")
 
-		for i in range(self.MOL['no_diheds']):
-			dihed = {
-				'id' : i + 1,
-				'a': self.MOL['dihed_a'][i] + 1,
-				'b': self.MOL['dihed_b'][i] + 1,
-				'c': self.MOL['dihed_c'][i] + 1,
-				'd': self.MOL['dihed_d'][i] + 1,
-				'type': self.MOL['dihed_ff_index'][i] + 1,
-			}
-			dihedstr =	"{id:>7d}  {type:>3d}  {a:>5d}  {b:>5d}  {c:>5d}  {d:>5d} \n"
-			self.fp.write(dihedstr.format(**dihed))
+		n = self.MOL['no_diheds']
+		dihedstr = "%7d  %3d  %5d  %5d  %5d  %5d \n"
 
+		self.write_rows(dihedstr, range(1, n + 1),
+			one_based(self.MOL['dihed_ff_index']),
+			one_based(self.MOL['dihed_a']),
+			one_based(self.MOL['dihed_b']),
+			one_based(self.MOL['dihed_c']),
+			one_based(self.MOL['dihed_d']))
 
 	def write(self):
 		if not self.MOL.get('_lammps_built', False):
 			print('-- Warning: MOL not getting build() for LAMMPS likely to fail while writing.')
 
-		self.title()
-		self.counts()
-		self.types()
-		self.box_info()
-		self.masses()
-		self.pair_coeffs()
-		self.bond_coeffs()
-		self.angle_coeffs()
-		self.dihed_coeffs()
-		self.atoms()
-		self.bonds()
-		self.angles()
-		self.diheds()
+		with self.section('Header'):
+			self.title()
+			self.counts()
+			self.types()
+			self.box_info()
+
+		with self.section('Coeffs', self.MOL['no_atom_types']):
+			self.masses()
+			self.pair_coeffs()
+			self.bond_coeffs()
+			self.angle_coeffs()
+			self.dihed_coeffs()
+
+		with self.section('Atoms', self.MOL['no_atoms']):
+			self.atoms()
+
+		with self.section('Bonds', self.MOL['no_bonds']):
+			self.bonds()
+
+		with self.section('Angles', self.MOL['no_angles']):
+			self.angles()
+
+		with self.section('Dihedrals', self.MOL['no_diheds']):
+			self.diheds()
 
 		# close the file
 		super(Writer, self).write()
+
+
+class DumpWriter(openmol.Writer):
+	""" Write frames of coordinates as a LAMMPS dump file with the
+		id, mol, type, x, y, z columns of each atom. The atom types and
+		molecule (residue) ids are taken from the built MOL. Call
+		frame() for each frame and write() to close the file. """
+
+	def __init__(self, MOL, dump_file):
+		super(DumpWriter, self).__init__(MOL, dump_file)
+
+		if not self.MOL.get('_lammps_built', False):
+			print('-- Warning: MOL not getting build() for LAMMPS likely to fail while writing.')
+
+		n = self.MOL['no_atoms']
+		self.ids = range(1, n + 1)
+		self.mols = one_based(self.MOL['atom_resid'])
+		self.types = one_based(self.MOL['atom_type_index'])
+		self.no_frames = 0
+
+	def bounds(self, xyz, box):
+		if box is None:
+			box = [self.MOL['box_x'], self.MOL['box_y'], self.MOL['box_z']]
+
+		origin = self.MOL.get('box_origin', [0.0, 0.0, 0.0])
+
+		bounds = []
+		for i in range(3):
+			if box[i] == 0.0:
+				bounds.append((xyz[:, i].min() - BOX_BUFFER, xyz[:, i].max() + BOX_BUFFER))
+			else:
+				bounds.append((origin[i], origin[i] + box[i]))
+
+		return bounds
+
+	def frame(self, coordinates, box=None, timestep=None):
+		""" Write a frame of (N, 3) coordinates, with the box lengths
+			if known. The timestep defaults to the frame number. """
+
+		xyz = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+
+		if len(xyz) != self.MOL['no_atoms']:
+			print('-- Error: frame has %d atoms, MOL has %d.' %(len(xyz), self.MOL['no_atoms']))
+			return False
+
+		if timestep is None:
+			timestep = self.no_frames
+
+		with self.section('frame', len(xyz)):
+			self.fp.write("ITEM: TIMESTEP\n%d\n" %timestep)
+			self.fp.write("ITEM: NUMBER OF ATOMS\n%d\n" %len(xyz))
+			self.fp.write("ITEM: BOX BOUNDS pp pp pp\n")
+			for lo, hi in self.bounds(xyz, box):
+				self.fp.write("%.4f %.4f\n" %(lo, hi))
+
+			self.fp.write("ITEM: ATOMS id mol type x y z\n")
+			self.write_rows("%d %d %d %.3f %.3f %.3f\n", self.ids, self.mols, self.types,
+				xyz[:, 0], xyz[:, 1], xyz[:, 2])
+
+		self.no_frames += 1
+		return True
+
+	def write(self):
+		# close the file
+		super(DumpWriter, self).write()
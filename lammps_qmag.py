@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-""" LAMMPS dat file writer for atom_style 'qmag'.
+""" LAMMPS dat file reader and writer for atom_style 'qmag'.
 
 	This file is a part of OpenMOL python module.
 	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
@@ -21,11 +21,32 @@ def initialize():
 
 def build(MOL):
 	MOL = lmp.build(MOL)
+	stage = openmol.Stage('build', 'lammps_qmag')
 	MOL = dict(initialize(), **MOL)
 
 	if len(MOL['atom_qm']) != MOL['no_atoms']:
 		MOL['atom_qm'] = [0.0 for i in range(MOL['no_atoms'])]
 
+	MOL['_lammps_qmag_built'] = True
+	stage.done(MOL['no_atoms'])
+
+	return openmol.AttrDict(MOL)
+
+
+def read(data_file):
+	""" Read a LAMMPS data file of atom_style qmag, see lmp.read().
+		The qm values of a full style file are set to 0.0. """
+
+	MOL = lmp.read(data_file)
+	if not MOL:
+		return False
+
+	MOL = dict(initialize(), **MOL)
+
+	if len(MOL['atom_qm']) != MOL['no_atoms']:
+		MOL['atom_qm'] = [0.0 for i in range(MOL['no_atoms'])]
+
+	MOL['source_format'] = "LAMMPS QMAG"
 	MOL['_lammps_qmag_built'] = True
 	return openmol.AttrDict(MOL)
 
@@ -75,25 +96,16 @@ class Writer(lmp.Writer):
 	def atoms(self):
 		self.fp.write("\nAtoms # atom_style_qmag\n\n")
 
-		for i in range(self.MOL['no_atoms']):
-			resid = self.MOL['atom_resid'][i]
-			atom = {
-				'id' : i + 1,
-				'name': self.MOL['atom_name'][i],
-				'x': self.MOL['atom_x'][i],
-				'y': self.MOL['atom_y'][i],
-				'z': self.MOL['atom_z'][i],
-				'typeid': self.MOL['atom_type_index'][i] + 1,
-				'resid': self.MOL['atom_resid'][i] + 1,
-				'charge': self.MOL['atom_q'][i],
-				'type': self.MOL['atom_type'][i],
-				'qm': self.MOL['atom_qm'][i]
-			}
-
-			atomstr =	"{id:>7d} {resid:>4d} {typeid:>3} {charge:>10.6f}  " \
-						"{x:>8.4f}  {y:>8.4f}  {z:>8.4f}   {qm:>7.4f} # {type}\n"
+		n = self.MOL['no_atoms']
+		atomstr = "%7d %4d %3d %10.6f  %8.4f  %8.4f  %8.4f   %7.4f # %s\n"
 
-			self.fp.write(atomstr.format(**atom))
+		self.write_rows(atomstr, range(1, n + 1),
+			lmp.one_based(self.MOL['atom_resid']),
+			lmp.one_based(self.MOL['atom_type_index']),
+			self.MOL['atom_q'],
+			self.MOL['atom_x'], self.MOL['atom_y'], self.MOL['atom_z'],
+			self.MOL['atom_qm'],
+			self.MOL['atom_type'])
 
 	def write(self):
 		if not self.MOL.get('_lammps_qmag_built', False):
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+""" Cell list of atom coordinates for the pairs within a cutoff and
+	the distance queries of an OpenMOL object.
+
+	The space is split into cells at least as large as the cutoff, so
+	the neighbors of an atom are in its own and the adjacent cells.
+	The atoms are sorted by cell, the atoms of a cell are a contiguous
+	range like a CSR row. The cost is linear in the no. of atoms.
+	Axes with a box length are periodic, with the minimum image
+	distances. Only orthorhombic boxes are supported.
+
+	index(MOL) builds the cell list of a MOL on demand for the radius
+	and the k nearest queries, and keeps it until the coordinates or
+	the box of the MOL change, in place or replaced.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import zlib
+
+import numpy as np
+
+# no. of atoms whose candidate neighbors are checked at once
+CHUNK = 1 << 16
+
+# at most this many cells per atom, sparse systems get larger cells
+MAX_CELLS_PER_ATOM = 8
+
+# cell size of the index of a MOL, larger query radii visit more cells
+INDEX_CELL_SIZE = 5.0
+
+# no. of MOL indexes kept
+CACHE_SIZE = 4
+
+# id of a MOL: its box, checksum of the coordinates and index
+_indexes = {}
+
+
+def coordinates(MOL):
+	""" (N, 3) array of the atom coordinates of MOL """
+	return np.column_stack([np.asarray(MOL[k], dtype=np.float64) for k in ['atom_x', 'atom_y', 'atom_z']])
+
+
+def box_of(MOL, warn=True):
+	""" Box lengths of MOL, 0.0 for the non periodic axes. Warns if
+		the box is not orthorhombic, unless warn is False. """
+	if warn and any(MOL.get(k, 90.0) != 90.0 for k in ['box_alpha', 'box_beta', 'box_gamma']):
+		print('-- Warning: only orthorhombic boxes are supported, box angles ignored.')
+
+	return np.array([MOL['box_x'], MOL['box_y'], MOL['box_z']], dtype=np.float64)
+
+
+def expand(starts, counts):
+	""" Group index and position of each item of the ranges
+		starts[g]:starts[g]+counts[g], all the groups concatenated. """
+
+	counts = np.asarray(counts, dtype=np.int64)
+	group = np.repeat(np.arange(len(counts)), counts)
+	first = np.cumsum(counts) - counts
+	position = np.asarray(starts, dtype=np.int64)[group] + np.arange(len(group)) - first[group]
+	return group, position
+
+
+class CellList(object):
+	""" Atoms sorted into cells of at least cell_size. The atoms of
+		cell c are order[start[c]:start[c+1]], and their coordinates
+		sorted[start[c]:start[c+1]]. """
+
+	def __init__(self, xyz, cell_size, box=None):
+		xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+
+		if box is None:
+			box = np.zeros(3)
+
+		self.box = np.asarray(box, dtype=np.float64)
+		self.periodic = self.box > 0.0
+		self.cell_size = float(cell_size)
+
+		# wrap the periodic coordinates into the box
+		self.xyz = xyz.copy()
+		p = self.periodic
+		self.xyz[:, p] = np.mod(self.xyz[:, p], self.box[p])
+
+		n = len(xyz)
+		lo = np.where(p, 0.0, self.xyz.min(axis=0) if n else 0.0)
+		span = np.where(p, self.box, (self.xyz.max(axis=0) - lo) if n else 0.0)
+
+		size = max(self.cell_size, 1e-6)
+		while True:
+			# periodic cells divide the box evenly, at least size long
+			shape = np.where(p, np.maximum(np.floor(self.box / size), 1), np.floor(span / size) + 1)
+			if np.prod(shape) <= MAX_CELLS_PER_ATOM * n + 27:
+				break
+			size *= 1.5
+
+		self.lo = lo
+		self.shape = shape.astype(np.int64)
+		self.length = np.where(p, self.box / self.shape, size)
+
+		cells = np.floor((self.xyz - lo) / self.length).astype(np.int64)
+		self.cells = np.clip(cells, 0, self.shape - 1)
+
+		flat = self.flat(self.cells)
+		self.order = np.argsort(flat, kind='stable')
+
+		# the atoms of nearby cells are close in memory too
+		self.sorted = self.xyz[self.order]
+		self.sorted_cells = self.cells[self.order]
+
+		counts = np.bincount(flat, minlength=int(np.prod(self.shape)))
+		self.start = np.zeros(len(counts) + 1, dtype=np.int64)
+		np.cumsum(counts, out=self.start[1:])
+
+	def flat(self, cells):
+		return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+	def offsets(self, reach, half=False):
+		""" Cell offsets upto reach cells away along each axis, a single
+			no. or one per axis. Along a periodic axis of few cells, each
+			cell is taken once. If half, only the offsets after (0, 0, 0)
+			and itself, so that each pair of cells is visited once, None
+			if not possible. """
+
+		reach = [int(r) for r in np.broadcast_to(reach, 3)]
+
+		axes = []
+		for k in range(3):
+			if not self.periodic[k]:
+				reach[k] = min(reach[k], self.shape[k] - 1)
+
+			steps = range(-reach[k], reach[k] + 1)
+			if self.periodic[k] and 2 * reach[k] + 1 > self.shape[k]:
+				if half:
+					return None
+				steps = range(self.shape[k])
+			axes.append(steps)
+
+		offsets = [(i, j, k) for i in axes[0] for j in axes[1] for k in axes[2]]
+
+		if half:
+			offsets = [o for o in offsets if o >= (0, 0, 0)]
+
+		return offsets
+
+	def neighbor_cells(self, cells, offset):
+		""" Flat index of the cells at an offset from the cells,
+			-1 if outside a non periodic axis. """
+
+		moved = cells + np.asarray(offset, dtype=np.int64)
+		inside = np.ones(len(cells), dtype=bool)
+
+		for k in range(3):
+			if self.periodic[k]:
+				moved[:, k] %= self.shape[k]
+			else:
+				inside &= (moved[:, k] >= 0) & (moved[:, k] < self.shape[k])
+
+		return np.where(inside, self.flat(np.clip(moved, 0, self.shape - 1)), -1)
+
+	def delta(self, a, b):
+		""" Minimum image vectors from the points a to b """
+		d = b - a
+		p = self.periodic
+		d[:, p] -= self.box[p] * np.round(d[:, p] / self.box[p])
+		return d
+
+	def locate(self, points):
+		""" Points wrapped into the periodic box and their cells,
+			outside points are in the nearest cell of the grid. """
+
+		points = np.array(points, dtype=np.float64).reshape(-1, 3)
+		p = self.periodic
+		points[:, p] = np.mod(points[:, p], self.box[p])
+
+		cells = np.floor((points - self.lo) / self.length).astype(np.int64)
+		return points, np.clip(cells, 0, self.shape - 1)
+
+	def reach(self, radius):
+		""" No. of cells along each axis to cover radius """
+		return np.maximum(np.ceil(radius / self.length), 1).astype(np.int64)
+
+	def covered(self, points, cells, reach):
+		""" Distance from each point within which all the atoms are in
+			the cells upto reach cells away from its cell, inf if all the
+			atoms are. """
+
+		covered = np.full(len(points), np.inf)
+
+		for k in range(3):
+			if self.periodic[k] and 2 * reach + 1 >= self.shape[k]:
+				continue
+
+			lower = self.lo[k] + (cells[:, k] - reach) * self.length[k]
+			upper = self.lo[k] + (cells[:, k] + reach + 1) * self.length[k]
+
+			if not self.periodic[k]:
+				# no atoms beyond the ends of the grid
+				lower[cells[:, k] - reach <= 0] = -np.inf
+				upper[cells[:, k] + reach >= self.shape[k] - 1] = np.inf
+
+			covered = np.minimum(covered, np.minimum(points[:, k] - lower, upper - points[:, k]))
+
+		return covered
+
+	def candidates(self, cells, offsets):
+		""" Yield the (point, sorted atom) index pairs of the atoms in
+			the cells at each of the offsets from the cells of the points. """
+
+		for offset in offsets:
+			neighbor = self.neighbor_cells(cells, offset)
+			valid = np.flatnonzero(neighbor >= 0)
+			neighbor = neighbor[valid]
+
+			group, position = expand(self.start[neighbor], self.start[neighbor + 1] - self.start[neighbor])
+			yield valid[group], position
+
+	def pairs(self, cutoff):
+		""" All the atom pairs i < j closer than cutoff, which is not more
+			than the cell size. Returns the i, j and distance arrays. """
+
+		if cutoff > self.cell_size:
+			raise ValueError('cutoff %g larger than the cell size %g' %(cutoff, self.cell_size))
+
+		# each pair of cells once if possible, every pair twice otherwise
+		offsets = self.offsets(1, half=True)
+		half = offsets is not None
+		if not half:
+			offsets = self.offsets(1)
+
+		found_i, found_j, found_d = [], [], []
+
+		# in the sorted order, the nearby atoms are checked together
+		for first in range(0, len(self.order), CHUNK):
+			cells = self.sorted_cells[first:first + CHUNK]
+
+			for offset, (q, j) in zip(offsets, self.candidates(cells, offsets)):
+				i = q + first
+
+				if not half or offset == (0, 0, 0):
+					keep = i < j
+					i, j = i[keep], j[keep]
+
+				v = self.delta(self.sorted[i], self.sorted[j])
+				d2 = np.einsum('ij,ij->i', v, v)
+				keep = d2 <= cutoff * cutoff
+
+				found_i.append(i[keep])
+				found_j.append(j[keep])
+				found_d.append(np.sqrt(d2[keep]))
+
+		if not found_i:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+		i, j, d = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_d)
+		i, j = self.order[i], self.order[j]
+		i, j = np.minimum(i, j), np.maximum(i, j)
+
+		order = np.argsort(i * len(self.order) + j)
+		return i[order], j[order], d[order]
+
+
+	def within(self, points, radius):
+		""" All the atoms within radius of each of the points. Returns
+			the point, atom and distance arrays, sorted by point then
+			atom. On the periodic axes, radius is upto half the box. """
+
+		if np.any(radius > self.box[self.periodic] / 2):
+			raise ValueError('radius %g larger than half the periodic box' %radius)
+
+		points, cells = self.locate(points)
+		offsets = self.offsets(self.reach(radius))
+
+		found_q, found_a, found_d = [], [], []
+
+		for first in range(0, len(points), CHUNK):
+			for q, position in self.candidates(cells[first:first + CHUNK], offsets):
+				q = q + first
+				v = self.delta(points[q], self.sorted[position])
+				d2 = np.einsum('ij,ij->i', v, v)
+				keep = d2 <= radius * radius
+
+				found_q.append(q[keep])
+				found_a.append(self.order[position[keep]])
+				found_d.append(np.sqrt(d2[keep]))
+
+		if not found_q:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+		q, a, d = np.concatenate(found_q), np.concatenate(found_a), np.concatenate(found_d)
+
+		order = np.argsort(q * len(self.order) + a)
+		return q[order], a[order], d[order]
+
+	def nearest(self, points, k):
+		""" The k nearest atoms of each of the points, nearest first.
+			Returns the (M, k) atom index and distance arrays, -1 and inf
+			if there are fewer than k atoms. The cells around a point
+			are searched in growing shells until its k-th atom is closer
+			than the searched cells reach. """
+
+		points, cells = self.locate(points)
+
+		atoms = np.full((len(points), k), -1, dtype=np.int64)
+		distances = np.full((len(points), k), np.inf)
+
+		todo = np.arange(len(points)) if k > 0 else np.zeros(0, dtype=np.int64)
+		reach = 1
+
+		while len(todo):
+			offsets = self.offsets(reach)
+			left = []
+
+			for first in range(0, len(todo), CHUNK):
+				chunk = todo[first:first + CHUNK]
+
+				found_q, found_p = [], []
+				for q, position in self.candidates(cells[chunk], offsets):
+					found_q.append(q)
+					found_p.append(position)
+
+				q, position = np.concatenate(found_q), np.concatenate(found_p)
+				v = self.delta(points[chunk[q]], self.sorted[position])
+				d = np.sqrt(np.einsum('ij,ij->i', v, v))
+
+				# the first k of each point, by distance
+				order = np.lexsort((d, q))
+				q, position, d = q[order], position[order], d[order]
+
+				counts = np.bincount(q, minlength=len(chunk))
+				rank = np.arange(len(q)) - (np.cumsum(counts) - counts)[q]
+				keep = rank < k
+				q, rank, position, d = q[keep], rank[keep], position[keep], d[keep]
+
+				last = np.full(len(chunk), np.inf)
+				last[q[rank == k - 1]] = d[rank == k - 1]
+
+				covered = self.covered(points[chunk], cells[chunk], reach)
+				done = (last <= covered) | np.isinf(covered)
+				keep = done[q]
+
+				atoms[chunk[q[keep]], rank[keep]] = self.order[position[keep]]
+				distances[chunk[q[keep]], rank[keep]] = d[keep]
+				left.append(chunk[~done])
+
+			todo = np.concatenate(left)
+			reach *= 2
+
+		return atoms, distances
+
+
+def pairs(xyz, cutoff, box=None):
+	""" All the pairs i < j of the (N, 3) coordinates within cutoff,
+		with periodic box lengths if given. Returns the i, j and
+		distance arrays, sorted by i then j. """
+	return CellList(xyz, cutoff, box).pairs(cutoff)
+
+
+def selection(atoms, no_atoms):
+	""" Atom indices of a selection given as indices or a boolean mask """
+	atoms = np.asarray(atoms)
+	if atoms.dtype == bool:
+		return np.flatnonzero(atoms[:no_atoms])
+	return atoms.astype(np.int64).ravel()
+
+
+def index(MOL, cell_size=INDEX_CELL_SIZE):
+	""" Cell list of the atoms of MOL, built on the first call and
+		reused until the coordinates or the box change. The
+		coordinates are compared by a checksum, so in place edits
+		are seen too. """
+
+	xyz = coordinates(MOL)
+	state = (xyz.shape, tuple(box_of(MOL, warn=False)), cell_size, zlib.crc32(xyz))
+
+	cached = _indexes.get(id(MOL), None)
+	if cached and cached[0] == state:
+		return cached[1]
+
+	cells = CellList(xyz, cell_size, box_of(MOL))
+
+	# a reused id has a different checksum unless the atoms are the same
+	_indexes.pop(id(MOL), None)
+	_indexes[id(MOL)] = (state, cells)
+	while len(_indexes) > CACHE_SIZE:
+		_indexes.pop(next(iter(_indexes)))
+
+	return cells
+
+
+def within(MOL, points, radius):
+	""" All the atoms of MOL within radius of each of the (M, 3) points,
+		as the point, atom and distance arrays, see CellList.within() """
+	return index(MOL).within(points, radius)
+
+
+def nearest(MOL, points, k=1):
+	""" The k nearest atoms of MOL of each of the (M, 3) points, as (M, k)
+		atom index and distance arrays, see CellList.nearest() """
+	return index(MOL).nearest(points, k)
+
+
+def around(MOL, atoms, radius):
+	""" Mask of the atoms of MOL within radius of any of the selected
+		atoms, the selection included. """
+
+	atoms = selection(atoms, MOL['no_atoms'])
+	cells = index(MOL)
+	q, found, d = cells.within(cells.xyz[atoms], radius)
+
+	mask = np.zeros(MOL['no_atoms'], dtype=bool)
+	mask[found] = True
+	mask[atoms] = True
+	return mask
+
+
+def contacts(MOL, first, second, cutoff):
+	""" The atom pairs i of the first and j of the second selection not
+		farther than cutoff, closest first. Returns the i, j and distance
+		arrays. An atom is not in contact with itself. """
+
+	first = selection(first, MOL['no_atoms'])
+	second = selection(second, MOL['no_atoms'])
+
+	cells = index(MOL)
+	q, j, d = cells.within(cells.xyz[first], cutoff)
+	i = first[q]
+
+	selected = np.zeros(MOL['no_atoms'], dtype=bool)
+	selected[second] = True
+	keep = selected[j] & (i != j)
+	i, j, d = i[keep], j[keep], d[keep]
+
+	order = np.argsort(d, kind='stable')
+	return i[order], j[order], d[order]
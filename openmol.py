@@ -7,8 +7,65 @@
 
 __author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
 
+import gzip
+import itertools
 import json
+import lzma
+import mmap
+import os
 import re
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Store the numeric per atom/bond fields as typed numpy
+# columns instead of python lists. See initialize().
+COLUMNAR = False
+
+# openmol binary container, see write_binary()
+BINARY_MAGIC = b'OPENMOL\x01'
+BINARY_ALIGN = 64
+
+# no. of array items written to JSON at once
+JSON_CHUNK = 4096
+
+# no. of rows formatted and written at once by Writer.write_rows()
+WRITE_CHUNK = 16384
+
+# print the progress messages of the readers and writers, see
+# set_quiet(). Errors and warnings are always printed.
+VERBOSE = os.environ.get('OPENMOL_QUIET', '') == ''
+
+# callables receiving the event of each finished Stage
+hooks = []
+
+# stages measuring their peak memory, innermost last
+_memory_stages = []
+
+# dtype of each numeric field when stored as a Column
+column_types = {
+	'atom_x': 'f8',		'atom_y': 'f8',		'atom_z': 'f8',
+	'atom_vx': 'f8',	'atom_vy': 'f8',	'atom_vz': 'f8',
+	'atom_q': 'f8',		'atom_mass': 'f8',
+	'atom_type_index': 'i4',	'atom_resid': 'i4',	'atom_atomic_no': 'i4',
+
+	'bond_from': 'i4',	'bond_to': 'i4',
+	'angle_a': 'i4',	'angle_b': 'i4',	'angle_c': 'i4',
+	'dihed_a': 'i4',	'dihed_b': 'i4',	'dihed_c': 'i4',	'dihed_d': 'i4',
+
+	'residue_start': 'i4',	'residue_end': 'i4',
+
+	'FF_lj_epsilon': 'f8',	'FF_lj_sigma': 'f8',	'pair_ff_index': 'i4',
+	'FF_bond_k': 'f8',		'FF_bond_eq': 'f8',		'bond_ff_index': 'i4',
+	'FF_angle_k': 'f8',		'FF_angle_eq': 'f8',	'angle_ff_index': 'i4',
+	'FF_dihed_k': 'f8',		'FF_dihed_phase': 'f8',
+	'FF_dihed_periodicity': 'f8',					'dihed_ff_index': 'i4',
+}
+
+# names of the dict attributes, not allowed as AttrDict keys
+dict_names = frozenset(dir({}))
 
 def legal_key(strg, search=re.compile(r'^[a-zA-Z_][a-zA-Z_0-9]*$').search):
 	return bool(search(strg))
@@ -29,7 +86,7 @@ class AttrDict(dict):
 
 	def __setitem__(self, key, value):
 		# do not allow any key from dict's namespace
-		if key in dir({}):
+		if key in dict_names:
 			raise KeyError(key)
 
 		# key has to be string
@@ -47,9 +104,176 @@ class AttrDict(dict):
 		return super().__dir__() + [str(k) for k in self.keys()]
 
 
-def initialize():
+class Column(object):
+	""" List like, typed and contiguous numpy storage for a
+		single MOL field. Grows by amortized chunks on append,
+		so the readers can keep appending item by item. """
+
+	# minimum number of items to grow the buffer by
+	chunk = 1024
+
+	def __init__(self, dtype, values=None):
+		self._data = np.empty(0, dtype=dtype)
+		self._size = 0
+
+		if values is not None:
+			self.extend(values)
+
+	@classmethod
+	def wrap(cls, array):
+		""" Use an existing 1D array as the buffer, without copying.
+			Read only arrays, e.g. memory maps, are copied on the
+			first write. """
+		column = cls(array.dtype)
+		column._data = array
+		column._size = len(array)
+		return column
+
+	@property
+	def dtype(self):
+		return self._data.dtype
+
+	@property
+	def array(self):
+		""" Numpy view of the filled items, no copy. """
+		return self._data[:self._size]
+
+	def reserve(self, size):
+		""" Make sure there is room for size items in total. """
+		if size <= len(self._data):
+			return
+
+		# grow geometrically to keep appends amortized O(1)
+		capacity = max(size, len(self._data) + max(len(self._data) // 2, self.chunk))
+		data = np.empty(capacity, dtype=self._data.dtype)
+		data[:self._size] = self._data[:self._size]
+		self._data = data
+
+	def append(self, value):
+		if self._size == len(self._data):
+			self.reserve(self._size + 1)
+
+		self._data[self._size] = value
+		self._size += 1
+
+	def extend(self, values):
+		values = np.asarray(values, dtype=self._data.dtype).ravel()
+		self.reserve(self._size + len(values))
+		self._data[self._size:self._size + len(values)] = values
+		self._size += len(values)
+
+	def index(self, value):
+		found = np.flatnonzero(self.array == value)
+		if len(found) == 0:
+			raise ValueError('%r is not in column' %value)
+		return int(found[0])
+
+	def tolist(self):
+		return self.array.tolist()
+
+	def __len__(self):
+		return self._size
+
+	def __iter__(self):
+		# yield python scalars, one chunk converted at a time
+		for i in range(0, self._size, self.chunk):
+			yield from self._data[i:min(i + self.chunk, self._size)].tolist()
+
+	def __contains__(self, value):
+		return bool(np.any(self.array == value))
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return Column(self.dtype, self.array[i])
+		return self.array.item(i)
+
+	def __setitem__(self, i, value):
+		if not self._data.flags.writeable:
+			self._data = self._data.copy()
+		self.array[i] = value
+
+	def __eq__(self, other):
+		if isinstance(other, (Column, list, tuple, np.ndarray)):
+			return len(self) == len(other) and bool(np.all(self.array == np.asarray(other)))
+		return NotImplemented
+
+	def __array__(self, dtype=None, copy=None):
+		# a view of the buffer, unless numpy asks for a copy
+		array = self.array
+
+		if dtype is not None and np.dtype(dtype) != array.dtype:
+			if copy is False:
+				raise ValueError('Column of %s can not be converted to %s without a copy' %(self.dtype, np.dtype(dtype)))
+			return array.astype(dtype)
+
+		if copy:
+			return array.copy()
+
+		return array
+
+	def __repr__(self):
+		return 'Column(%s, %s)' %(self.dtype, self.array)
+
+
+def to_columns(MOL):
+	""" Convert the numeric list fields of MOL to Columns in place. """
+	for key, dtype in column_types.items():
+		if key in MOL and not isinstance(MOL[key], Column):
+			MOL[key] = Column(dtype, MOL[key])
+
+	return MOL
+
+
+def to_lists(MOL):
+	""" Convert the Column fields of MOL back to python lists in place. """
+	for key, value in MOL.items():
+		if isinstance(value, Column):
+			MOL[key] = value.tolist()
+
+	return MOL
+
+
+def extend_field(MOL, key, values):
+	""" Append an array of values to a MOL field in one call,
+		whether the field is a Column or a python list. """
+	field = MOL[key]
+
+	if isinstance(field, Column):
+		field.extend(values)
+	else:
+		field.extend(np.asarray(values).tolist())
+
+	return MOL
+
+
+def set_field(MOL, key, values):
+	""" Replace a MOL field with an array of values, keeping it
+		a Column if it is one, a python list otherwise. """
+	field = MOL.get(key, None)
+
+	if isinstance(field, Column):
+		MOL[key] = Column(field.dtype, values)
+	else:
+		MOL[key] = np.asarray(values).tolist()
+
+	return MOL
+
+
+def _json_default(obj):
+	# json can not serialize the numpy types directly
+	if isinstance(obj, (Column, np.ndarray)):
+		return obj.tolist()
+	if isinstance(obj, np.generic):
+		return obj.item()
+
+	raise TypeError('Object of type %s is not JSON serializable' %type(obj).__name__)
+
+
+def initialize(columnar=None):
 	""" Generate empty OpenMOL dictionary object with
-		the default properties.
+		the default properties. If columnar is True (defaults
+		to the module level COLUMNAR), the numeric per item
+		fields are typed numpy Columns instead of lists.
 		Note: openmol uses 0 based indexing. """
 
 	MOL = {}
@@ -126,34 +350,443 @@ def initialize():
 	MOL['FF_dihed_periodicity'] = []
 	MOL['dihed_ff_index'] = []
 
+	if columnar is None:
+		columnar = COLUMNAR
+
+	if columnar:
+		to_columns(MOL)
+
 	return AttrDict(MOL)
 
 
-def write_json(MOL, json_file, compress=False):
+def _open_json(json_file, mode, compression=None):
+	""" Open a plain, gzip or xz compressed JSON file in text mode.
+		When reading, the compression is detected from the magic bytes,
+		when writing from the compression argument or the file extension. """
+
+	if 'r' in mode:
+		with open(json_file, 'rb') as fp:
+			magic = fp.read(6)
+		if magic.startswith(b'\x1f\x8b'):
+			compression = 'gzip'
+		elif magic.startswith(b'\xfd7zXZ\x00'):
+			compression = 'xz'
+
+	elif compression is None:
+		if json_file.endswith('.gz'):
+			compression = 'gzip'
+		elif json_file.endswith('.xz'):
+			compression = 'xz'
+
+	if compression == 'gzip':
+		return gzip.open(json_file, mode.replace('+', '') + 't', compresslevel=6)
+	elif compression == 'xz':
+		return lzma.open(json_file, mode.replace('+', '') + 't')
+	elif compression:
+		raise ValueError('unknown compression: %s' %compression)
+
+	return open(json_file, mode)
+
+
+def _is_flat(value):
+	# arrays of scalars can be written chunk by chunk
+	if isinstance(value, (Column, np.ndarray)):
+		return np.ndim(value) == 1
+	if isinstance(value, (list, tuple)):
+		return not any(isinstance(v, (list, tuple, dict, Column, np.ndarray)) for v in value)
+	return False
+
+
+def write_json(MOL, json_file, compress=False, compression=None):
 	""" Write the openmol object as openmol JSON file
 		Optional compress argument can be used to save
-		without any indentation. """
+		without any indentation.
+		The fields are written one by one, the arrays in chunks, so
+		the whole document is never held in memory. The output is the
+		same as json.dump. Optional compression can be 'gzip' or 'xz',
+		guessed from a .gz or .xz extension if not given. """
+
+	if compress:
+		newline, pad, key_sep = '', '', ':'
+	else:
+		newline, pad, key_sep = '\n', '    ', ': '
+
+	stage = Stage('write', 'json', json_file)
+
+	with _open_json(json_file, 'w+', compression) as fp:
+		for i, (key, value) in enumerate(MOL.items()):
+			fp.write('{' if i == 0 else ',')
+			fp.write(newline + pad + json.dumps(key) + key_sep)
+
+			if not _is_flat(value) or len(value) == 0:
+				if compress:
+					fp.write(json.dumps(value, separators=(',', ':'), default=_json_default))
+				else:
+					text = json.dumps(value, indent=4, default=_json_default)
+					fp.write(text.replace('\n', '\n' + pad))
+				continue
+
+			# stream the items of the array, chunk by chunk
+			sep = ',' + newline + pad * 2
+			fp.write('[' + newline + pad * 2)
+
+			for j in range(0, len(value), JSON_CHUNK):
+				chunk = value[j:j + JSON_CHUNK]
+				if not isinstance(chunk, list):
+					chunk = np.asarray(chunk).tolist()
+
+				if j > 0:
+					fp.write(sep)
+				fp.write(json.dumps(chunk, separators=(sep, ':'), default=_json_default)[1:-1])
+
+			fp.write(newline + pad + ']')
+
+		fp.write(newline + '}' if len(MOL) else '{}')
+
+	if stage.active:
+		stage.bytes = os.path.getsize(json_file)
+	stage.done(MOL.get('no_atoms', 0))
+
+	info('Write OK: %s' %json_file)
+
+
+class _JSONStream(object):
+	""" Incremental reader of a top level JSON object. Arrays are
+		decoded item by item from a small sliding text buffer. """
+
+	def __init__(self, fp):
+		self.fp = fp
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+		self.decoder = json.JSONDecoder()
+
+	def fill(self):
+		""" Read the next chunk, drop the consumed text """
+		if self.eof:
+			return False
+
+		data = self.fp.read(JSON_CHUNK * 16)
+		self.eof = len(data) == 0
+		self.buf = self.buf[self.pos:] + data
+		self.pos = 0
+		return not self.eof
+
+	def peek(self):
+		""" Next non white space character """
+		while True:
+			while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+				self.pos += 1
+			if self.pos < len(self.buf) or not self.fill():
+				return self.buf[self.pos:self.pos + 1]
+
+	def expect(self, chars):
+		c = self.peek()
+		if c not in chars or not c:
+			raise ValueError('invalid openmol JSON, expected %r, found %r' %(chars, c))
+		self.pos += 1
+		return c
+
+	def value(self):
+		""" Decode the next complete JSON value """
+		self.peek()
+
+		# a number cut at the buffer end would still decode, keep some look ahead
+		if len(self.buf) - self.pos < 64:
+			self.fill()
+
+		while True:
+			try:
+				value, end = self.decoder.raw_decode(self.buf, self.pos)
+			except json.JSONDecodeError:
+				if not self.fill():
+					raise
+				continue
+
+			# a number at the end of the buffer may continue in the next chunk
+			if end == len(self.buf) and self.fill():
+				continue
+
+			self.pos = end
+			return value
+
+	def array(self):
+		""" Decode an array a buffer full of items at a time """
+		items = []
+
+		while True:
+			# buf[pos] is the opening bracket, try the rest of the array at once
+			if self.buf.find(']', self.pos) >= 0:
+				try:
+					value, end = self.decoder.raw_decode(self.buf, self.pos)
+					if end < len(self.buf) or self.eof:
+						self.pos = end
+						return items + value
+				except json.JSONDecodeError:
+					pass
+
+			# array continues past the buffer, take the items upto the last comma.
+			# A comma inside a string or a nested array fails to decode.
+			cut = self.buf.rfind(',', self.pos + 1)
+			chunk = None
+			if cut > 0:
+				try:
+					chunk = json.loads('[' + self.buf[self.pos + 1:cut] + ']')
+				except json.JSONDecodeError:
+					pass
+
+			if chunk is not None:
+				items += chunk
+				self.pos = cut
+			else:
+				# decode a single item
+				self.pos += 1
+				if self.peek() == ']':
+					self.pos += 1
+					return items
+
+				items.append(self.value())
+				if self.expect(',]') == ']':
+					return items
+				self.pos -= 1
+
+			# the separator comma becomes the opening bracket of the rest
+			self.buf = '[' + self.buf[self.pos + 1:]
+			self.pos = 0
+			if not self.fill() and self.eof and len(self.buf) <= 1:
+				raise ValueError('invalid openmol JSON, unterminated array')
+
+	def items(self):
+		""" Yield the key and value pairs of the top level object """
+		self.expect('{')
+		if self.peek() == '}':
+			return
+
+		while True:
+			key = self.value()
+			self.expect(':')
+
+			if self.peek() == '[':
+				value = self.array()
+			else:
+				value = self.value()
+
+			yield key, value
+
+			if self.expect(',}') == '}':
+				return
+
+
+def load_json(json_file, columnar=None):
+	""" Load a openmol type JSON file and return the openmol object.
+		The file may be gzip or xz compressed. It is parsed field by
+		field and item by item, the whole text is never in memory. """
+
+	if columnar is None:
+		columnar = COLUMNAR
 
-	with open(json_file, 'w+') as fp:
-		if compress:
-			json.dump(MOL,fp, indent=None, separators=(',', ':'))
-		else:
-			json.dump(MOL, fp, indent=4)
+	MOL = {}
+	stage = Stage('read', 'json', json_file)
 
-	print('Write OK: %s' %json_file)
+	with _open_json(json_file, 'r') as fp:
+		for key, value in _JSONStream(fp).items():
+			if columnar and key in column_types:
+				value = Column(column_types[key], value)
+			MOL[key] = value
 
+	MOL['source_json'] = json_file
 
-def load_json(json_file):
-	""" Load a openmol type JSON file and return the openmol object """
-	with open(json_file, 'r') as fp:
-		MOL = json.load(fp)
+	if stage.active:
+		stage.bytes = os.path.getsize(json_file)
+	stage.done(MOL.get('no_atoms', 0))
 
-	MOL['source_json'] = json_file
-	print('Load OK: %s' %json_file)
+	info('Load OK: %s' %json_file)
 
 	return AttrDict(MOL)
 
 
+def _binary_field(value):
+	""" Classify a MOL value for the binary container. Returns the
+		kind ('array', 'strings' or 'json') and the array to save. """
+
+	if isinstance(value, (Column, np.ndarray)):
+		return 'array', np.asarray(value)
+
+	if isinstance(value, (list, tuple)) and len(value):
+		types = set(map(type, value))
+
+		if types == {str}:
+			return 'strings', None
+		if types == {int}:
+			return 'array', np.asarray(value, dtype=np.int64)
+		if types <= {int, float}:
+			return 'array', np.asarray(value, dtype=np.float64)
+
+	return 'json', None
+
+
+def write_binary(MOL, bin_file):
+	""" Write the openmol object as a binary container. Numeric fields
+		are saved as raw little endian arrays, string fields dictionary
+		encoded, and the rest in a small JSON header.
+
+		Layout: magic, header size (uint64), JSON header, then each
+		array aligned to BINARY_ALIGN bytes from the file start. """
+
+	stage = Stage('write', 'binary', bin_file)
+
+	header = {'version': 1, 'fields': {}}
+	arrays = []
+	offset = 0
+
+	for key, value in MOL.items():
+		kind, array = _binary_field(value)
+
+		if kind == 'json':
+			header['fields'][key] = {'kind': kind, 'value': value}
+			continue
+
+		field = {'kind': kind}
+
+		if kind == 'strings':
+			# dictionary encoding, unique values and a code per item
+			vocabulary = {}
+			codes = np.fromiter((vocabulary.setdefault(v, len(vocabulary)) for v in value),
+								dtype=np.int32, count=len(value))
+			field['vocabulary'] = list(vocabulary)
+			array = codes
+
+		array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+		field['dtype'] = array.dtype.str
+		field['count'] = len(array)
+		field['offset'] = offset
+
+		header['fields'][key] = field
+		arrays.append(array)
+		offset += array.nbytes + (-array.nbytes % BINARY_ALIGN)
+
+	head = json.dumps(header, default=_json_default).encode('utf-8')
+
+	# data starts at the first aligned offset after the header
+	start = len(BINARY_MAGIC) + 8 + len(head)
+	start += -start % BINARY_ALIGN
+
+	with open(bin_file, 'wb+') as fp:
+		fp.write(BINARY_MAGIC)
+		fp.write(np.uint64(start).tobytes())
+		fp.write(head)
+		fp.write(b'\0' * (start - fp.tell()))
+
+		for array in arrays:
+			fp.write(array.tobytes())
+			fp.write(b'\0' * (-array.nbytes % BINARY_ALIGN))
+
+		stage.bytes = fp.tell()
+
+	stage.done(MOL.get('no_atoms', 0))
+	info('Write OK: %s' %bin_file)
+
+
+def _load_binary_header(fp):
+	magic = fp.read(len(BINARY_MAGIC))
+	if magic != BINARY_MAGIC:
+		raise ValueError('%s is not an openmol binary file' %fp.name)
+
+	start = int(np.frombuffer(fp.read(8), dtype=np.uint64)[0])
+	head = fp.read(start - len(BINARY_MAGIC) - 8).rstrip(b'\0')
+	return start, json.loads(head.decode('utf-8'))
+
+
+def _load_binary_field(mm, start, field):
+	if field['kind'] == 'json':
+		return field['value']
+
+	# zero copy, a read only view of the map
+	data = np.frombuffer(mm, dtype=np.dtype(field['dtype']),
+					count=field['count'], offset=start + field['offset'])
+
+	if field['kind'] == 'strings':
+		vocabulary = np.array(field['vocabulary'], dtype=object)
+		return vocabulary[data].tolist()
+
+	return Column.wrap(data)
+
+
+def load_binary(bin_file, fields=None):
+	""" Load an openmol binary container written by write_binary.
+		The numeric fields are memory mapped, zero copy, as Columns.
+		If fields is given, only those and the scalar items are loaded. """
+
+	stage = Stage('read', 'binary', bin_file)
+
+	with open(bin_file, 'rb') as fp:
+		start, header = _load_binary_header(fp)
+
+		# the map stays open as long as any array refers to it
+		mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+	MOL = {}
+	for key, field in header['fields'].items():
+		if fields is None or key in fields or field['kind'] == 'json':
+			MOL[key] = _load_binary_field(mm, start, field)
+
+	MOL['source_binary'] = bin_file
+
+	# the arrays are mapped, only the header is actually read
+	stage.bytes = start
+	stage.done(MOL.get('no_atoms', 0))
+
+	info('Load OK: %s' %bin_file)
+
+	return AttrDict(MOL)
+
+
+def read_binary_field(bin_file, key):
+	""" Read a single field of an openmol binary container,
+		without loading the rest. """
+
+	with open(bin_file, 'rb') as fp:
+		start, header = _load_binary_header(fp)
+		mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+	return _load_binary_field(mm, start, header['fields'][key])
+
+
+def file_signature(path):
+	""" Size and modification time of a file, used to detect
+		if a saved index still matches its source file. """
+	stat = os.stat(path)
+	return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_index(index, source, index_file):
+	""" Save a byte offset index of the source file as JSON,
+		stamped with the signature of the source file. """
+	index = dict(index)
+	index['signature'] = file_signature(source)
+
+	with open(index_file, 'w+') as fp:
+		json.dump(index, fp)
+
+	info('Write OK: %s' %index_file)
+
+
+def load_index(source, index_file):
+	""" Load a saved index of the source file. Returns None if there
+		is no index, or the source file has changed since. """
+	if not os.path.isfile(index_file):
+		return None
+
+	with open(index_file, 'r') as fp:
+		index = json.load(fp)
+
+	if index.get('signature') != file_signature(source):
+		print('-- Warning: %s was modified after indexing, ignoring stale index %s' %(source, index_file))
+		return None
+
+	return index
+
+
 def check_atoms_ok(MOL):
 	conditions_fail = [
 		not MOL['no_atoms'],
@@ -231,6 +864,203 @@ def update_summary(MOL, overwrite=False):
 	return MOL
 
 
+def deep_size(value, seen=None):
+	""" Bytes of memory held by a value, including the items of lists,
+		tuples and dicts and the data buffers of arrays and Columns.
+		Objects whose ids are in seen are not counted again. Memory
+		mapped arrays, e.g. of load_binary(), are not counted. """
+
+	if seen is None:
+		seen = set()
+
+	if id(value) in seen:
+		return 0
+	seen.add(id(value))
+
+	size = sys.getsizeof(value)
+
+	if isinstance(value, Column):
+		size += deep_size(value._data, seen)
+
+	elif isinstance(value, np.ndarray):
+		# views do not include the buffer of the array they refer to
+		base = value
+		while isinstance(base.base, np.ndarray):
+			base = base.base
+
+		if base is not value:
+			size += deep_size(base, seen)
+		elif value.base is not None and not isinstance(value.base, mmap.mmap):
+			size += deep_size(value.base, seen)
+
+		if value.dtype == object:
+			size += sum(deep_size(item, seen) for item in value.ravel().tolist())
+
+	elif isinstance(value, dict):
+		for key, item in dict.items(value):
+			size += deep_size(key, seen) + deep_size(item, seen)
+
+	elif isinstance(value, (list, tuple, set, frozenset)):
+		for item in value:
+			if id(item) not in seen:
+				size += deep_size(item, seen)
+
+	return size
+
+def memory_usage(MOL):
+	""" Bytes held by each field of MOL, largest first, see deep_size().
+		Within a field shared items, e.g. repeated residue names, are
+		counted once. Fields not yet loaded by a lazy reader are left
+		out. Returns a dictionary of the field names and the sizes. """
+
+	sizes = {key: deep_size(value) for key, value in dict.items(MOL)}
+	return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+def print_memory(MOL, top=10):
+	""" Print the total and the largest fields of memory_usage() """
+	sizes = memory_usage(MOL)
+	print('Memory: %.3f MB in %d fields' %(sum(sizes.values()) / 1e6, len(sizes)))
+
+	for key, size in list(sizes.items())[:top]:
+		print('  %-24s %12.3f MB' %(key, size / 1e6))
+
+def set_quiet(quiet=True):
+	""" Turn off (or back on) the progress messages """
+	global VERBOSE
+	VERBOSE = not quiet
+
+def info(*args, **kwargs):
+	""" Print a progress message unless quiet """
+	if VERBOSE:
+		print(*args, **kwargs)
+
+class Stage(object):
+	""" Wall time of a pipeline stage, e.g. a section parsed, a build
+		step or a writer section. When done, an event dictionary is
+		passed to each function in hooks:
+
+			kind	read, build or write
+			stage	name of the section or the step
+			source	file name, if any
+			time	wall time in seconds
+			records	no. of records processed
+			bytes	no. of bytes read or written
+			ok		False if the stage raised an exception
+			memory	peak bytes allocated above the start, only if
+					tracemalloc is tracing, None otherwise
+
+		Nothing is measured if no hooks are set. Can be used as a
+		context manager, or by calling done() at the end. The bytes
+		written to fp, if given, are counted. """
+
+	def __init__(self, kind, stage, source=None, records=0, fp=None):
+		self.active = len(hooks) > 0
+		self.kind = kind
+		self.stage = stage
+		self.source = source
+		self.records = records
+		self.bytes = 0
+
+		if self.active:
+			self.fp = fp
+			self.offset = fp.tell() if fp is not None else 0
+			self.memory = None
+
+			if tracemalloc.is_tracing():
+				# the peak so far belongs to the enclosing stage
+				current, peak = tracemalloc.get_traced_memory()
+				if _memory_stages:
+					_memory_stages[-1].peak = max(_memory_stages[-1].peak, peak)
+
+				tracemalloc.reset_peak()
+				self.base = self.peak = current
+				_memory_stages.append(self)
+
+			self.start = time.perf_counter()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.done(ok=exc_type is None)
+
+	def done(self, records=None, ok=True):
+		if not self.active:
+			return
+
+		self.active = False
+		elapsed = time.perf_counter() - self.start
+
+		if self in _memory_stages:
+			# also drop the inner stages never done, e.g. after errors
+			while _memory_stages.pop() is not self:
+				pass
+
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+			self.memory = self.peak - self.base
+
+			if _memory_stages:
+				_memory_stages[-1].peak = max(_memory_stages[-1].peak, self.peak)
+			tracemalloc.reset_peak()
+
+		if records is not None:
+			self.records = records
+
+		if self.fp is not None and not self.fp.closed:
+			self.bytes = self.fp.tell() - self.offset
+
+		event = {
+			'kind': self.kind,
+			'stage': self.stage,
+			'source': self.source,
+			'time': elapsed,
+			'records': self.records,
+			'bytes': self.bytes,
+			'ok': ok,
+			'memory': self.memory,
+		}
+
+		for hook in hooks:
+			hook(event)
+
+class record_stages(object):
+	""" Collect the events of the stages run inside a with block
+		into a list, e.g.
+
+			with openmol.record_stages() as events:
+				MOL = amber_parm7.read(prmtop, rst7)
+
+		If memory is True, tracemalloc is started to measure the peak
+		memory of each stage as well. It slows down the stages. """
+
+	def __init__(self, memory=False):
+		self.memory = memory and not tracemalloc.is_tracing()
+
+	def __enter__(self):
+		self.events = []
+		hooks.append(self.events.append)
+
+		if self.memory:
+			tracemalloc.start()
+
+		return self.events
+
+	def __exit__(self, *args):
+		hooks.remove(self.events.append)
+
+		if self.memory:
+			tracemalloc.stop()
+			del _memory_stages[:]
+
+def _chunk_list(values, start, end):
+	""" Python scalars of values[start:end] of a field. """
+	if isinstance(values, Column):
+		values = values.array
+	if isinstance(values, np.ndarray):
+		return values[start:end].tolist()
+	return values[start:end]
+
+
 class Writer(object):
 	""" Base file writer interface to implement in different
 		Writer classes. """
@@ -239,13 +1069,36 @@ class Writer(object):
 		self.out_file = out_file
 		self.fp = open(out_file, 'w+')
 		self.MOL = MOL
+		self.stage = Stage('write', 'total', out_file, fp=self.fp)
+
+	def section(self, name, records=0):
+		""" Stage of writing a section, to use in a with block """
+		return Stage('write', name, self.out_file, records, self.fp)
 
 	def title(self):
 		self.fp.write("%s (by OpenMOL)\n\n" %self.MOL['title'])
 
+	def write_rows(self, row_format, *columns):
+		""" Write one line of the old style row_format per row of the
+			columns (lists, Columns, arrays or ranges). A chunk of rows
+			is formatted by a single % operation and written at once.
+			Raises ValueError if the columns differ in length. """
+
+		if len(set(map(len, columns))) > 1:
+			raise ValueError('columns of different lengths: %s' %', '.join(str(len(c)) for c in columns))
+
+		size = len(columns[0]) if columns else 0
+
+		for start in range(0, size, WRITE_CHUNK):
+			end = min(start + WRITE_CHUNK, size)
+			rows = zip(*[_chunk_list(c, start, end) for c in columns])
+			values = tuple(itertools.chain.from_iterable(rows))
+			self.fp.write((row_format * (end - start)) % values)
+
 	def close(self):
+		self.stage.done(self.MOL.get('no_atoms', 0))
 		self.fp.close()
-		print('Write OK: %s' %self.out_file)
+		info('Write OK: %s' %self.out_file)
 
 
 	def write(self):
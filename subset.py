@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+""" Extract a subset of the atoms of an OpenMOL object.
+
+	The selected atoms keep their order. The bonds, angles and dihedrals
+	of the removed atoms are dropped, the rest renumbered through an
+	old to new atom index map. Residues without any selected atom are
+	dropped and the force field types no longer used are removed, with
+	their *_ff_index renumbered the same way. All the steps are array
+	operations, the cost is linear in the size of the MOL.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import itertools
+
+import numpy as np
+
+import openmol
+import neighbors
+import amber_parm7 as parm
+
+# atom index fields of each record table, and its count
+record_tables = {
+	'bond': (['bond_from', 'bond_to'], 'no_bonds'),
+	'angle': (['angle_a', 'angle_b', 'angle_c'], 'no_angles'),
+	'dihed': (['dihed_a', 'dihed_b', 'dihed_c', 'dihed_d'], 'no_diheds'),
+}
+
+# type index field, its count, the field of one item per type (None to
+# use the count) and the prefixes of the per type fields
+type_tables = [
+	('bond_ff_index', 'no_bond_types', 'FF_bond_k', ['FF_bond_', 'unique_bond_types']),
+	('angle_ff_index', 'no_angle_types', 'FF_angle_k', ['FF_angle_', 'unique_angle_types']),
+	('dihed_ff_index', 'no_dihed_types', 'FF_dihed_k', ['FF_dihed_', 'unique_dihed_types']),
+	('atom_type_index', 'no_atom_types', 'unique_atom_types', ['FF_lj_', 'unique_atom_types', 'unique_atom_mass']),
+	('pair_ff_index', 'PARM_NTYPES', None, ['parm7_lj_epsilon', 'parm7_lj_sigma']),
+]
+
+# PARM7 record sections of each table, as read by amber_parm7 the
+# records with a hydrogen first, then the others
+record_sections = {
+	'bond': ('BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN'),
+	'angle': ('ANGLES_INC_HYDROGEN', 'ANGLES_WITHOUT_HYDROGEN'),
+	'dihed': ('DIHEDRALS_INC_HYDROGEN', 'DIHEDRALS_WITHOUT_HYDROGEN'),
+}
+
+# PARM7 pointers updated to the length of a field
+parm_lengths = {
+	'PARM_NATOM': 'atom_name',
+	'PARM_NRES': 'residue_start',
+	'PARM_NUMBND': 'FF_bond_k',
+	'PARM_NUMANG': 'FF_angle_k',
+	'PARM_NPTRA': 'FF_dihed_k',
+}
+
+
+def is_field(value):
+	return isinstance(value, (list, openmol.Column, np.ndarray))
+
+
+def indices(value):
+	""" Integer array of an index field, a Column is not copied """
+
+	if isinstance(value, openmol.Column):
+		return value.array
+
+	if isinstance(value, np.ndarray):
+		return value
+
+	return np.fromiter(value, dtype=np.int64, count=len(value))
+
+
+def take(value, keep):
+	""" Items of a field where the boolean keep array is True,
+		of the same kind as the field. """
+
+	if isinstance(value, openmol.Column):
+		return openmol.Column.wrap(value.array[keep])
+
+	if isinstance(value, np.ndarray):
+		return value[keep]
+
+	return list(itertools.compress(value, keep.tolist()))
+
+
+def store(value, array):
+	""" A computed array as a field of the same kind as value """
+
+	if isinstance(value, openmol.Column):
+		return openmol.Column.wrap(array.astype(value.dtype))
+
+	if isinstance(value, np.ndarray):
+		return array
+
+	return array.tolist()
+
+
+def filter_records(MOL, NEW, keep, new_index):
+	""" Keep the records of each table whose atoms are all kept """
+
+	for table, (columns, count_key) in record_tables.items():
+		count = len(MOL.get(columns[0], []))
+		if count == 0 or any(len(MOL.get(c, [])) != count for c in columns):
+			continue
+
+		atoms = [indices(MOL[c]) for c in columns]
+		kept = np.ones(count, dtype=bool)
+		for a in atoms:
+			kept &= keep[a]
+
+		for key, value in MOL.items():
+			if not key.startswith(table + '_') or not is_field(value) or len(value) != count:
+				continue
+
+			if key in columns:
+				NEW[key] = store(value, new_index[atoms[columns.index(key)][kept]])
+			else:
+				NEW[key] = take(value, kept)
+
+		NEW[count_key] = int(kept.sum())
+		record_pointers(MOL, NEW, table, kept)
+
+
+def record_pointers(MOL, NEW, table, kept):
+	""" Update the PARM7 pointers of the no. of records of a table with
+		and without a hydrogen, the first PARM_NBONH, PARM_NTHETH or
+		PARM_NPHIH records have a hydrogen. """
+
+	hydrogen, other = record_sections[table]
+	first = 'PARM_%s' %parm.record_pointers[hydrogen][0]
+
+	if first not in MOL or MOL[first] > len(kept):
+		return
+
+	parm.set_record_pointers(NEW, hydrogen, int(kept[:MOL[first]].sum()))
+	parm.set_record_pointers(NEW, other, int(kept[MOL[first]:].sum()))
+
+
+def drop_types(MOL, NEW, index_key, count_key, primary, prefixes, count):
+	""" Remove the types no longer used by the index_key field of count
+		items, renumber the field. Returns the mask of the kept types,
+		None if the field is not set. """
+
+	if len(MOL.get(index_key, [])) != count or count == 0:
+		return None
+
+	no_types = len(MOL.get(primary, [])) if primary else MOL.get(count_key, 0)
+	if not no_types:
+		return None
+
+	index = indices(NEW[index_key])
+	valid = (index >= 0) & (index < no_types)
+
+	used = np.zeros(no_types, dtype=bool)
+	used[index[valid]] = True
+	renumber = np.cumsum(used) - 1
+
+	NEW[index_key] = store(NEW[index_key], np.where(valid, renumber[np.where(valid, index, 0)], index))
+
+	for key, value in MOL.items():
+		if any(key.startswith(p) for p in prefixes) and is_field(value) and len(value) == no_types:
+			NEW[key] = take(value, used)
+
+	if count_key in MOL:
+		NEW[count_key] = int(used.sum())
+
+	return used
+
+
+def drop_lj_pairs(MOL, NEW, used):
+	""" Keep the PARM7 nonbonded index of the kept LJ types, and the
+		A and B coefficients of the pairs still referenced. """
+
+	no_types = len(used)
+	if len(MOL.get('parm7_lj_index', [])) != no_types * no_types:
+		return
+
+	types = np.flatnonzero(used)
+	lj_index = indices(MOL['parm7_lj_index']).reshape(no_types, no_types)
+	lj_index = lj_index[np.ix_(types, types)].ravel()
+
+	# 1 based, negative for the 10-12 hydrogen bond pairs
+	positive = lj_index > 0
+	pairs = np.unique(lj_index[positive])
+
+	if len(MOL.get('parm7_lj_acoeff', [])) and pairs.max(initial=0) <= len(MOL['parm7_lj_acoeff']):
+		renumber = np.zeros(pairs.max(initial=0) + 1, dtype=np.int64)
+		renumber[pairs] = np.arange(1, len(pairs) + 1)
+		lj_index[positive] = renumber[lj_index[positive]]
+
+		for key in ['parm7_lj_acoeff', 'parm7_lj_bcoeff']:
+			if len(MOL.get(key, [])) == len(MOL['parm7_lj_acoeff']):
+				NEW[key] = store(MOL[key], np.asarray(MOL[key])[pairs - 1])
+
+	NEW['parm7_lj_index'] = store(MOL['parm7_lj_index'], lj_index)
+
+
+def filter_residues(MOL, NEW, keep):
+	""" Keep the residues with any kept atom, starting at their first
+		kept atom, and renumber atom_resid. """
+
+	n = len(keep)
+	starts = indices(MOL.get('residue_start', []))
+	no_residues = len(starts)
+	if no_residues == 0:
+		return
+
+	ends = np.append(starts[1:], n)
+
+	# no. of kept atoms before each atom
+	before = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum(keep, out=before[1:])
+
+	kept = before[ends] - before[starts]
+	residues = kept > 0
+	new_starts = before[starts]
+
+	for key, value in MOL.items():
+		if not key.startswith('residue_') or not is_field(value) or len(value) != no_residues:
+			continue
+
+		if key == 'residue_start':
+			NEW[key] = store(value, new_starts[residues])
+		elif key == 'residue_end':
+			# same offset from the end of the residue as before
+			end = new_starts + kept + np.asarray(value, dtype=np.int64) - ends
+			NEW[key] = store(value, end[residues])
+		else:
+			NEW[key] = take(value, residues)
+
+	NEW['no_residues'] = int(residues.sum())
+
+	resid = NEW.get('atom_resid', [])
+	if len(resid) and len(resid) == int(keep.sum()):
+		resid = indices(resid)
+		# only if they are the residue indices
+		if resid.min() >= 0 and resid.max() < no_residues:
+			NEW['atom_resid'] = store(NEW['atom_resid'], (np.cumsum(residues) - 1)[resid])
+
+
+def extract(MOL, atoms):
+	""" New MOL of the selected atoms, given as a boolean mask or
+		indices, with all the per atom, bonded, residue and force field
+		items made consistent. The coordinates and box are kept as is.
+		The fields of MOL are not modified. Returns False if an index
+		is negative or out of range. """
+
+	n = MOL['no_atoms']
+
+	selected = neighbors.selection(atoms, n)
+	if len(selected) and (selected.min() < 0 or selected.max() >= n):
+		print('-- Error: atom index out of range of %d atoms.' %n)
+		return False
+
+	stage = openmol.Stage('build', 'extract')
+
+	keep = np.zeros(n, dtype=bool)
+	keep[selected] = True
+
+	new_index = np.full(n, -1, dtype=np.int64)
+	new_index[keep] = np.arange(int(keep.sum()))
+
+	NEW = openmol.AttrDict(dict(MOL.items()))
+
+	for key, value in MOL.items():
+		if (key.startswith('atom_') or key == 'pair_ff_index') and is_field(value) and len(value) == n:
+			NEW[key] = take(value, keep)
+
+	NEW['no_atoms'] = int(keep.sum())
+
+	filter_records(MOL, NEW, keep, new_index)
+
+	for index_key, count_key, primary, prefixes in type_tables:
+		table = index_key.split('_')[0]
+		count = n if table in ['atom', 'pair'] else len(MOL.get(record_tables[table][0][0], []))
+		used = drop_types(MOL, NEW, index_key, count_key, primary, prefixes, count)
+
+		if index_key == 'pair_ff_index' and used is not None:
+			drop_lj_pairs(MOL, NEW, used)
+
+	# types named by the atoms only, before the force field is built
+	if len(MOL.get('atom_type_index', [])) != n and len(MOL.get('atom_type', [])) == n:
+		present = set(NEW['atom_type'])
+		kept = np.array([t in present for t in MOL.get('unique_atom_types', [])], dtype=bool)
+		for key in ['unique_atom_types', 'unique_atom_mass']:
+			if len(MOL.get(key, [])) == len(kept):
+				NEW[key] = take(MOL[key], kept)
+		if 'no_atom_types' in MOL and len(kept):
+			NEW['no_atom_types'] = int(kept.sum())
+
+	filter_residues(MOL, NEW, keep)
+
+	for pointer, key in parm_lengths.items():
+		if pointer in MOL and key in NEW:
+			NEW[pointer] = len(NEW[key])
+
+	# the fields left as they are are copied too
+	for key, value in NEW.items():
+		if value is MOL[key] and isinstance(value, list):
+			NEW[key] = list(value)
+		elif value is MOL[key] and isinstance(value, (openmol.Column, np.ndarray)):
+			NEW[key] = store(value, np.array(value))
+
+	stage.done(NEW['no_atoms'])
+	openmol.info('Extracted %d of %d atoms.' %(NEW['no_atoms'], n))
+	return NEW
+
+
+def residue_atoms(MOL, names):
+	""" Mask of the atoms in the residues of the given names """
+
+	n = MOL['no_atoms']
+	starts = np.asarray(MOL['residue_start'], dtype=np.int64)
+	if len(starts) == 0:
+		return np.zeros(n, dtype=bool)
+
+	selected = np.isin(np.asarray(MOL['residue_name'][:len(starts)], dtype=str), list(names))
+
+	# residue of each atom, -1 before the first one
+	residue = np.searchsorted(starts, np.arange(n), side='right') - 1
+	return (residue >= 0) & selected[np.maximum(residue, 0)]
+
+
+def strip(MOL, names=('WAT', 'HOH', 'Na+', 'Cl-')):
+	""" New MOL without the residues of the given names, e.g. the
+		water and the counter ions. """
+	return extract(MOL, ~residue_atoms(MOL, names))
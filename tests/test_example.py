@@ -0,0 +1,970 @@
+""" Tests of the readers, writers and builders, mostly on the
+	oleylamine example, grouped by module. Run with python -m pytest tests.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+import os
+import sys
+import json
+import filecmp
+import shutil
+import struct
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+sys.path.append(os.path.join(HERE, '..', 'benchmarks'))
+
+import openmol
+import amber_parm7 as parm
+import amber_mdcrd as mdcrd
+import amber_netcdf as netcdf
+import batch
+import lammps_full as lammps
+import lammps_qmag as qmag
+import tripos_mol2 as mol2
+import neighbors
+import topology
+import subset
+
+import synthetic
+
+EXAMPLES = os.path.join(HERE, '..', 'examples')
+PRMTOP = os.path.join(EXAMPLES, 'oleylamine.prmtop')
+RST7 = os.path.join(EXAMPLES, 'oleylamine.rst7')
+
+# written by the list based reader, before the sections were decoded
+# in bulk, as openmol.write_json(parm.read(PRMTOP, RST7))
+BASELINE = os.path.join(HERE, 'data', 'oleylamine.baseline.json')
+
+# residues of the solvent of the synthetic systems
+SOLVENT = ['WAT', 'Na+', 'Cl-']
+
+# PARM7 pointers of the no. of atoms, residues and records of a subset
+POINTERS = ['PARM_%s' %p for p in ['NATOM', 'NRES', 'NBONH', 'MBONA', 'NBONA', 'NTHETH',
+	'MTHETA', 'NTHETA', 'NPHIH', 'MPHIA', 'NPHIA']]
+
+openmol.set_quiet()
+
+
+def plain(value):
+	""" A field as python lists and scalars, for comparison """
+	if isinstance(value, (openmol.Column, np.ndarray)):
+		return np.asarray(value).tolist()
+	if isinstance(value, dict):
+		return {k: plain(v) for k, v in value.items() if not k.startswith('source_')}
+	return value
+
+
+def assert_same(expected, actual, keys=None):
+	""" The fields of keys are equal, the floats to the printed precision """
+
+	for key in keys or expected:
+		a, b = plain(expected[key]), plain(actual[key])
+		if isinstance(a, list) and len(a) and isinstance(a[0], float):
+			assert np.allclose(a, b, rtol=1e-12, atol=0), key
+		else:
+			assert a == b, key
+
+
+def example():
+	return parm.read(PRMTOP, RST7)
+
+
+# numpy Columns
+
+
+def test_column_array_copy():
+	column = openmol.Column(np.int64, [1, 2, 3])
+
+	copied = np.array(column)
+	copied[0] = 10
+	assert column[0] == 1
+
+	view = np.asarray(column)
+	view[0] = 10
+	assert column[0] == 10
+
+	assert np.asarray(column, dtype=np.float64).tolist() == [10.0, 2.0, 3.0]
+	assert np.shares_memory(np.array(column, dtype=np.int64, copy=False), column.array)
+
+	with pytest.raises(ValueError):
+		np.array(column, dtype=np.float64, copy=False)
+
+
+# PARM7 sections
+
+
+def test_read_matches_baseline():
+	with open(BASELINE, 'r') as fp:
+		expected = json.load(fp)
+
+	MOL = example()
+	assert sorted(plain(MOL)) == sorted(plain(expected))
+
+	# the list based reader kept the new line of the title
+	expected['title'] = expected['title'].strip()
+	assert_same(plain(expected), MOL)
+
+
+@pytest.mark.parametrize('text, items', [
+	('       1      -2\n       3\n', [1, -2, 3]),
+	('-1234567-2345678\n       0\n', [-1234567, -2345678, 0]),
+	('12345678       9\n', [12345678, 9]),
+])
+def test_decode_integers(text, items):
+	assert parm.decode_section(text, '2I8').tolist() == items
+
+
+def test_decode_integers_invalid():
+	with pytest.raises(ValueError):
+		parm.decode_section('     1 2\n', '2I8')
+
+
+# synthetic systems
+
+
+@pytest.fixture(scope='module')
+def solvated(tmp_path_factory):
+	""" Input files of a small synthetic solvated system """
+	prefix = str(tmp_path_factory.mktemp('solvated') / 'solvated')
+	return synthetic.generate(1500, prefix, ['rst7'], solvent=True)
+
+
+def test_solvated_system(solvated):
+	MOL = parm.read(solvated['prmtop'], solvated['rst7'])
+
+	names = plain(MOL['residue_name'])
+	assert set(names) == set(SOLVENT + ['Olm'])
+	assert names.count('Na+') == names.count('Cl-')
+
+	solvent = subset.residue_atoms(MOL, SOLVENT)
+	assert 0.85 < solvent.sum() / MOL['no_atoms'] < 0.95
+	assert abs(np.asarray(MOL['atom_q'])[solvent].sum()) < 1e-6
+
+
+# subsets
+
+
+def test_extract_pointers():
+	MOL = example()
+	NEW = subset.extract(MOL, np.arange(10))
+
+	# the records with a hydrogen come first
+	kept = (np.asarray(MOL['bond_from']) < 10) & (np.asarray(MOL['bond_to']) < 10)
+	assert NEW['PARM_NBONH'] == kept[:MOL['PARM_NBONH']].sum()
+	assert NEW['PARM_NBONA'] == NEW['PARM_MBONA'] == kept[MOL['PARM_NBONH']:].sum()
+
+	assert NEW['PARM_NATOM'] == NEW['no_atoms'] == 10
+	assert NEW['no_bonds'] == NEW['PARM_NBONH'] + NEW['PARM_NBONA']
+	assert NEW['no_angles'] == NEW['PARM_NTHETH'] + NEW['PARM_NTHETA']
+	assert NEW['no_diheds'] == NEW['PARM_NPHIH'] + NEW['PARM_NPHIA']
+
+
+@pytest.mark.parametrize('atoms', [[0, -1], [0, 10000]])
+def test_extract_out_of_range(capsys, atoms):
+	assert subset.extract(example(), atoms) is False
+	assert 'out of range' in capsys.readouterr().out
+
+
+# filtered reads
+
+
+def resolved(MOL, index_key, table):
+	""" The values of a per type table for each item """
+	index = np.asarray(MOL[index_key])
+	return np.asarray(MOL[table])[index].tolist()
+
+
+def assert_same_atoms(expected, actual):
+	""" Same atoms, bonded items and residues, the force field types
+		compared by their values, the type indices may differ. """
+
+	keys = [key for key in expected if key.startswith(('atom_', 'bond_', 'angle_', 'dihed_', 'residue_', 'no_'))
+		and not key.endswith(('_ff_index', 'type_index')) and key not in ['no_atom_types', 'no_bond_types',
+		'no_angle_types', 'no_dihed_types']]
+	assert_same(expected, actual, keys)
+
+	for index_key, table in [('atom_type_index', 'unique_atom_types'), ('bond_ff_index', 'FF_bond_k'),
+			('angle_ff_index', 'FF_angle_eq'), ('dihed_ff_index', 'FF_dihed_k')]:
+		assert len(expected[index_key]) == len(actual[index_key]), index_key
+		if len(expected[index_key]):
+			assert resolved(expected, index_key, table) == resolved(actual, index_key, table), index_key
+
+
+def test_filtered_read_matches_strip(solvated):
+	MOL = parm.read(solvated['prmtop'], solvated['rst7'])
+	expected = subset.strip(MOL)
+	actual = parm.read(solvated['prmtop'], solvated['rst7'], exclude=SOLVENT)
+
+	assert actual['no_atoms'] == expected['no_atoms'] > 0
+	assert_same_atoms(expected, actual)
+	assert_same(expected, actual, POINTERS)
+
+
+def test_filtered_read_matches_extract(solvated):
+	MOL = parm.read(solvated['prmtop'], solvated['rst7'])
+	residues = [1, 2, 5, len(MOL['residue_start']) - 1]
+
+	starts = np.append(MOL['residue_start'], MOL['no_atoms'])
+	atoms = np.concatenate([np.arange(starts[r], starts[r + 1]) for r in residues])
+
+	expected = subset.extract(MOL, atoms)
+	actual = parm.read(solvated['prmtop'], solvated['rst7'], residues=residues)
+
+	assert actual['no_atoms'] == len(atoms)
+	assert_same_atoms(expected, actual)
+	assert_same(expected, actual, POINTERS)
+
+
+# lazy PARM7 reads
+
+
+def test_lazy_read(tmp_path):
+	prmtop = str(tmp_path / 'mol.prmtop')
+	shutil.copy(PRMTOP, prmtop)
+
+	expected = parm.read_prmtop(prmtop)
+	MOL = parm.read_prmtop(prmtop, lazy=True, index_file=prmtop + '.idx')
+	assert isinstance(MOL, parm.LazyMOL)
+	assert os.path.isfile(prmtop + '.idx')
+
+	# decoded on the first access only
+	assert 'atom_q' in MOL and not dict.__contains__(MOL, 'atom_q')
+	assert plain(MOL['atom_q']) == plain(expected['atom_q'])
+	assert dict.__contains__(MOL, 'atom_q') and not dict.__contains__(MOL, 'bond_from')
+
+	# a field set before its section is loaded is kept
+	MOL['atom_mass'] = [1.0]
+	assert plain(dict(MOL.items())) == plain(dict(expected, atom_mass=[1.0]))
+
+
+def test_lazy_saved_index(tmp_path, monkeypatch, capsys):
+	prmtop = str(tmp_path / 'mol.prmtop')
+	shutil.copy(PRMTOP, prmtop)
+	parm.index_prmtop(prmtop, prmtop + '.idx')
+
+	def index_prmtop(*args):
+		raise AssertionError('indexed again')
+
+	with monkeypatch.context() as patch:
+		patch.setattr(parm, 'index_prmtop', index_prmtop)
+		MOL = parm.read_prmtop(prmtop, lazy=True, index_file=prmtop + '.idx')
+		assert plain(MOL['atom_name']) == plain(example()['atom_name'])
+
+	# modified after indexing
+	with open(prmtop, 'a') as fp:
+		fp.write('%FLAG EXTRA\n%FORMAT(20a4)\nEXTR\n')
+
+	MOL = parm.read_prmtop(prmtop, lazy=True, index_file=prmtop + '.idx')
+	assert 'stale index' in capsys.readouterr().out
+	assert plain(MOL['atom_name']) == plain(example()['atom_name'])
+	assert openmol.load_index(prmtop, prmtop + '.idx') is not None
+
+
+# RST7 restarts
+
+
+@pytest.mark.parametrize('box', ['  30.0  30.0  30.0', '  30.0  30.0  30.0  90.0  90.0  90.0',
+	'  30.0000000  30.0000000  30.0000000', '  30.0  30.0  30.0\n'])
+def test_rst7_short_box_line(tmp_path, box):
+	rst7 = str(tmp_path / 'short.rst7')
+	with open(rst7, 'w') as fp:
+		fp.write('short box\n     2\n')
+		fp.write('   1.0000000   2.0000000   3.0000000  -4.0000000   5.0000000   6.0000000\n')
+		fp.write(box)
+
+	rst = parm.load_rst7(rst7)
+	assert rst['coordinates'].tolist() == [[1.0, 2.0, 3.0], [-4.0, 5.0, 6.0]]
+	assert rst['box'].tolist() == [30.0, 30.0, 30.0]
+
+
+# NetCDF restarts and trajectories
+
+
+def nc_name(name):
+	data = name.encode('utf-8')
+	return struct.pack('>i', len(data)) + data + b'\x00' * (-len(data) % 4)
+
+
+def nc_attributes(attributes):
+	if not attributes:
+		return struct.pack('>ii', 0, 0)
+
+	header = struct.pack('>ii', netcdf.NC_ATTRIBUTE, len(attributes))
+	for name, value in attributes.items():
+		if isinstance(value, str):
+			data, nc_type, count = value.encode('utf-8'), 2, len(value)
+		else:
+			data, nc_type, count = np.asarray(value, dtype='>f8').tobytes(), 6, np.size(value)
+		header += nc_name(name) + struct.pack('>ii', nc_type, count) + data + b'\x00' * (-len(data) % 4)
+	return header
+
+
+def write_netcdf(nc_file, dimensions, attributes, variables, streaming=False):
+	""" Write a NetCDF3 classic file, the dimensions as a dict of the
+		lengths, None for the record one, and the variables as a list
+		of the name, dimension names and the array. The arrays of the
+		record variables have the records as their first axis. """
+
+	names = list(dimensions)
+	record = [d for d in names if dimensions[d] is None]
+	numrecs = 0
+	types = {'f': 5, 'd': 6, 'S': 2}
+
+	def is_record(dims):
+		return len(dims) > 0 and dims[0] in record
+
+	def header(begins):
+		data = b'CDF\x01' + struct.pack('>I', netcdf.STREAMING if streaming else numrecs)
+		data += struct.pack('>ii', netcdf.NC_DIMENSION, len(names))
+		for name in names:
+			data += nc_name(name) + struct.pack('>i', dimensions[name] or 0)
+		data += nc_attributes(attributes)
+		data += struct.pack('>ii', netcdf.NC_VARIABLE, len(variables))
+		for name, dims, array in variables:
+			data += nc_name(name) + struct.pack('>i', len(dims))
+			data += b''.join(struct.pack('>i', names.index(d)) for d in dims)
+			data += nc_attributes({}) + struct.pack('>iii', types[array.dtype.char], vsizes[name], begins[name])
+		return data
+
+	fixed, slabs, vsizes = [], [], {}
+	for name, dims, array in variables:
+		array = array.astype(array.dtype.newbyteorder('>'))
+		size = array[:1].nbytes if is_record(dims) else array.nbytes
+		vsizes[name] = size + (-size % 4)
+		if is_record(dims):
+			numrecs = len(array)
+			slabs.append(array)
+		else:
+			fixed.append(array.tobytes() + b'\x00' * (-array.nbytes % 4))
+
+	# the fixed variables first, then a slab of each record variable
+	begins, pos = {}, len(header({name: 0 for name, dims, array in variables}))
+	for name, dims, array in sorted(variables, key=lambda v: is_record(v[1])):
+		begins[name] = pos
+		pos += vsizes[name]
+
+	with open(nc_file, 'wb') as fp:
+		fp.write(header(begins))
+		fp.write(b''.join(fixed))
+		for i in range(numrecs):
+			for slab in slabs:
+				fp.write(slab[i:i + 1].tobytes() + b'\x00' * (-slab[i:i + 1].nbytes % 4))
+
+
+def nc_trajectory(nc_file, coordinates, streaming=False):
+	""" AMBER NetCDF trajectory of the (frames, N, 3) coordinates """
+	frames = len(coordinates)
+	write_netcdf(nc_file, {'frame': None, 'spatial': 3, 'atom': coordinates.shape[1], 'cell_spatial': 3},
+		{'Conventions': 'AMBER', 'title': 'test trajectory'}, [
+			('spatial', ['spatial'], np.array([b'x', b'y', b'z'])),
+			('time', ['frame'], np.arange(frames, dtype='f') * 2.0),
+			('coordinates', ['frame', 'atom', 'spatial'], coordinates.astype('f')),
+			('cell_lengths', ['frame', 'cell_spatial'], np.full((frames, 3), 30.0) + np.arange(frames)[:, None]),
+		], streaming)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_netcdf_trajectory(tmp_path, streaming):
+	nc_file = str(tmp_path / 'mol.nc')
+	coordinates = np.random.RandomState(0).uniform(-10, 10, (3, 4, 3)).astype('f')
+	nc_trajectory(nc_file, coordinates, streaming)
+
+	with netcdf.NetCDF(nc_file) as nc:
+		assert nc.no_records == 3
+		assert nc.read('spatial') == 'xyz'
+		assert nc.shape('coordinates') == (3, 4, 3)
+
+	frames = list(netcdf.frames(nc_file))
+	assert len(frames) == 3
+	for i, frame in enumerate(frames):
+		assert frame['title'] == 'test trajectory' and frame['no_atoms'] == 4
+		assert frame['coordinates'].tolist() == coordinates[i].tolist()
+		assert frame['box'].tolist() == [30.0 + i] * 3
+		assert frame['time'] == 2.0 * i and frame['velocities'] is None
+
+	assert netcdf.load(nc_file, -1)['coordinates'].tolist() == coordinates[2].tolist()
+	with pytest.raises(IndexError):
+		netcdf.load(nc_file, 3)
+
+
+def test_netcdf_restart(tmp_path):
+	nc_file = str(tmp_path / 'mol.ncrst')
+	MOL = example()
+	xyz = np.column_stack([MOL['atom_x'], MOL['atom_y'], MOL['atom_z']]) + 1.0
+
+	write_netcdf(nc_file, {'spatial': 3, 'atom': len(xyz), 'cell_spatial': 3, 'cell_angular': 3},
+		{'Conventions': 'AMBERRESTART', 'title': 'test restart'}, [
+			('time', [], np.array([10.0])),
+			('coordinates', ['atom', 'spatial'], xyz),
+			('cell_lengths', ['cell_spatial'], np.array([40.0, 41.0, 42.0])),
+			('cell_angles', ['cell_angular'], np.array([90.0, 90.0, 90.0])),
+		])
+
+	assert netcdf.is_netcdf(nc_file) and not netcdf.is_netcdf(RST7)
+
+	MOL = parm.read_restart(MOL, nc_file)
+	assert np.asarray(MOL['atom_x']).tolist() == xyz[:, 0].tolist()
+	assert (MOL['box_x'], MOL['box_y'], MOL['box_z']) == (40.0, 41.0, 42.0)
+	assert MOL['time'] == 10.0
+
+
+# MDCRD trajectories
+
+
+def write_mdcrd(mdcrd_file, frames, box=None):
+	""" Write (N, 3) frames as 10F8.3 records, and a box line if given """
+	with open(mdcrd_file, 'w') as fp:
+		fp.write('test trajectory\n')
+		for xyz in frames:
+			items = ['%8.3f' %v if abs(v) < 1e4 else '*' * 8 for v in np.ravel(xyz)]
+			for i in range(0, len(items), 10):
+				fp.write(''.join(items[i:i + 10]) + '\n')
+			if box is not None:
+				fp.write(''.join('%8.3f' %v for v in box) + '\n')
+
+
+@pytest.mark.parametrize('box', [None, [30.0, 31.0, 32.0]])
+def test_mdcrd_frames(tmp_path, box):
+	mdcrd_file = str(tmp_path / 'mol.mdcrd')
+	n = example()['no_atoms']
+	coordinates = [np.round(np.random.RandomState(i).uniform(-50, 50, (n, 3)), 3) for i in range(3)]
+	write_mdcrd(mdcrd_file, coordinates, box)
+
+	frames = list(mdcrd.frames(mdcrd_file, n))
+	assert len(frames) == 3
+	for expected, frame in zip(coordinates, frames):
+		assert np.allclose(frame['coordinates'], expected, rtol=0, atol=1e-9)
+		assert (frame['box'] is None) if box is None else (frame['box'].tolist() == box)
+
+	assert np.allclose(mdcrd.load(mdcrd_file, n, frame=2)['coordinates'], coordinates[2])
+
+
+def test_mdcrd_overflow(tmp_path, capsys):
+	mdcrd_file = str(tmp_path / 'mol.mdcrd')
+	coordinates = [np.arange(12.0).reshape(4, 3) for i in range(2)]
+	coordinates[0][1, 2] = coordinates[1][3, 0] = 12345.0
+	write_mdcrd(mdcrd_file, coordinates)
+
+	frames = list(mdcrd.frames(mdcrd_file, 4))
+	assert len(frames) == 2
+	assert np.isnan(frames[0]['coordinates'][1, 2]) and np.isnan(frames[1]['coordinates'][3, 0])
+	assert np.isnan(frames[1]['coordinates']).sum() == 1
+
+	out = capsys.readouterr().out
+	assert 'frame 1 ' in out and 'frame 2 ' in out
+
+
+def test_dump_writer(tmp_path):
+	dump_file = str(tmp_path / 'mol.dump')
+	MOL = lammps.build(example())
+	xyz = np.column_stack([MOL['atom_x'], MOL['atom_y'], MOL['atom_z']])
+
+	writer = lammps.DumpWriter(MOL, dump_file)
+	assert writer.frame(xyz)
+	assert writer.frame(xyz + 1.0, box=[40.0, 40.0, 40.0], timestep=100)
+	assert writer.frame(xyz[:-1]) is False
+	writer.write()
+
+	with open(dump_file, 'r') as fp:
+		frames = fp.read().split('ITEM: TIMESTEP\n')[1:]
+	assert len(frames) == 2
+
+	head, atoms = frames[1].split('ITEM: ATOMS id mol type x y z\n')
+	assert head.split('\n')[0] == '100'
+	assert '0.0000 40.0000' in head
+
+	rows = np.array([line.split() for line in atoms.strip().split('\n')], dtype=np.float64)
+	assert rows[:, 0].tolist() == list(range(1, MOL['no_atoms'] + 1))
+	assert np.allclose(rows[:, 3:], xyz + 1.0, atol=5e-4)
+
+
+# restart snapshots
+
+
+def write_restart(rst7, xyz, velocities=None, box=None, time=None):
+	""" Write an ASCII restart of the (N, 3) arrays """
+	with open(rst7, 'w') as fp:
+		fp.write('snapshot\n%6d%s\n' %(len(xyz), '' if time is None else '%15.7e' %time))
+		synthetic.write_fixed(fp, np.ravel(xyz), '%12.7f', 6)
+		if velocities is not None:
+			synthetic.write_fixed(fp, np.ravel(velocities), '%12.7f', 6)
+		if box is not None:
+			synthetic.write_fixed(fp, box, '%12.7f', 6)
+	return rst7
+
+
+def test_snapshots(tmp_path):
+	MOL = lammps.build(parm.read_prmtop(PRMTOP))
+	n = MOL['no_atoms']
+	xyz = np.random.RandomState(0).uniform(0, 30, (3, n, 3)).round(7)
+
+	rst_files = [
+		write_restart(str(tmp_path / '0.rst7'), xyz[0], xyz[0] / 10, [40.0, 41.0, 42.0, 90.0, 90.0, 100.0], 5.0),
+		str(tmp_path / 'missing.rst7'),
+		write_restart(str(tmp_path / '2.rst7'), xyz[2]),
+	]
+
+	results = list(parm.snapshots(MOL, rst_files))
+	assert [r for r, SNAP in results] == rst_files
+	assert results[1][1] is False
+
+	# the same MOL, updated in place, with the topology kept
+	first, last = results[0][1], results[2][1]
+	assert first is MOL and last is MOL
+	assert MOL['_lammps_built'] and MOL['no_bonds'] == example()['no_bonds']
+
+	# nothing left from the first restart
+	assert np.asarray(MOL['atom_z']).tolist() == xyz[2][:, 2].tolist()
+	assert len(MOL.get('atom_vx', [])) == 0 and MOL.get('time') is None
+	assert MOL.get('box_gamma', 90.0) == 90.0
+
+
+def test_overlay_restart(tmp_path):
+	MOL = parm.read_prmtop(PRMTOP)
+	state = parm.restart_state(MOL)
+	n = MOL['no_atoms']
+	xyz = np.random.RandomState(1).uniform(0, 30, (n, 3)).round(7)
+
+	rst7 = write_restart(str(tmp_path / 'mol.rst7'), xyz, xyz / 10, [40.0, 41.0, 42.0], 5.0)
+	SNAP = parm.overlay_restart(MOL, rst7, state)
+	assert np.allclose(SNAP['atom_vy'], xyz[:, 1] / 10, rtol=0, atol=1e-7)
+	assert (SNAP['box_x'], SNAP['time']) == (40.0, 5.0)
+
+	# the same as reading both at once
+	assert_same(parm.read(PRMTOP, rst7), SNAP)
+	assert parm.overlay_restart(MOL, str(tmp_path / 'missing.rst7'), state) is False
+
+
+# binary container
+
+
+def test_binary_round_trip(tmp_path):
+	MOL = example()
+	bin_file = str(tmp_path / 'mol.bin')
+
+	openmol.write_binary(MOL, bin_file)
+	assert plain(openmol.load_binary(bin_file)) == plain(MOL)
+	assert plain(openmol.read_binary_field(bin_file, 'atom_x')) == plain(MOL['atom_x'])
+
+
+# memory usage
+
+
+def test_memory_usage():
+	n = 10000
+	MOL = {
+		'atom_x': openmol.Column(np.float64, np.arange(n, dtype=np.float64)),
+		'atom_y': np.arange(n, dtype=np.float64)[::2],
+		'atom_z': [float(i) for i in range(n)],
+		'atom_resname': ['WAT'] * n,
+		'title': 'memory',
+	}
+	sizes = openmol.memory_usage(MOL)
+
+	assert list(sizes) == sorted(sizes, key=sizes.get, reverse=True)
+	assert sizes['atom_x'] >= 8 * n
+	# a view holds the buffer of its base array
+	assert sizes['atom_y'] >= 8 * n
+	assert sizes['atom_z'] >= sys.getsizeof(MOL['atom_z']) + n * sys.getsizeof(1.0)
+	# the same string in each item is counted once
+	assert sizes['atom_resname'] == sys.getsizeof(MOL['atom_resname']) + sys.getsizeof('WAT')
+
+
+def test_memory_usage_lazy_and_mapped(tmp_path, capsys):
+	MOL = parm.read_prmtop(PRMTOP, lazy=True)
+	assert 'atom_q' not in openmol.memory_usage(MOL)
+	MOL['atom_q']
+	assert 'atom_q' in openmol.memory_usage(MOL)
+
+	# the buffers of a memory mapped binary file are not counted
+	n = 100000
+	bin_file = str(tmp_path / 'mol.bin')
+	openmol.write_binary({'atom_x': openmol.Column(np.float64, np.zeros(n))}, bin_file)
+	assert openmol.memory_usage(openmol.load_binary(bin_file))['atom_x'] < 8 * n
+
+	openmol.print_memory(example(), top=3)
+	out = capsys.readouterr().out.split('\n')
+	assert out[0].startswith('Memory: ') and len([line for line in out[1:] if line]) == 3
+
+
+# JSON files
+
+
+@pytest.mark.parametrize('name', ['mol.json', 'mol.json.gz', 'mol.json.xz'])
+def test_json_round_trip(tmp_path, name):
+	MOL = example()
+	json_file = str(tmp_path / name)
+
+	openmol.write_json(MOL, json_file)
+	assert plain(openmol.load_json(json_file)) == plain(MOL)
+
+	openmol.write_json(MOL, json_file, compress=True)
+	assert plain(openmol.load_json(json_file, columnar=True)) == plain(MOL)
+
+
+# Writer
+
+
+def test_write_rows_lengths(tmp_path):
+	writer = openmol.Writer(example(), str(tmp_path / 'rows.txt'))
+	writer.write_rows('%d %s\n', range(1, 3), ['a', 'b'])
+
+	with pytest.raises(ValueError):
+		writer.write_rows('%d %s\n', range(1, 4), ['a', 'b'])
+
+	writer.write()
+	with open(str(tmp_path / 'rows.txt'), 'r') as fp:
+		assert fp.read() == '1 a\n2 b\n'
+
+
+# batch conversion
+
+
+def snapshot_rst7(rst7, shift):
+	""" Restart of the example with all the atoms moved by shift """
+	MOL = example()
+	for key in ['atom_x', 'atom_y', 'atom_z']:
+		openmol.set_field(MOL, key, np.asarray(MOL[key]) + shift)
+	synthetic.write_rst7(MOL, rst7)
+	return rst7
+
+
+def converted(rst7, data_file):
+	""" The example with a restart, converted directly """
+	lammps.Writer(lammps.build(parm.read(PRMTOP, rst7)), data_file).write()
+	return data_file
+
+
+def test_batch_manifest(tmp_path):
+	manifest = str(tmp_path / 'manifest.txt')
+	with open(manifest, 'w') as fp:
+		fp.write('# prmtop rst7 output [style]\n\n')
+		fp.write('a.prmtop a.rst7 a.data\na.prmtop b.rst7 b.json\n')
+		fp.write('a.prmtop c.rst7 c.mol2\n%s %s c.data qmag\n' %(PRMTOP, RST7))
+
+	jobs = batch.read_manifest(manifest)
+	assert [job['style'] for job in jobs] == ['full', 'json', 'mol2', 'qmag']
+	assert jobs[0]['prmtop'] == str(tmp_path / 'a.prmtop') and jobs[3]['prmtop'] == PRMTOP
+
+	with open(manifest, 'a') as fp:
+		fp.write('a.prmtop d.rst7 d.data charmm\n')
+	assert batch.read_manifest(manifest) is None
+
+
+def test_batch_groups():
+	jobs = [{'prmtop': p, 'style': s} for p, s in [('a', 'full'), ('b', 'full'), ('a', 'full'),
+		('a', 'mol2'), ('a', 'full'), ('a', 'full')]]
+
+	assert sorted(batch.groups(jobs, 1)) == [[0, 2, 4, 5], [1], [3]]
+	assert sorted(batch.groups(jobs, 2)) == [[0, 4], [1], [2, 5], [3]]
+
+
+def test_batch_convert(tmp_path):
+	rst7 = [snapshot_rst7(str(tmp_path / ('%d.rst7' %i)), float(i)) for i in range(2)]
+	rst7.insert(1, str(tmp_path / 'missing.rst7'))
+	jobs = [{'prmtop': PRMTOP, 'rst7': r, 'output': r + '.data', 'style': 'full'} for r in rst7]
+
+	results = batch.convert(jobs)
+	assert [r['ok'] for r in results] == [True, False, True]
+	assert 'missing.rst7' in results[1]['error']
+
+	# the topology is read once for the group, by the first system
+	prmtop_reads = [[e for e in r['stages'] if e['source'] == PRMTOP] for r in results]
+	assert len(prmtop_reads[0]) > 0 and prmtop_reads[1:] == [[], []]
+	assert 'topology' in results[0]['times'] and 'topology' not in results[2]['times']
+
+	# the restarts overlaid on the shared topology, same as converted one by one
+	for r in [rst7[0], rst7[2]]:
+		assert filecmp.cmp(r + '.data', converted(r, r + '.expected'), shallow=False)
+
+
+def test_batch_run(tmp_path, capsys):
+	rst7 = [snapshot_rst7(str(tmp_path / ('%d.rst7' %i)), float(i)) for i in range(3)]
+	jobs = [{'prmtop': PRMTOP, 'rst7': r, 'output': r + '.data', 'style': 'full'} for r in rst7]
+	summary_file = str(tmp_path / 'summary.json')
+
+	summary = batch.run(jobs, 2, summary_file)
+	assert summary['no_systems'] == 3 and summary['no_failed'] == 0
+	assert [r['output'] for r in summary['results']] == [job['output'] for job in jobs]
+	assert summary['hot_spots'] and capsys.readouterr().out.count('OK') >= 3
+
+	with open(summary_file, 'r') as fp:
+		assert json.load(fp)['no_systems'] == 3
+
+	for r in rst7:
+		assert filecmp.cmp(r + '.data', converted(r, r + '.expected'), shallow=False)
+
+
+# LAMMPS data files
+
+
+@pytest.mark.parametrize('module', [lammps, qmag])
+def test_lammps_round_trip(tmp_path, module):
+	first, second = str(tmp_path / 'first.data'), str(tmp_path / 'second.data')
+
+	module.Writer(module.build(example()), first).write()
+	module.Writer(module.read(first), second).write()
+
+	assert filecmp.cmp(first, second, shallow=False)
+
+
+def test_lammps_dihedral_phase(tmp_path):
+	data_file = str(tmp_path / 'mol.data')
+	MOL = example()
+	phase = np.asarray(MOL['FF_dihed_phase'])
+	assert set(np.round(phase, 4).tolist()) == {0.0, 3.1416}
+
+	lammps.Writer(lammps.build(MOL), data_file).write()
+	with open(data_file, 'r') as fp:
+		coeffs = fp.read().split('Dihedral Coeffs')[1].split('Atoms')[0].split('\n')
+	d = [int(line.split()[2]) for line in coeffs if line.strip()]
+
+	# harmonic style, K [1 + d cos(n phi)]
+	assert d == np.where(phase > 1.0, -1, 1).tolist()
+	assert np.allclose(lammps.read(data_file)['FF_dihed_phase'], phase, atol=1e-5)
+
+
+def test_lammps_uneven_records():
+	# 10 + 7 + 13 items add up to 3 records of 10
+	body = '\n'.join(['1 1 1 0.5 1.0 2.0 3.0 0 0 0', '2 1 1 0.5 4.0 5.0 6.0',
+		'3 1 1 0.5 7.0 8.0 9.0 0 0 0 1 1 1'])
+
+	cols, comments = lammps.split_records(body, 7)
+	assert cols[4] == ['1.0', '4.0', '7.0']
+	assert cols[6] == ['3.0', '6.0', '9.0']
+
+
+def test_lammps_residue_index(tmp_path):
+	data_file = str(tmp_path / 'mol.data')
+	lammps.Writer(lammps.build(example()), data_file).write()
+
+	# molecule ids 7, 3 and 7 again, in three blocks of atoms
+	with open(data_file, 'r') as fp:
+		head, rest = fp.read().split('Atoms # atom_style_full\n')
+	atoms, tail = rest.split('Bonds')
+	lines = [line.split() for line in atoms.strip().split('\n')]
+	ids = np.repeat([7, 3, 7], [10, 10, len(lines) - 20])
+	for items, mol in zip(lines, ids):
+		items[1] = str(mol)
+	with open(data_file, 'w') as fp:
+		fp.write(head + 'Atoms # atom_style_full\n\n')
+		fp.write('\n'.join(' '.join(items) for items in lines))
+		fp.write('\n\nBonds' + tail)
+
+	MOL = lammps.read(data_file)
+	assert MOL['no_residues'] == 3
+	assert np.asarray(MOL['residue_start']).tolist() == [0, 10, 20]
+	assert np.asarray(MOL['atom_resid']).tolist() == np.repeat([0, 1, 2], [10, 10, len(lines) - 20]).tolist()
+
+
+def test_lammps_box_origin(tmp_path):
+	first, second = str(tmp_path / 'first.data'), str(tmp_path / 'second.data')
+
+	MOL = lammps.build(example())
+	lammps.Writer(MOL, first).write()
+
+	with open(first, 'r') as fp:
+		text = fp.read()
+	text = text.replace('  0.0000  32.6092 xlo xhi', ' -5.0000   5.0000 xlo xhi')
+	with open(first, 'w') as fp:
+		fp.write(text)
+
+	MOL = lammps.read(first)
+	assert (MOL['box_x'], MOL['box_y']) == (10.0, 21.4578)
+	assert MOL['box_origin'] == [-5.0, 0.0, 0.0]
+
+	lammps.Writer(MOL, second).write()
+	assert filecmp.cmp(first, second, shallow=False)
+
+
+def test_lammps_estimated_box(tmp_path):
+	first, second = str(tmp_path / 'first.data'), str(tmp_path / 'second.data')
+
+	MOL = lammps.build(example())
+	MOL['box_x'] = MOL['box_y'] = MOL['box_z'] = 0.0
+	lammps.Writer(MOL, first).write()
+
+	MOL = lammps.read(first)
+	assert MOL['box_x'] == pytest.approx(max(MOL['atom_x']) - min(MOL['atom_x']) + 2 * lammps.BOX_BUFFER, abs=1e-3)
+
+	lammps.Writer(MOL, second).write()
+	assert filecmp.cmp(first, second, shallow=False)
+
+
+# angles and dihedrals
+
+
+def test_topology_build_stage():
+	MOL = example()
+
+	with openmol.record_stages() as events:
+		built = topology.build(MOL, overwrite=True)
+
+	assert built['no_angles'] == MOL['no_angles']
+	# the multi term dihedrals of the PRMTOP are listed once per term
+	assert built['no_diheds'] == len(set(zip(MOL['dihed_a'], MOL['dihed_b'], MOL['dihed_c'], MOL['dihed_d'])))
+	assert [(e['kind'], e['stage']) for e in events] == [('build', 'topology')]
+
+
+# MOL2 files
+
+
+@pytest.mark.parametrize('lengths', [[6, 7, 8], [9, 10], [10]])
+def test_mol2_optional_columns(tmp_path, lengths):
+	mol2_file = str(tmp_path / 'uneven.mol2')
+
+	# atoms and bonds of different no. of items, longer than a bulk
+	# block so the sections are split in bulk
+	atoms = []
+	for i in range(400):
+		items = ['%d' %(i + 1), 'C%d' %i, '%.4f' %(0.5 * i), '%.4f' %-i, '1.0e+01', 'c3',
+			'%d' %(i // 10 + 1), 'RES', '%.6f' %(0.001 * i), 'DICT']
+		atoms.append(' '.join(items[:lengths[i % len(lengths)]]))
+	bonds = ['%d %d %d 1%s' %(i + 1, i + 1, i + 2, ' BACKBONE' * (i % 2)) for i in range(399)]
+
+	with open(mol2_file, 'w') as fp:
+		fp.write('@<TRIPOS>MOLECULE\nuneven\n 400 399 0\nSMALL\nUSER_CHARGES\n\n')
+		fp.write('@<TRIPOS>ATOM\n' + '\n'.join(atoms) + '\n')
+		fp.write('@<TRIPOS>BOND\n' + '\n'.join(bonds) + '\n')
+
+	MOL = mol2.read(mol2_file)
+
+	# parsed line by line, the optional items only from the lines having them
+	records = [line.split() for line in atoms]
+	assert plain(MOL['atom_x']) == [float(r[2]) for r in records]
+	assert plain(MOL['atom_z']) == [float(r[4]) for r in records]
+	assert plain(MOL['atom_resid']) == [int(r[6]) - 1 for r in records if len(r) > 6]
+	assert plain(MOL['atom_resname']) == [r[7] for r in records if len(r) > 7]
+	assert plain(MOL['atom_q']) == [float(r[8]) for r in records if len(r) > 8]
+	assert plain(MOL['atom_status_bit']) == [r[9] for r in records if len(r) > 9]
+
+	records = [line.split() for line in bonds]
+	assert plain(MOL['bond_from']) == [int(r[1]) - 1 for r in records]
+	assert plain(MOL['bond_to']) == [int(r[2]) - 1 for r in records]
+	assert plain(MOL['bond_status_bit']) == [r[4] for r in records if len(r) > 4]
+
+
+# MOL2 libraries
+
+
+def mol2_library(library, titles):
+	""" Write a MOL2 file of copies of the example, one per title """
+	mol2.Writer(mol2.build(example()), library).write()
+	with open(library, 'r') as fp:
+		text = fp.read()
+
+	first = text.split('\n')[1]
+	with open(library, 'w') as fp:
+		for title in titles:
+			fp.write(text.replace(first, title, 1))
+	return library
+
+
+def test_mol2_molecules(tmp_path):
+	library = mol2_library(str(tmp_path / 'library.mol2'), ['first', 'second', 'third'])
+
+	# an atom line without its coordinates in the second molecule
+	with open(library, 'r') as fp:
+		text = fp.read().split('@<TRIPOS>ATOM\n')
+	text[2] = 'broken\n' + text[2]
+	with open(library, 'w') as fp:
+		fp.write('@<TRIPOS>ATOM\n'.join(text))
+
+	molecules = list(mol2.molecules(library))
+	assert len(molecules) == 3 and molecules[1] is None
+	assert [MOL['title'] for MOL in molecules[::2]] == ['first', 'third']
+	assert plain(molecules[2]['atom_x']) == plain(mol2.read_entry(library, 2)['atom_x'])
+
+
+def test_mol2_read_entry(tmp_path):
+	titles = ['first', 'second', 'third', 'second']
+	library = mol2_library(str(tmp_path / 'library.mol2'), titles)
+	index_file = str(tmp_path / 'library.mol2.idx')
+
+	index = mol2.index_mol2(library, index_file)
+	assert index['titles'] == titles
+	assert index['entries'] == {'first': 0, 'second': 1, 'third': 2}
+
+	assert mol2.read_entry(library, 2, index=index)['title'] == 'third'
+	assert mol2.read_entry(library, -1, index=index)['title'] == 'second'
+	assert mol2.read_entry(library, 'third', index_file=index_file)['title'] == 'third'
+	assert mol2.read_entry(library, 'fourth', index=index) is None
+	assert mol2.read_entry(library, 4, index=index) is None
+
+	# an index saved without the entries
+	del index['entries']
+	assert mol2.read_entry(library, 'second', index=index)['no_atoms'] == example()['no_atoms']
+	assert index['entries']['second'] == 1
+
+
+def test_mol2_stale_index(tmp_path, capsys):
+	library = mol2_library(str(tmp_path / 'library.mol2'), ['first', 'second'])
+	index_file = str(tmp_path / 'library.mol2.idx')
+	index = mol2.index_mol2(library, index_file)
+
+	# a molecule added after indexing
+	mol2_library(library, ['first', 'second', 'third'])
+
+	assert mol2.read_entry(library, 'third', index=index) is None
+	assert 'stale index' in capsys.readouterr().out
+
+	# a saved index is rebuilt instead
+	assert mol2.read_entry(library, 'third', index_file=index_file)['title'] == 'third'
+	assert 'stale index' in capsys.readouterr().out
+
+
+# bonds from coordinates
+
+
+@pytest.mark.parametrize('perceive', [False, True])
+def test_mol2_perceive_bonds(tmp_path, perceive):
+	mol2_file = str(tmp_path / 'mol.mol2')
+	MOL = mol2.build(example())
+	mol2.Writer(MOL, mol2_file).write()
+
+	# drop the BOND section
+	with open(mol2_file, 'r') as fp:
+		head, rest = fp.read().split('@<TRIPOS>BOND\n')
+	with open(mol2_file, 'w') as fp:
+		fp.write(head + '@<TRIPOS>' + rest.split('@<TRIPOS>', 1)[1])
+
+	built = mol2.build(mol2.read(mol2_file), perceive=perceive)
+	bonds = sorted(zip(built['bond_from'], built['bond_to']))
+
+	if perceive:
+		assert bonds == sorted(zip(MOL['bond_from'], MOL['bond_to']))
+	else:
+		assert bonds == []
+
+
+# spatial index
+
+
+def test_index_warns_once(capsys):
+	MOL = example()
+	MOL['box_gamma'] = 100.0
+
+	first = neighbors.index(MOL)
+	assert neighbors.index(MOL) is first
+	neighbors.nearest(MOL, [[0.0, 0.0, 0.0]])
+
+	assert capsys.readouterr().out.count('only orthorhombic boxes') == 1
+
+
+def test_index_in_place_edit():
+	MOL = example()
+	first = neighbors.index(MOL)
+
+	# moved in place, the fields are the same objects
+	MOL['atom_x'][0] += 100.0
+	second = neighbors.index(MOL)
+	assert second is not first
+	assert neighbors.index(MOL) is second
+
+	atoms, distances = neighbors.nearest(MOL, [[MOL['atom_x'][0], MOL['atom_y'][0], MOL['atom_z'][0]]])
+	assert atoms[0, 0] == 0 and distances[0, 0] == 0.0
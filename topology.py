@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+""" Bonded topology of an OpenMOL object.
+
+	The bonds are stored as a compressed sparse row (CSR) adjacency,
+	the neighbors of atom i are indices[indptr[i]:indptr[i+1]]. All the
+	angles and proper dihedrals are enumerated from it with array
+	operations, in time linear in the no. of bonds and generated terms.
+
+	Missing bonds can be perceived from the coordinates and the covalent
+	radii of the elements, using a cell list of the atoms.
+
+	This file is a part of OpenMOL python module.
+	License GPLv3.0 Copyright (c) 2019 Akhlak Mahmood """
+
+__author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
+
+import numpy as np
+
+import openmol
+import neighbors
+
+# covalent radii in angstrom, Cordero et al. Dalton Trans. 2008, 2832
+covalent_radii = {
+	'H': 0.31, 'He': 0.28, 'Li': 1.28, 'Be': 0.96, 'B': 0.84, 'C': 0.76,
+	'N': 0.71, 'O': 0.66, 'F': 0.57, 'Ne': 0.58, 'Na': 1.66, 'Mg': 1.41,
+	'Al': 1.21, 'Si': 1.11, 'P': 1.07, 'S': 1.05, 'Cl': 1.02, 'Ar': 1.06,
+	'K': 2.03, 'Ca': 1.76, 'Sc': 1.70, 'Ti': 1.60, 'V': 1.53, 'Cr': 1.39,
+	'Mn': 1.39, 'Fe': 1.32, 'Co': 1.26, 'Ni': 1.24, 'Cu': 1.32, 'Zn': 1.22,
+	'Ga': 1.22, 'Ge': 1.20, 'As': 1.19, 'Se': 1.20, 'Br': 1.20, 'Kr': 1.16,
+	'Rb': 2.20, 'Sr': 1.95, 'Y': 1.90, 'Zr': 1.75, 'Nb': 1.64, 'Mo': 1.54,
+	'Tc': 1.47, 'Ru': 1.46, 'Rh': 1.42, 'Pd': 1.39, 'Ag': 1.45, 'Cd': 1.44,
+	'In': 1.42, 'Sn': 1.39, 'Sb': 1.39, 'Te': 1.38, 'I': 1.39, 'Xe': 1.40,
+	'Cs': 2.44, 'Ba': 2.15, 'La': 2.07, 'Ce': 2.04, 'Pr': 2.03, 'Nd': 2.01,
+	'Pm': 1.99, 'Sm': 1.98, 'Eu': 1.98, 'Gd': 1.96, 'Tb': 1.94, 'Dy': 1.92,
+	'Ho': 1.92, 'Er': 1.89, 'Tm': 1.90, 'Yb': 1.87, 'Lu': 1.87, 'Hf': 1.75,
+	'Ta': 1.70, 'W': 1.62, 'Re': 1.51, 'Os': 1.44, 'Ir': 1.41, 'Pt': 1.36,
+	'Au': 1.36, 'Hg': 1.32, 'Tl': 1.45, 'Pb': 1.46, 'Bi': 1.48,
+}
+
+# element symbols by atomic no.
+elements = list(covalent_radii)
+
+# closer atoms are overlapping copies, not bonded
+MIN_BOND_LENGTH = 0.4
+
+
+def unique_bonds(bond_from, bond_to):
+	""" Bond pairs as (N, 2) array of the lower index first, without
+		duplicates and self bonds. """
+
+	pairs = np.column_stack([np.asarray(bond_from, dtype=np.int64), np.asarray(bond_to, dtype=np.int64)])
+	pairs = np.sort(pairs, axis=1)
+	pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+	if len(pairs) == 0:
+		return pairs.reshape(0, 2)
+
+	# a single integer key per pair sorts much faster than rows
+	size = pairs.max() + 1
+	keys = np.sort(pairs[:, 0] * size + pairs[:, 1])
+	keys = keys[np.append(True, keys[1:] != keys[:-1])]
+	return np.column_stack([keys // size, keys % size])
+
+
+def adjacency(pairs, no_atoms):
+	""" CSR adjacency (indptr, indices) of the bond pairs """
+
+	source = np.concatenate([pairs[:, 0], pairs[:, 1]])
+	target = np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+	order = np.argsort(source, kind='stable')
+	degree = np.bincount(source, minlength=no_atoms)
+
+	indptr = np.zeros(no_atoms + 1, dtype=np.int64)
+	np.cumsum(degree, out=indptr[1:])
+
+	return indptr, target[order]
+
+
+def angles(indptr, indices):
+	""" All the angles a-b-c, a < c in the neighbor order of b,
+		as three arrays. """
+
+	# each neighbor slot p pairs with the slots after it of the same atom
+	centers = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+	slots = np.arange(len(indices))
+	after = indptr[centers + 1] - slots - 1
+
+	p, q = neighbors.expand(slots + 1, after)
+	return indices[p], centers[p], indices[q]
+
+
+def dihedrals(pairs, indptr, indices):
+	""" All the proper dihedrals a-b-c-d around each bond b-c,
+		as four arrays. Three membered rings are left out. """
+
+	b, c = pairs[:, 0], pairs[:, 1]
+
+	# neighbors a of b, except c
+	bond, slot = neighbors.expand(indptr[b], indptr[b + 1] - indptr[b])
+	a = indices[slot]
+	keep = a != c[bond]
+	bond, a = bond[keep], a[keep]
+
+	# neighbors d of c, except b and a
+	cb = c[bond]
+	group, slot = neighbors.expand(indptr[cb], indptr[cb + 1] - indptr[cb])
+	bond, a, d = bond[group], a[group], indices[slot]
+	keep = (d != b[bond]) & (d != a)
+
+	return a[keep], b[bond[keep]], c[bond[keep]], d[keep]
+
+
+def type_codes(atom_types):
+	""" Integer code of each atom type, and the type of each code """
+	names = list(dict.fromkeys(atom_types))
+	lookup = dict(zip(names, range(len(names))))
+	codes = np.fromiter(map(lookup.__getitem__, atom_types), dtype=np.int64, count=len(atom_types))
+	return codes, names
+
+
+def term_types(codes, names, columns, symmetric):
+	""" Index of each term in the list of the unique combinations of
+		the type codes of its atoms, and the names of those as 'a-b-c'.
+		If symmetric, a term and its reverse have the same type. """
+
+	keys = np.column_stack([codes[col] for col in columns])
+
+	if symmetric and len(keys):
+		reverse = keys[:, ::-1]
+		# use the smaller of the forward and reverse type sequences
+		flip = np.zeros(len(keys), dtype=bool)
+		undecided = np.ones(len(keys), dtype=bool)
+		for j in range(keys.shape[1]):
+			flip |= undecided & (reverse[:, j] < keys[:, j])
+			undecided &= reverse[:, j] == keys[:, j]
+		keys = np.where(flip[:, None], reverse, keys)
+
+	if len(keys) == 0:
+		return np.zeros(0, dtype=np.int64), []
+
+	base = len(names)
+
+	if base ** keys.shape[1] < 2**62:
+		# combine the type codes of a term into a single integer key
+		combined = np.zeros(len(keys), dtype=np.int64)
+		for j in range(keys.shape[1]):
+			combined = combined * base + keys[:, j]
+
+		combined, index = np.unique(combined, return_inverse=True)
+
+		unique = np.empty((len(combined), keys.shape[1]), dtype=np.int64)
+		for j in range(keys.shape[1] - 1, -1, -1):
+			combined, unique[:, j] = np.divmod(combined, base)
+	else:
+		unique, index = np.unique(keys, axis=0, return_inverse=True)
+
+	labels = ['-'.join(names[k] for k in row) for row in unique.tolist()]
+	return index.ravel(), labels
+
+
+def build(MOL, overwrite=False):
+	""" Generate the angles and the proper dihedrals of MOL from its
+		bonds, if there are none or overwrite is True.
+
+		The terms are typed by the atom types of their atoms, named as
+		a-b-c in unique_angle_types and unique_dihed_types. The force
+		field coefficients of the new types are set to 0.0 and have to
+		be set before a simulation. """
+
+	MOL = openmol.AttrDict(dict(openmol.initialize(), **MOL))
+	stage = openmol.Stage('build', 'topology')
+
+	n = MOL['no_atoms']
+
+	if len(MOL['bond_from']) != len(MOL['bond_to']):
+		print('-- Error: bond_from and bond_to length mismatch.')
+		return False
+
+	pairs = unique_bonds(MOL['bond_from'], MOL['bond_to'])
+
+	if len(pairs) and (pairs.min() < 0 or pairs.max() >= n):
+		print('-- Error: bond atom index out of range of %d atoms.' %n)
+		return False
+
+	indptr, indices = adjacency(pairs, n)
+	types = MOL['atom_type'] if len(MOL['atom_type']) == n else ['X'] * n
+	codes, names = type_codes(types)
+
+	if overwrite or not MOL['no_angles']:
+		a, b, c = angles(indptr, indices)
+		index, labels = term_types(codes, names, [a, b, c], True)
+
+		if len(MOL['FF_angle_k']):
+			print('-- Warning: angle force field replaced by %d new types.' %len(labels))
+
+		for key, values in [('angle_a', a), ('angle_b', b), ('angle_c', c), ('angle_ff_index', index)]:
+			openmol.set_field(MOL, key, values)
+
+		openmol.set_field(MOL, 'FF_angle_k', np.zeros(len(labels)))
+		openmol.set_field(MOL, 'FF_angle_eq', np.zeros(len(labels)))
+		MOL['unique_angle_types'] = labels
+		MOL['no_angles'] = len(a)
+
+	if overwrite or not MOL['no_diheds']:
+		a, b, c, d = dihedrals(pairs, indptr, indices)
+		index, labels = term_types(codes, names, [a, b, c, d], True)
+
+		if len(MOL['FF_dihed_k']):
+			print('-- Warning: dihedral force field replaced by %d new types.' %len(labels))
+
+		for key, values in [('dihed_a', a), ('dihed_b', b), ('dihed_c', c), ('dihed_d', d), ('dihed_ff_index', index)]:
+			openmol.set_field(MOL, key, values)
+
+		openmol.set_field(MOL, 'FF_dihed_k', np.zeros(len(labels)))
+		openmol.set_field(MOL, 'FF_dihed_phase', np.zeros(len(labels)))
+		openmol.set_field(MOL, 'FF_dihed_periodicity', np.zeros(len(labels)))
+		MOL['unique_dihed_types'] = labels
+		MOL['no_diheds'] = len(a)
+
+	stage.done(n)
+	return MOL
+
+
+def element_of(name):
+	""" Element symbol of an atom name or a SYBYL atom type, e.g.
+		CA is a carbon, Cl1 or CL1 a chlorine and C.ar a carbon.
+		None if not known. """
+
+	name = name.split('.')[0].lstrip('0123456789')
+	letters = ''
+	for c in name:
+		if not c.isalpha():
+			break
+		letters += c
+
+	if len(letters) > 1:
+		# two letter names written in capitals are ambiguous, CA is a
+		# C alpha, only the halogens are taken
+		two = letters[0].upper() + letters[1].lower()
+		if (letters[1].islower() or two in ('Cl', 'Br')) and two in covalent_radii:
+			return two
+
+	one = letters[:1].upper()
+	return one if one in covalent_radii else None
+
+
+def atom_radii(MOL):
+	""" Covalent radius of each atom of MOL, nan if not known. From the
+		atomic numbers if set, the atom names otherwise. """
+
+	n = MOL['no_atoms']
+
+	numbers = np.asarray(MOL['atom_atomic_no'], dtype=np.int64)
+	if len(numbers) == n and n and numbers.min() > 0:
+		table = np.array([np.nan] + [covalent_radii[e] for e in elements] + [np.nan])
+		return table[np.minimum(numbers, len(table) - 1)]
+
+	# SYBYL types name the element, e.g. C.3, unlike the force field types
+	names = MOL['atom_name']
+	if len(MOL['atom_type']) == n and any('.' in str(t) for t in MOL['atom_type']):
+		names = MOL['atom_type']
+
+	# one lookup per distinct name
+	lookup = {}
+	for name in dict.fromkeys(names):
+		symbol = element_of(str(name))
+		lookup[name] = covalent_radii[symbol] if symbol else np.nan
+
+	return np.fromiter(map(lookup.__getitem__, names), dtype=np.float64, count=n)
+
+
+def single_atom_residues(MOL):
+	""" Mask of the atoms that are a residue by themselves, e.g. the ions """
+
+	n = MOL['no_atoms']
+	mask = np.zeros(n, dtype=bool)
+
+	starts = np.asarray(MOL['residue_start'], dtype=np.int64)
+	if len(starts) == 0:
+		return mask
+
+	sizes = np.diff(np.append(starts, n))
+	mask[starts[sizes == 1]] = True
+	return mask
+
+
+def perceive_bonds(MOL, tolerance=0.45, overwrite=False):
+	""" Find the bonds of MOL from its coordinates, if there are none
+		or overwrite is True. Atoms i and j are bonded if they are not
+		farther than the sum of their covalent radii plus tolerance.
+		The box lengths, if set, are periodic. Atoms of unknown element
+		and single atom residues (ions) are not bonded. All the bonds
+		are typed as single, "1". """
+
+	MOL = openmol.AttrDict(dict(openmol.initialize(), **MOL))
+
+	n = MOL['no_atoms']
+
+	if len(MOL['bond_from']) and not overwrite:
+		print('-- Warning: MOL already has %d bonds, not perceived.' %len(MOL['bond_from']))
+		return MOL
+
+	if any(len(MOL[k]) != n for k in ['atom_x', 'atom_y', 'atom_z']):
+		print('-- Error: coordinates of %d atoms required to perceive bonds.' %n)
+		return False
+
+	stage = openmol.Stage('build', 'bonds')
+
+	radii = atom_radii(MOL)
+	unknown = np.isnan(radii)
+	if unknown.any():
+		names = sorted(set(str(MOL['atom_name'][i]) for i in np.flatnonzero(unknown)[:100]))
+		print('-- Warning: element of %d atoms not known, not bonded: %s' %(unknown.sum(), ' '.join(names)))
+
+	radii[single_atom_residues(MOL)] = np.nan
+	known = np.flatnonzero(~np.isnan(radii))
+
+	i = j = np.zeros(0, dtype=np.int64)
+
+	if len(known) > 1:
+		cutoff = 2 * radii[known].max() + tolerance
+		cells = neighbors.CellList(neighbors.coordinates(MOL)[known], cutoff, neighbors.box_of(MOL))
+		i, j, d = cells.pairs(cutoff)
+
+		i, j = known[i], known[j]
+		keep = (d <= radii[i] + radii[j] + tolerance) & (d > MIN_BOND_LENGTH)
+		i, j = i[keep], j[keep]
+
+	openmol.set_field(MOL, 'bond_from', i)
+	openmol.set_field(MOL, 'bond_to', j)
+	MOL['bond_type'] = ['1'] * len(i)
+	MOL['no_bonds'] = len(i)
+
+	# per bond items of the old bonds
+	for key in ['bond_ff_index', 'bond_status_bit']:
+		if key in MOL:
+			MOL[key] = []
+
+	stage.done(len(i))
+	openmol.info('Perceived %d bonds.' %len(i))
+	return MOL
@@ -7,8 +7,30 @@
 
 __author__ 	= "Akhlak Mahmood, Yingling Group, MSE, NCSU"
 
+import io
+import mmap
+
+import numpy as np
 
 import openmol
+import topology
+
+# no. of characters read at once
+read_chunk = 1 << 20
+
+# smaller section blocks are counted line by line
+bulk_size = 4096
+
+# lookup table of the ascii characters that str.split() treats as whitespace
+split_whitespace = np.zeros(256, dtype=bool)
+split_whitespace[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = True
+
+# a field of each section, its length is the no. of records read
+section_fields = {
+	'ATOM': 'atom_name',
+	'BOND': 'bond_from',
+	'SUBSTRUCTURE': 'residue_name',
+}
 
 def initialize():
 	""" Initialize an openmol object with TRIPOS MOL2
@@ -49,19 +71,262 @@ def check_last_section(section, MOL):
 			# @todo: do this check here
 			return False
 
-	print('OK.')
+	openmol.info('OK.')
 	return True
 
 
-def read(mol2_file):
-	""" Read a TRIPOS MOL2 file and store as OpenMOL object.
-		All indices are decremented to use 0 base indexing. """
+class LineReader(object):
+	""" Read the lines of a MOL2 file from large chunks. The lines
+		of a whole section can be taken at once with block(). """
+
+	def __init__(self, fp):
+		self.fp = fp
+		self.buf = ''
+		self.pos = 0
+		self.line_no = 0		# no. of lines read so far
+
+	def fill(self):
+		data = self.fp.read(read_chunk)
+		if not data:
+			return False
+
+		self.buf = self.buf[self.pos:] + data
+		self.pos = 0
+		return True
+
+	def readline(self):
+		""" Next line including the newline, None at the end of file. """
+		while True:
+			end = self.buf.find('\n', self.pos)
+			if end >= 0:
+				line = self.buf[self.pos:end + 1]
+				self.pos = end + 1
+				self.line_no += 1
+				return line
+
+			if not self.fill():
+				if self.pos < len(self.buf):
+					line = self.buf[self.pos:]
+					self.pos = len(self.buf)
+					self.line_no += 1
+					return line
+				return None
+
+	def unread(self, line):
+		""" Push back the line last returned by readline(). """
+		self.pos -= len(line)
+		self.line_no -= 1
+
+	def at_end(self):
+		return self.pos >= len(self.buf) and not self.fill()
+
+	def find_header(self):
+		""" Start of the next section definition line in the buffer,
+			-1 if there is none. """
+		at = self.pos
+
+		while True:
+			at = self.buf.find('@<', at)
+			if at < 0:
+				return -1
+
+			# only whitespace allowed before it on the line
+			start = self.buf.rfind('\n', self.pos, at) + 1 or self.pos
+			if start == at or self.buf[start:at].isspace():
+				return start
+
+			at += 2
+
+	def block(self):
+		""" Text of the lines up to the next section definition
+			or the end of file. """
+		parts = []
+
+		while True:
+			start = self.find_header()
+			if start >= 0:
+				parts.append(self.buf[self.pos:start])
+				self.pos = start
+				break
+
+			# keep an incomplete last line for the next search
+			end = self.buf.rfind('\n', self.pos) + 1
+			if end > self.pos:
+				parts.append(self.buf[self.pos:end])
+				self.pos = end
+
+			if not self.fill():
+				parts.append(self.buf[self.pos:])
+				self.pos = len(self.buf)
+				break
+
+		text = ''.join(parts)
+		self.line_no += count_lines(text)
+		return text
+
+
+def count_lines(text):
+	""" No. of lines of a block text. """
+	return text.count('\n') + (len(text) > 0 and text[-1] != '\n')
+
+
+def item_counts(text):
+	""" Count the whitespace separated items of each line of an
+		ascii text without splitting the lines. Returns the counts
+		and whether each line is a comment. """
+
+	data = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+	space = split_whitespace[data]
+
+	# an item starts at a non space after a space or at the start
+	starts = ~space
+	starts[1:] &= space[:-1]
+	starts = np.flatnonzero(starts)
+
+	# index of the first item of each line
+	ends = np.flatnonzero(data == ord('\n'))
+	bounds = np.concatenate(([0], np.searchsorted(starts, ends), [len(starts)]))
+	counts = np.diff(bounds)
+
+	comment = np.zeros(len(counts), dtype=bool)
+	filled = np.flatnonzero(counts)
+	comment[filled] = data[starts[bounds[filled]]] == ord('#')
+
+	return counts, comment
+
+
+def section_records(MOL, text, line_no, required):
+	""" Find the records, i.e. the non blank and non comment lines,
+		of a section block text. line_no is the file line number of
+		the first line of the block. Comments are added to the
+		description. Returns the text of the records and the no. of
+		items of each, None if a record has too few items. """
+
+	lines = None
+
+	if len(text) >= bulk_size and text.isascii():
+		counts, comment = item_counts(text)
+	else:
+		lines = text.split('\n')
+		counts = np.array([len(line.split()) for line in lines], dtype=np.int64)
+		comment = np.array([line.strip().startswith('#') for line in lines], dtype=bool)
+
+	offsets = np.flatnonzero((counts > 0) & ~comment)
+	counts = counts[offsets]
+
+	short = np.flatnonzero(counts < required)
+	if len(short):
+		k = offsets[short[0]]
+		line = text.split('\n')[k].strip()
+		print('-- Error: Invalid MOL2 [line %d]:\n%s' %(line_no + k, line))
+		return None
+
+	if comment.any():
+		if lines is None:
+			lines = text.split('\n')
+
+		for k in np.flatnonzero(comment):
+			MOL['description'] += "%s\n" %lines[k].strip()
+
+		text = '\n'.join([lines[k] for k in offsets])
+
+	return text, counts
+
+
+def columns(text, counts, size, required):
+	""" Transpose the first size items of the records into columns.
+		A column beyond the required ones only holds the items of
+		the records long enough to have it, same as the line by line
+		parsing. """
+
+	if len(counts) and counts.min() == counts.max():
+		# all the records have the same no. of items, split at once
+		length = int(counts[0])
+		items = text.split()
+		cols = [items[j::length] for j in range(min(length, size))]
+		return cols + [()] * (size - len(cols))
+
+	records = [r for r in map(str.split, text.split('\n')) if r]
+	cols = list(zip(*[r[:required] for r in records])) if records else [()] * required
+	for j in range(required, size):
+		cols.append([r[j] for r in records if len(r) > j])
+
+	return cols
+
+
+def read_atoms(MOL, block, line_no):
+	""" Parse the whole text block of an ATOM section at once into
+		the MOL fields, line_no is the file line number of its first
+		line. The optional items are only added for the lines
+		that have them, same as reading line by line. """
+
+	records = section_records(MOL, block, line_no, 6)
+	if records is None:
+		return False
+
+	cols = columns(*records, 10, 6)
+
+	# mandatory items, the numbers converted a column at a time
+	MOL['atom_name'].extend(cols[1])
+	openmol.extend_field(MOL, 'atom_x', np.array(cols[2], dtype=np.float64))
+	openmol.extend_field(MOL, 'atom_y', np.array(cols[3], dtype=np.float64))
+	openmol.extend_field(MOL, 'atom_z', np.array(cols[4], dtype=np.float64))
+	MOL['atom_type'].extend(cols[5])
+
+	# optional items
+	openmol.extend_field(MOL, 'atom_resid', np.array(cols[6], dtype=np.int64) - 1)
+	MOL['atom_resname'].extend(cols[7])
+	openmol.extend_field(MOL, 'atom_q', np.array(cols[8], dtype=np.float64))
+	MOL['atom_status_bit'].extend(cols[9])
+
+	return True
+
+
+def read_bonds(MOL, block, line_no):
+	""" Parse all the lines of a BOND section at once, see read_atoms(). """
+
+	records = section_records(MOL, block, line_no, 4)
+	if records is None:
+		return False
+
+	cols = columns(*records, 5, 4)
+
+	openmol.extend_field(MOL, 'bond_from', np.array(cols[1], dtype=np.int64) - 1)
+	openmol.extend_field(MOL, 'bond_to', np.array(cols[2], dtype=np.int64) - 1)
+	MOL['bond_type'].extend(cols[3])
+	if len(cols[4]):
+		MOL.setdefault('bond_status_bit', []).extend(cols[4])
+
+	return True
+
+
+# sections parsed as a whole block
+block_readers = {
+	'ATOM': read_atoms,
+	'BOND': read_bonds,
+}
+
+
+def section_name(line):
+	""" Name of the section defined by a stripped @<TRIPOS> line,
+		None if it is not a valid section definition. """
+	parts = line.split('>')
+	if len(parts) < 2:
+		return None
+	return parts[1]
+
+
+def read_molecule(lines, split=False):
+	""" Read the sections from a LineReader into an OpenMOL object.
+		If split is True, stop before the next MOLECULE section,
+		otherwise read till the end of file. """
 
 	MOL = initialize()
 
-	line_no = 0
 	section_line_no = 0
 	section = None
+	stage = None				# timing of current section
+	source = getattr(lines.fp, 'name', None)
 
 	# variables for sanity checking
 	type_ok = False
@@ -69,13 +334,14 @@ def read(mol2_file):
 	name_ok = False
 	summary_ok = False
 
+	while True:
+		raw = lines.readline()
+		if raw is None:
+			break
 
-	for line in open(mol2_file, 'r'):
-
-		line_no += 1
 		section_line_no += 1
 
-		line = line.strip()
+		line = raw.strip()
 
 		if len(line) == 0:
 			continue
@@ -87,18 +353,36 @@ def read(mol2_file):
 
 		# new section definition
 		if line.startswith('@<'):
-			parts = line.split('>')
+			name = section_name(line)
 
-			if len(parts) < 2:
-				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(line_no, line))
+			if name is None:
+				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(lines.line_no, line))
 				return None
 			else:
+				if split and name == 'MOLECULE' and section is not None:
+					# next molecule begins
+					lines.unread(raw)
+					break
+
 				if not check_last_section(section, MOL):
 					return False
 
-				section = parts[1]
-				print('Reading %s ...' %section, end=' ')
+				if stage is not None:
+					stage.done(len(MOL[section_fields[section]]) if section in section_fields else 0)
+
+				section = name
+				stage = openmol.Stage('read', section, source)
+				openmol.info('Reading %s ...' %section, end=' ')
 				section_line_no = 0
+
+				if section in block_readers:
+					first_line = lines.line_no + 1
+					block = lines.block()
+					stage.bytes = len(block)
+
+					if not block_readers[section](MOL, block, first_line):
+						return None
+
 				continue
 
 		# handle sections
@@ -140,53 +424,11 @@ def read(mol2_file):
 			elif section_line_no == 6:
 				MOL['mol2_comment'] = line
 
-		elif section == 'ATOM':
-			parts = line.split()
-
-			if len(parts) < 6:
-				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(line_no, line))
-				return None
-
-			# mandatory items
-			MOL['atom_name'].append(parts[1])
-			MOL['atom_x'].append(float(parts[2]))
-			MOL['atom_y'].append(float(parts[3]))
-			MOL['atom_z'].append(float(parts[4]))
-			MOL['atom_type'].append(parts[5])
-
-			# optional items
-			if len(parts) > 6:
-				MOL['atom_resid'].append(int(parts[6]) - 1)
-
-			if len(parts) > 7:
-				MOL['atom_resname'].append(parts[7])
-
-			if len(parts) > 8:
-				MOL['atom_q'].append(float(parts[8]))
-
-			if len(parts) > 9:
-				MOL['atom_status_bit'].append(parts[9])
-
-
-		elif section == 'BOND':
-			parts = line.split()
-
-			if len(parts) < 4:
-				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(line_no, line))
-				return None
-
-			MOL['bond_from'].append(int(parts[1]) - 1)
-			MOL['bond_to'].append(int(parts[2]) - 1)
-			MOL['bond_type'].append(parts[3])
-
-			if len(parts) > 4:
-				MOL['bond_status_bit'].append(parts[4])
-
 		elif section == 'SUBSTRUCTURE':
 			parts = line.split()
 
 			if len(parts) < 3:
-				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(line_no, line))
+				print('-- Error: Invalid MOL2 [line %d]:\n%s' %(lines.line_no, line))
 				return None
 
 			MOL['residue_name'].append(parts[1])
@@ -216,13 +458,187 @@ def read(mol2_file):
 	if not check_last_section(section, MOL):
 		return False
 
-	print('Done.')
+	if stage is not None:
+		stage.done(len(MOL[section_fields[section]]) if section in section_fields else 0)
+
+	return MOL
+
+
+def read(mol2_file):
+	""" Read a TRIPOS MOL2 file and store as OpenMOL object.
+		All indices are decremented to use 0 base indexing. """
+
+	with open(mol2_file, 'r') as fp:
+		MOL = read_molecule(LineReader(fp))
+
+	if MOL:
+		openmol.info('Done.')
+
+	return MOL
+
+
+def molecules(mol2_file):
+	""" Iterate over the molecules of a multi molecule MOL2 file,
+		e.g. a ligand library, yielding an OpenMOL object for each
+		MOLECULE section. The file is read in chunks, so only one
+		molecule is kept in memory at a time. None is yielded for an
+		invalid molecule and reading continues with the next one. """
+
+	with open(mol2_file, 'r') as fp:
+		lines = LineReader(fp)
+
+		while not lines.at_end():
+			MOL = read_molecule(lines, split=True)
+
+			if not MOL:
+				skip_molecule(lines)
+				MOL = None
+
+			yield MOL
+
+
+def skip_molecule(lines):
+	""" Skip the rest of an invalid molecule, up to the next
+		MOLECULE section. """
+
+	while True:
+		raw = lines.readline()
+		if raw is None:
+			return
+
+		line = raw.strip()
+		if line.startswith('@<') and section_name(line) == 'MOLECULE':
+			lines.unread(raw)
+			return
+
+def index_mol2(mol2_file, index_file=None):
+	""" Record the byte offset, first line number and title of each
+		MOLECULE section of a MOL2 file, without parsing anything.
+		The first molecule also gets any lines before its section,
+		entries maps the titles to their offsets in the lists.
+		Saved as JSON if an index_file is given. """
+
+	index = {'titles': [], 'offsets': [], 'lines': []}
+
+	with open(mol2_file, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		pos = 0
+		counted = 0
+		line_no = 1
+
+		while True:
+			at = mm.find(b'>MOLECULE', pos)
+			if at < 0:
+				break
+			pos = at + 1
+
+			start = mm.rfind(b'\n', 0, at) + 1
+			end = mm.find(b'\n', at)
+			if end < 0:
+				end = len(mm)
+
+			line = mm[start:end].decode('utf-8', 'replace').strip()
+			if not line.startswith('@<') or section_name(line) != 'MOLECULE':
+				continue
+
+			line_no += mm[counted:start].count(b'\n')
+			counted = start
+
+			# title is the next line
+			title_end = mm.find(b'\n', end + 1)
+			if title_end < 0:
+				title_end = len(mm)
+
+			index['titles'].append(mm[end + 1:title_end].decode('utf-8', 'replace').strip())
+			index['offsets'].append(start)
+			index['lines'].append(line_no)
+
+		if index['offsets']:
+			index['offsets'][0] = 0
+			index['lines'][0] = 1
+
+		# end of the last molecule
+		index['offsets'].append(len(mm))
+
+	# ordinal of each title, the first one if repeated
+	index['entries'] = title_entries(index['titles'])
+
+	index['signature'] = openmol.file_signature(mol2_file)
+
+	if index_file:
+		openmol.write_index(index, mol2_file, index_file)
+
+	return index
+
+
+def title_entries(titles):
+	""" Ordinal of the first molecule of each title """
+	entries = {}
+	for i, title in enumerate(titles):
+		entries.setdefault(title, i)
+	return entries
+
+
+def read_entry(mol2_file, entry, index=None, index_file=None):
+	""" Seek to a single molecule of a MOL2 library and read only
+		that one. entry is either the 0 based ordinal or the title
+		of the molecule. The index is reused if given or saved,
+		otherwise the file is indexed first. A stale index, i.e. one
+		made before the file was last modified, is refused. """
+
+	if index is None:
+		if index_file:
+			index = openmol.load_index(mol2_file, index_file)
+
+		if index is None:
+			index = index_mol2(mol2_file, index_file)
+
+	elif index.get('signature') != openmol.file_signature(mol2_file):
+		print('-- Error: %s was modified after indexing, refusing the stale index.' %mol2_file)
+		return None
+
+	if isinstance(entry, str):
+		# indexes saved before the entries were added
+		if 'entries' not in index:
+			index['entries'] = title_entries(index['titles'])
+
+		if entry not in index['entries']:
+			print('-- Error: No molecule titled %s in %s' %(entry, mol2_file))
+			return None
+		entry = index['entries'][entry]
+
+	no_molecules = len(index['titles'])
+	if not -no_molecules <= entry < no_molecules:
+		print('-- Error: Molecule %d out of range, %s has %d molecules.' %(entry, mol2_file, no_molecules))
+		return None
+
+	entry %= no_molecules
+	start, end = index['offsets'][entry], index['offsets'][entry + 1]
+
+	with open(mol2_file, 'rb') as fp:
+		fp.seek(start)
+		data = fp.read(end - start)
+
+	lines = LineReader(io.TextIOWrapper(io.BytesIO(data)))
+	lines.line_no = index['lines'][entry] - 1
+
+	MOL = read_molecule(lines, split=True)
+
+	if MOL:
+		openmol.info('Done.')
+
 	return MOL
 
-def build(MOL):
+
+def build(MOL, perceive=False):
 	""" Go through the openmol object and see if MOL2
 		specific items are properly calculated.
-		If not, attemt to determine/guess them. """
+		If not, attemt to determine/guess them.
+
+		With perceive=True, the bonds of a MOL without any are
+		perceived from the coordinates, see topology.perceive_bonds().
+		A BOND section that is present but incomplete is kept as is. """
+
+	stage = openmol.Stage('build', 'tripos_mol2')
 
 	# add/update with default mol2 items
 	MOL = dict(initialize(), **MOL)
@@ -268,6 +684,17 @@ def build(MOL):
 				id_num += 1
 			MOL['atom_resid'][i] = id_num
 
+	# BOND section missing, find the bonds from the coordinates if asked
+	if len(MOL['bond_from']) == 0 and len(MOL['atom_name']) > 1:
+		if perceive:
+			print("-- Warning: bond info missing. Perceiving bonds from coordinates.\n")
+			bonded = topology.perceive_bonds(MOL)
+			if bonded:
+				for key in ['bond_from', 'bond_to', 'bond_type', 'no_bonds']:
+					MOL[key] = bonded[key]
+		else:
+			print("-- Warning: bond info missing. Use build(MOL, perceive=True) to perceive bonds.\n")
+
 	# if no type set, use single bond
 	if len(MOL['bond_type']) == 0:
 		print("-- Warning: bond type info missing. Assuming single bonds.\n")
@@ -307,6 +734,8 @@ def build(MOL):
 			MOL['residue_type'].append("RESIDUE")
 
 	MOL['_mol2_built'] = True
+	stage.done(MOL['no_atoms'])
+
 	return openmol.AttrDict(MOL)
 
 
@@ -380,10 +809,17 @@ class Writer(openmol.Writer):
 		if not self.MOL.get('_mol2_built', False):
 			print('-- Warning: call tripos_mol2.build(MOL) before writing. Continuing anyway ...')
 
-		self.molecule()
-		self.atoms()
-		self.bonds()
-		self.substructures()
+		with self.section('MOLECULE', 1):
+			self.molecule()
+
+		with self.section('ATOM', self.MOL['no_atoms']):
+			self.atoms()
+
+		with self.section('BOND', self.MOL['no_bonds']):
+			self.bonds()
+
+		with self.section('SUBSTRUCTURE', self.MOL['no_residues']):
+			self.substructures()
 
 		# close the file
 		super(Writer, self).write()